@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+'''measures the round trip of one eval at a time to a stand-in nrepl in
+this process, over tcp on localhost, a unix domain socket and in-process
+channels, and reports the latency percentiles of each'''
+
+import argparse, os, shutil, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# the stand-in nrepl lives with the tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test')))
+
+from pyjurer.session_container import create_bcode_session_container, stop_bcode_session_container
+from standin_server import StandinNrepl
+
+def percentile(ordered, p):
+	return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def round_trips(uri, requests):
+	'''returns the sorted latencies of requests evals sent one after the other'''
+
+	container = create_bcode_session_container(uri)
+	try:
+		ready = threading.Event()
+		sessions = []
+		container.create_new_session(lambda s: (sessions.append(s), ready.set()))
+		ready.wait()
+		session = sessions[0]
+
+		latencies = []
+		done = threading.Event()
+		for i in range(requests):
+			done.clear()
+			started = time.time()
+			session.eval('(+ 1 2)', done=lambda s, id_: done.set())
+			done.wait()
+			latencies.append(time.time() - started)
+		return sorted(latencies)
+	finally:
+		stop_bcode_session_container(container)
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Round-trip latency over each kind of channel")
+	cliParser.add_argument("-r", "--requests", type=int, help="The evals per channel. Default = 5000", default=5000)
+	args = cliParser.parse_args()
+
+	directory = tempfile.mkdtemp()
+	path = os.path.join(directory, 'nrepl.sock')
+	servers = [StandinNrepl().listen_inproc('bench').start(), StandinNrepl(path=path).start()]
+	try:
+		for name, uri in (('tcp', 'tcp://{0}:{1}'.format(*servers[0].address)),
+			('unix', 'unix://' + path), ('inproc', 'inproc://bench')):
+			# a short warm up, so the first connection's costs are not measured
+			round_trips(uri, 100)
+			latencies = round_trips(uri, args.requests)
+			print "{0:>6}: p50 {1:.1f} us, p99 {2:.1f} us, {3:.0f} round trips/s".format(name,
+				percentile(latencies, 0.5) * 1e6, percentile(latencies, 0.99) * 1e6,
+				len(latencies) / sum(latencies))
+	finally:
+		for server in servers:
+			server.stop()
+		shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+'''measures how many decoded responses per second a session dispatches to
+the callbacks of eval requests, without a transport or a nrepl'''
+
+import argparse, itertools, os, sys, time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyjurer.nrepl_session import NREPLSession
+
+SESSION = 'a8f2b0c4-1c1e-4f0e-9d63-2b0e3b1b7c55'
+
+class NullChannel(object):
+	def _submit(self, data):
+		pass
+
+def responses(ids, outs):
+	'''every eval answers with outs lines of out, a value and done'''
+
+	messages = []
+	for id_ in ids:
+		for i in range(outs):
+			messages.append({'id': id_, 'session': SESSION, 'out': 'line {0}\n'.format(i)})
+		messages.append({'id': id_, 'session': SESSION, 'ns': 'user', 'value': '42'})
+		messages.append({'id': id_, 'session': SESSION, 'status': ['done']})
+	return messages
+
+def measure(requests, outs):
+	session = NREPLSession(NullChannel(), SESSION, (str(i) for i in itertools.count(1)))
+	count = [0]
+	def callback(*args):
+		count[0] += 1
+
+	ids = [session.eval('(+ 1 2)', value=callback, stdout=callback, stderr=callback,
+		done=callback, error=callback) for i in range(requests)]
+	messages = responses(ids, outs)
+
+	receive = session._receive_results
+	started = time.time()
+	for message in messages:
+		receive(message)
+	elapsed = time.time() - started
+	assert count[0] == requests * (outs + 2)
+	return len(messages) / elapsed
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Dispatch throughput of decoded responses")
+	cliParser.add_argument("-n", "--requests", type=int, help="The evals per run. Default = 20000", default=20000)
+	cliParser.add_argument("-o", "--outs", type=int, help="The out messages per eval. Default = 3", default=3)
+	cliParser.add_argument("-r", "--runs", type=int, help="The runs. Default = 3", default=3)
+	args = cliParser.parse_args()
+
+	best = max(measure(args.requests, args.outs) for i in range(args.runs))
+	print "{0:.0f} messages/s".format(best)
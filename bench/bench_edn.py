@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+'''reads printed clojure collections of a few MB with edn.loads, as eval
+values decoded with decode=True are, and the same data printed as json with
+json.loads for reference: a vector of records, a map of vectors of numbers
+and a set of strings'''
+
+import argparse, gc, json, os, sys, time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyjurer import edn
+
+def records(count):
+	return [{'id': i, 'name': 'user-{0}'.format(i), 'score': i * 0.5, 'active': i % 2 == 0,
+		'tags': ['a', 'b', 'c'], 'parent': None} for i in range(count)]
+
+def series(count):
+	return dict(('series-{0}'.format(i), range(i, i + 100)) for i in range(count // 10))
+
+def strings(count):
+	return set('string number {0} with "quotes"'.format(i) for i in range(count))
+
+def printed(value, keywords):
+	'''prints value the way clojure does, with the keys of records as keywords'''
+
+	if value is None:
+		return 'nil'
+	if value is True:
+		return 'true'
+	if value is False:
+		return 'false'
+	if isinstance(value, str):
+		return json.dumps(value)
+	if isinstance(value, (int, float)):
+		return repr(value)
+	if isinstance(value, list):
+		return '[' + ' '.join(printed(v, keywords) for v in value) + ']'
+	if isinstance(value, set):
+		return '#{' + ' '.join(printed(v, keywords) for v in value) + '}'
+	return '{' + ', '.join('{0} {1}'.format(':' + k if keywords else printed(k, keywords),
+		printed(v, keywords)) for k, v in value.iteritems()) + '}'
+
+def measure(read, text, runs):
+	best = None
+	for i in range(runs):
+		gc.collect()
+		started = time.clock()
+		read(text)
+		seconds = time.clock() - started
+		best = seconds if best is None else min(best, seconds)
+	return best
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Reading MB-scale printed values")
+	cliParser.add_argument("-c", "--count", type=int, help="The elements per collection. Default = 50000", default=50000)
+	cliParser.add_argument("-r", "--runs", type=int, help="The runs. Default = 3", default=3)
+	args = cliParser.parse_args()
+
+	for name, make, keywords in (('records', records, True), ('series', series, False), ('strings', strings, False)):
+		value = make(args.count)
+		text = printed(value, keywords)
+		asJson = json.dumps(list(value) if isinstance(value, set) else value)
+		seconds = measure(edn.loads, text, args.runs)
+		jsonSeconds = measure(json.loads, asJson, args.runs)
+		print "{0:>8}: {1:.1f} MB edn in {2:.3f}s, {3:.1f} MB/s; {4:.1f} MB json in {5:.3f}s".format(
+			name, len(text) / 1e6, seconds, len(text) / 1e6 / seconds, len(asJson) / 1e6, jsonSeconds)
@@ -0,0 +1,35 @@
+#! /usr/bin/env python
+'''measures how many one-line eval requests per second the bencode transport
+can encode, with the request templates and with plain bcode.bencode'''
+
+import argparse, itertools, os, sys, time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyjurer.transports import bcode
+from pyjurer.transports.bcode_templates import RequestTemplates
+
+SESSION = 'a8f2b0c4-1c1e-4f0e-9d63-2b0e3b1b7c55'
+
+def requests(n):
+	ids = itertools.count(1)
+	return [{'op': 'eval', 'session': SESSION, 'id': str(ids.next()), 'code': '(+ 1 {0})'.format(i)}
+		for i in range(n)]
+
+def measure(encode, batch):
+	started = time.time()
+	for request in batch:
+		encode(request)
+	return len(batch) / (time.time() - started)
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Encoding throughput of one-line eval requests")
+	cliParser.add_argument("-n", "--requests", type=int, help="The requests per run. Default = 200000", default=200000)
+	cliParser.add_argument("-r", "--runs", type=int, help="The runs per encoder. Default = 3", default=3)
+	args = cliParser.parse_args()
+
+	batch = requests(args.requests)
+	templates = RequestTemplates()
+	for name, encode in (('bencode', bcode.bencode), ('templates', templates.encode)):
+		best = max(measure(encode, batch) for i in range(args.runs))
+		print "{0:>9}: {1:.0f} requests/s".format(name, best)
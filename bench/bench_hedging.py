@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+'''evals on sessions spread over stand-in nrepls whose evals now and then
+stall, like a jvm in a gc pause, without and with hedging, and reports the
+p50 and p99 of the eval latency, the hedge rate and the p99 of the evals
+that HedgedEvaluator kept unhedged as its baseline'''
+
+import argparse, os, sys, threading, time, Queue
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# the stand-in nrepl lives with the tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test')))
+
+from pyjurer.hedging import HedgedEvaluator, percentile
+from pyjurer.session_container import create_bcode_session_container, stop_bcode_session_container
+from standin_server import StandinNrepl
+
+def run(evaluator, evals, concurrency, idempotent):
+	'''evals from concurrency threads, returns the latencies in seconds'''
+
+	latencies = []
+	lock = threading.Lock()
+
+	def worker(count):
+		done = Queue.Queue()
+		for i in range(count):
+			started = time.time()
+			evaluator.eval('(+ 1 2)', idempotent=idempotent, done=lambda s, id_: done.put(None))
+			done.get(True, 30)
+			with lock:
+				latencies.append(time.time() - started)
+
+	threads = [threading.Thread(target=worker, args=(evals // concurrency,)) for i in range(concurrency)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return latencies
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Tail latency with and without hedging")
+	cliParser.add_argument("-n", "--evals", type=int, help="The evals per mode. Default = 2000", default=2000)
+	cliParser.add_argument("-c", "--concurrency", type=int, help="The threads evaluating. Default = 4", default=4)
+	cliParser.add_argument("-s", "--servers", type=int, help="The stand-in nrepls. Default = 2", default=2)
+	cliParser.add_argument("--latency", type=float, help="Seconds every eval takes. Default = 0.002", default=0.002)
+	cliParser.add_argument("--stall-rate", type=float, help="The share of evals that stall. Default = 0.02", default=0.02)
+	cliParser.add_argument("--stall", type=float, help="Seconds a stall takes. Default = 0.1", default=0.1)
+	args = cliParser.parse_args()
+
+	servers = [StandinNrepl(latency=args.latency, stall_rate=args.stall_rate, stall=args.stall).start()
+		for i in range(args.servers)]
+	containers = [create_bcode_session_container('tcp://{0}:{1}'.format(*s.address)) for s in servers]
+	try:
+		created = Queue.Queue()
+		# a session per thread and server, so evals only queue behind a stall on their own session
+		for i in range(args.concurrency):
+			for container in containers:
+				container.create_new_session(created.put)
+		sessions = [created.get(True, 5) for i in range(args.concurrency * len(containers))]
+
+		for idempotent in (False, True):
+			evaluator = HedgedEvaluator(sessions)
+			latencies = run(evaluator, args.evals, args.concurrency, idempotent)
+			print "{0:>10}: p50 {1:.1f} ms, p99 {2:.1f} ms, max {3:.1f} ms".format(
+				'hedged' if idempotent else 'unhedged', percentile(latencies, 50) * 1000,
+				percentile(latencies, 99) * 1000, max(latencies) * 1000)
+			if idempotent:
+				metrics = evaluator.metrics()
+				print "            hedge rate {0:.1%}, {1} hedges won, delay {2:.1f} ms, baseline p99 {3}".format(
+					metrics['hedge_rate'], metrics['hedge_wins'], metrics['delay'] * 1000,
+					'n/a' if metrics['baseline_p99'] is None else '{0:.1f} ms'.format(metrics['baseline_p99'] * 1000))
+	finally:
+		for container in containers:
+			stop_bcode_session_container(container)
+		for server in servers:
+			server.stop()
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+'''measures the bencode transport and a session decoding and dispatching
+responses that carry large fields no callback reads, with and without lazy
+decoding: describes of a nrepl with many ops whose docs only describe's
+callback skips, and evals whose responses come with a large map of
+changed namespaces next to the value'''
+
+import argparse, gc, itertools, os, sys, time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyjurer.nrepl_session import NREPLSession
+from pyjurer.transports import bcode
+from pyjurer.transports.bcode_transport import BCodeTransport
+
+SESSION = 'a8f2b0c4-1c1e-4f0e-9d63-2b0e3b1b7c55'
+
+class NullChannel(object):
+	def _submit(self, data):
+		pass
+
+def describe_ops(count):
+	return dict(('op-{0}'.format(i), {
+		'doc': 'does operation {0}. '.format(i) * 20,
+		'requires': {'session': 'The session', 'code': 'The code'},
+		'optional': {'ns': 'The namespace', 'line': 'The line'},
+		'returns': {'value': 'The value', 'status': 'done'}})
+		for i in range(count))
+
+def changed_namespaces(count):
+	return dict(('app.ns-{0}'.format(i), {
+		'aliases': {'str': 'clojure.string', 'io': 'clojure.java.io'},
+		'interns': dict(('fn-{0}'.format(j), {'arglists': '([x])'}) for j in range(10))})
+		for i in range(count))
+
+def stream(kind, requests, size):
+	'''returns the ids and the encoded responses'''
+
+	ids = [str(i) for i in range(1, requests + 1)]
+	frames = []
+	if kind == 'describe':
+		ops = describe_ops(size)
+		for id_ in ids:
+			frames.append(bcode.bencode({'id': id_, 'session': SESSION, 'ops': ops,
+				'versions': {'nrepl': {'major': 1}}}))
+			frames.append(bcode.bencode({'id': id_, 'session': SESSION, 'status': ['done']}))
+	else:
+		changed = changed_namespaces(size)
+		for id_ in ids:
+			frames.append(bcode.bencode({'id': id_, 'session': SESSION, 'ns': 'user', 'value': '42',
+				'changed-namespaces': changed}))
+			frames.append(bcode.bencode({'id': id_, 'session': SESSION, 'status': ['done']}))
+	return ''.join(frames)
+
+def measure(kind, requests, size, lazy):
+	'''returns the cpu seconds and the objects left for the collector to track'''
+
+	session = NREPLSession(NullChannel(), SESSION, (str(i) for i in itertools.count(1)))
+	transport = BCodeTransport(None, session._receive_results, lazy=lazy)
+	for i in range(requests):
+		if kind == 'describe':
+			session.describe(lambda s, result: None)
+		else:
+			session.eval('(+ 1 2)', value=lambda s, id_, v: None)
+
+	data = stream(kind, requests, size)
+	gc.collect()
+	started = time.clock()
+	for i in range(0, len(data), 65536):
+		transport.receive(data[i:i + 65536])
+	return time.clock() - started, len(data)
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Decoding responses with unread fields, eagerly and lazily")
+	cliParser.add_argument("-n", "--requests", type=int, help="The requests per run. Default = 200", default=200)
+	cliParser.add_argument("-s", "--size", type=int, help="The ops or namespaces per response. Default = 200", default=200)
+	cliParser.add_argument("-r", "--runs", type=int, help="The runs. Default = 3", default=3)
+	args = cliParser.parse_args()
+
+	for kind in ('describe', 'eval'):
+		for lazy in (False, True):
+			seconds, size = min(measure(kind, args.requests, args.size, lazy) for i in range(args.runs))
+			print "{0:>8} {1:>5}: {2:.1f} MB in {3:.3f}s cpu, {4:.0f} responses/s".format(kind,
+				'lazy' if lazy else 'eager', size / 1e6, seconds, args.requests / seconds)
@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+'''end-to-end load generator: runs sessions x concurrency evals in flight
+through create_bcode_over_tcp_session_container against a nrepl, by default
+a stand-in started in a separate process, and reports the throughput, the
+latency percentiles and the cpu and memory the client used.
+
+every session keeps its share of requests in flight: each time one is done
+the next one is submitted, until the total is reached.'''
+
+import argparse, os, resource, subprocess, sys, threading, time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from pyjurer.session_container import create_bcode_over_tcp_session_container, stop_bcode_over_tcp_session_container
+
+def start_standin(args):
+	'''starts the stand-in nrepl in a process of its own and returns it and its port'''
+
+	command = [sys.executable, os.path.join(ROOT, 'test', 'standin_server.py'),
+		'--latency', str(args.latency), '--out-chunks', str(args.out_chunks)]
+	if not args.value_size is None:
+		command += ['--value-size', str(args.value_size)]
+	if not args.fragment is None:
+		command += ['--fragment', str(args.fragment)]
+	process = subprocess.Popen(command, stdout=subprocess.PIPE, env=dict(os.environ, PYTHONPATH=ROOT))
+	port = int(process.stdout.readline())
+	return process, port
+
+def percentile(ordered, p):
+	return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+class LoadRun(object):
+	'''drives the evals of one session'''
+
+	def __init__(self, session, requests, concurrency, latencies, finished):
+		self._session = session
+		self._remaining = requests
+		self._lock = threading.Lock()
+		self._latencies = latencies
+		self._finished = finished
+		self._concurrency = concurrency
+
+	def start(self):
+		for i in range(self._concurrency):
+			self._next()
+
+	def _next(self):
+		with self._lock:
+			if self._remaining == 0:
+				return
+			self._remaining -= 1
+		started = time.time()
+		def done(s, id_):
+			self._latencies.append(time.time() - started)
+			self._finished.release()
+			self._next()
+		self._session.eval('(+ 1 2)', done=done)
+
+def run(host, port, connections, sessions, concurrency, requests):
+	'''returns the sorted latencies and the elapsed seconds'''
+
+	containers = [create_bcode_over_tcp_session_container(host, port) for i in range(connections)]
+
+	created = []
+	ready = threading.Semaphore(0)
+	def new_session(s):
+		created.append(s)
+		ready.release()
+	for container in containers:
+		for i in range(sessions):
+			container.create_new_session(new_session)
+	for i in range(connections * sessions):
+		ready.acquire()
+
+	perSession = requests // len(created)
+	latencies = []
+	finished = threading.Semaphore(0)
+	runs = [LoadRun(s, perSession, concurrency, latencies, finished) for s in created]
+
+	started = time.time()
+	for r in runs:
+		r.start()
+	for i in range(perSession * len(created)):
+		finished.acquire()
+	elapsed = time.time() - started
+
+	for container in containers:
+		stop_bcode_over_tcp_session_container(container)
+	return sorted(latencies), elapsed
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="End-to-end load generator for the client")
+	cliParser.add_argument("-n", "--hostname", help="The nrepl's host. Default = 'localhost'", default="localhost")
+	cliParser.add_argument("-p", "--port", type=int, help="The nrepl's port. Without it a stand-in nrepl is started", default=None)
+	cliParser.add_argument("-c", "--connections", type=int, help="The number of connections. Default = 1", default=1)
+	cliParser.add_argument("-s", "--sessions", type=int, help="The sessions per connection. Default = 4", default=4)
+	cliParser.add_argument("-m", "--concurrency", type=int, help="The requests in flight per session. Default = 16", default=16)
+	cliParser.add_argument("-r", "--requests", type=int, help="The total number of requests. Default = 20000", default=20000)
+	cliParser.add_argument("--value-size", type=int, help="stand-in: the size of every value", default=None)
+	cliParser.add_argument("--out-chunks", type=int, help="stand-in: the out messages per eval", default=0)
+	cliParser.add_argument("--latency", type=float, help="stand-in: seconds every eval takes", default=0.0)
+	cliParser.add_argument("--fragment", type=int, help="stand-in: maximum bytes per socket write", default=None)
+	args = cliParser.parse_args()
+
+	standin = None
+	port = args.port
+	if port is None:
+		standin, port = start_standin(args)
+
+	try:
+		before = resource.getrusage(resource.RUSAGE_SELF)
+		latencies, elapsed = run(args.hostname, port, args.connections, args.sessions, args.concurrency, args.requests)
+		after = resource.getrusage(resource.RUSAGE_SELF)
+	finally:
+		if not standin is None:
+			standin.kill()
+
+	cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+	print "{0} requests over {1} connection(s) x {2} session(s) x {3} in flight in {4:.2f}s".format(
+		len(latencies), args.connections, args.sessions, args.concurrency, elapsed)
+	print "throughput: {0:.0f} requests/s".format(len(latencies) / elapsed)
+	print "latency:    p50 {0:.2f} ms, p99 {1:.2f} ms, p999 {2:.2f} ms".format(
+		percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, percentile(latencies, 0.999) * 1000)
+	print "client:     {0:.2f}s cpu ({1:.0f}% of one core), max rss {2:.1f} MB".format(
+		cpu, cpu / elapsed * 100, after.ru_maxrss / 1024.0)
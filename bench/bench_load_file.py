@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+'''compares load_file, which takes the file's contents as a string, with
+load_file_path, which streams a memory-mapped file to the socket, on a large
+generated file. every run is a fresh process loading the file into a
+stand-in nrepl running in another process, and reports the time until the
+nrepl answered and the peak rss of the client'''
+
+import argparse, os, subprocess, sys, tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from bench_load import start_standin
+
+CHILD = '''
+import resource, threading, time
+from pyjurer.session_container import create_bcode_over_tcp_session_container, stop_bcode_over_tcp_session_container
+
+container = create_bcode_over_tcp_session_container('localhost', %(port)d)
+ready = threading.Event()
+def new_session(s):
+	new_session.session = s
+	ready.set()
+container.create_new_session(new_session)
+ready.wait()
+session = new_session.session
+
+done = threading.Event()
+started = time.time()
+if %(mode)r == 'string':
+	with open(%(path)r) as f:
+		session.load_file(f.read(), fileName='big.clj', done=lambda s, id_: done.set())
+else:
+	session.load_file_path(%(path)r, done=lambda s, id_: done.set())
+done.wait()
+elapsed = time.time() - started
+print elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+stop_bcode_over_tcp_session_container(container)
+'''
+
+def generate(path, size):
+	line = '(def x "' + 'y' * 100 + '")\n'
+	with open(path, 'w') as f:
+		for i in range(size // len(line)):
+			f.write(line)
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Benchmarks loading a large file with load_file and load_file_path")
+	cliParser.add_argument("-s", "--size", type=int, help="The size of the file in MB. Default = 100", default=100)
+	cliParser.add_argument("-r", "--runs", type=int, help="The runs per mode. Default = 3", default=3)
+	args = cliParser.parse_args()
+
+	fd, path = tempfile.mkstemp(suffix='.clj')
+	os.close(fd)
+	generate(path, args.size * 1024 * 1024)
+
+	class StandinArgs(object):
+		latency = 0.0
+		out_chunks = 0
+		value_size = None
+		fragment = None
+	standin, port = start_standin(StandinArgs())
+
+	env = dict(os.environ)
+	env['PYTHONPATH'] = ROOT
+	try:
+		for mode in ('string', 'mmap'):
+			for i in range(args.runs):
+				output = subprocess.check_output([sys.executable, '-c',
+					CHILD % {'port': port, 'mode': mode, 'path': path}], env=env)
+				elapsed, rss = output.split()
+				print "{0:>6}: {1:.2f}s, peak rss {2:.0f} MB".format(mode, float(elapsed), int(rss) / 1024.0)
+	finally:
+		standin.kill()
+		os.remove(path)
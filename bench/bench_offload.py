@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+'''measures how long the other threads of the process are stalled while a
+large, token heavy frame, shaped like the describe of a nrepl with many
+middleware, is decoded inline and in a worker process. a ticker thread
+sleeps for a millisecond at a time and records the longest gap it sees.
+
+a full collection of the cyclic garbage collector walks every dict of the
+decoded value with the GIL held, which stalls the other threads however the
+value was decoded. the time one takes with the value alive is reported as
+well, and --no-gc leaves the collector out of the measurement'''
+
+import argparse, gc, os, resource, sys, threading, time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyjurer.transports import bcode
+from pyjurer.transports.async_bcode_deserialiser import AsyncBCodeDeserialiser
+from pyjurer.transports.offload import OffloadDecoder, OFFLOAD_THRESHOLD
+
+CHUNK = 65536
+
+class Ticker(object):
+	def __init__(self):
+		self.worst = 0.0
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+
+	def _run(self):
+		last = time.time()
+		while not self._stop.is_set():
+			time.sleep(0.001)
+			now = time.time()
+			self.worst = max(self.worst, now - last)
+			last = now
+
+	def __enter__(self):
+		self._thread.start()
+		return self
+
+	def __exit__(self, *args):
+		self._stop.set()
+		self._thread.join()
+
+def decode(frame, offload):
+	'''returns the seconds until the frame was delivered, the worst stall,
+	the cpu seconds this process spent and the seconds a full collection
+	takes with the value alive'''
+
+	delivered = threading.Event()
+	received = []
+	deserialiser = AsyncBCodeDeserialiser(offload)
+	# the value is kept until the ticker stops, freeing it is not decoding it
+	deserialiser.register_cb(lambda data: (received.append(data), delivered.set()))
+
+	with Ticker() as ticker:
+		before = resource.getrusage(resource.RUSAGE_SELF)
+		started = time.time()
+		for i in range(0, len(frame), CHUNK):
+			deserialiser.push_data(frame[i:i + CHUNK])
+		delivered.wait()
+		elapsed = time.time() - started
+		after = resource.getrusage(resource.RUSAGE_SELF)
+	cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+	started = time.time()
+	gc.collect()
+	return elapsed, ticker.worst, cpu, time.time() - started
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Thread stalls while decoding a large frame")
+	cliParser.add_argument("-o", "--ops", type=int, help="The ops in the describe-like frame. Default = 100000", default=100000)
+	cliParser.add_argument("-v", "--value-size", type=int, help="The size of the value frame. Default = 200000000", default=200000000)
+	cliParser.add_argument("--no-gc", action='store_true', help="Disable the garbage collector while measuring")
+	args = cliParser.parse_args()
+
+	frames = [
+		('describe', bcode.bencode({'id': '1', 'session': 's', 'status': ['done'],
+			'ops': dict(('op-{0}'.format(i), {'doc': 'x' * 50, 'requires': {'session': 'the session'}})
+				for i in range(args.ops))})),
+		('value', bcode.bencode({'id': '1', 'session': 's', 'ns': 'user', 'value': 'x' * args.value_size}))]
+
+	offload = OffloadDecoder()
+	try:
+		# warms the worker up, so its first task is not measured
+		decode(bcode.bencode(range(OFFLOAD_THRESHOLD)), offload)
+		if args.no_gc:
+			gc.disable()
+		for kind, frame in frames:
+			for name, o in (('inline', None), ('offloaded', offload)):
+				elapsed, worst, cpu, collection = decode(frame, o)
+				print "{0:>8} {1:>9}: {2:.1f} MB frame delivered in {3:.2f}s, {4:.2f}s cpu, worst stall of other threads {5:.0f} ms, full gc {6:.0f} ms".format(
+					kind, name, len(frame) / 1e6, elapsed, cpu, worst * 1000, collection * 1000)
+	finally:
+		offload.close()
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+'''opens a growing number of connections to a stand-in nrepl in another
+process, with threads of their own and served by one reactor, and reports
+the threads and the resident memory of this process at every step and the
+time a round of one eval on every connection takes'''
+
+import argparse, os, subprocess, sys, threading, time, Queue
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from pyjurer.channels.reactor import Reactor
+from pyjurer.session_container import create_bcode_over_tcp_session_container, stop_bcode_session_container
+
+def resident_kb():
+	with open('/proc/self/status') as f:
+		for line in f:
+			if line.startswith('VmRSS:'):
+				return int(line.split()[1])
+	return 0
+
+def eval_round(sessions):
+	'''evals on every session at once, returns the seconds until all are done'''
+
+	done = Queue.Queue()
+	started = time.time()
+	for session in sessions:
+		session.eval('(+ 1 2)', done=lambda s, id_: done.put(None))
+	for session in sessions:
+		done.get(True, 30)
+	return time.time() - started
+
+def measure(port, steps, reactor):
+	containers = []
+	sessions = []
+	created = Queue.Queue()
+	try:
+		for count in steps:
+			while len(containers) < count:
+				options = {} if reactor is None else {'reactor': reactor}
+				container = create_bcode_over_tcp_session_container('127.0.0.1', port, **options)
+				containers.append(container)
+				container.create_new_session(created.put)
+				sessions.append(created.get(True, 30))
+			seconds = min(eval_round(sessions) for i in range(3))
+			print "{0:>6} connections: {1:>5} threads, {2:>7} kB resident, {3:.1f} ms a round".format(
+				count, threading.active_count(), resident_kb(), seconds * 1000)
+	finally:
+		for container in containers:
+			stop_bcode_session_container(container)
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Threads and memory as the number of connections grows")
+	cliParser.add_argument("-s", "--steps", type=int, nargs='+', help="The connection counts. Default = 10 100 500", default=[10, 100, 500])
+	cliParser.add_argument("-m", "--mode", choices=['threads', 'reactor', 'both'], help="Default = both", default='both')
+	args = cliParser.parse_args()
+
+	server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'test', 'standin_server.py')],
+		stdout=subprocess.PIPE, env=dict(os.environ, PYTHONPATH=ROOT))
+	try:
+		port = int(server.stdout.readline())
+		if args.mode in ('threads', 'both'):
+			print 'threads of their own'
+			measure(port, args.steps, None)
+		if args.mode in ('reactor', 'both'):
+			print 'one reactor'
+			reactor = Reactor()
+			measure(port, args.steps, reactor)
+			reactor.close()
+	finally:
+		server.terminate()
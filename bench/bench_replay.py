@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+'''replays the server side of a recording, see pyjurer/channels/recording.py,
+through the bencode transport and a session container as fast as possible,
+to benchmark the decode-and-dispatch path without a nrepl.
+
+every request in the recording gets callbacks registered on the container
+first, so the responses are routed exactly as they were when recorded.'''
+
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyjurer.channels.recording import ReplayChannel, read_recording, SENT, RECEIVED
+from pyjurer.nrepl_session import NREPLSession
+from pyjurer.session_container import SessionContainer
+from pyjurer.transports.async_bcode_deserialiser import AsyncBCodeDeserialiser
+from pyjurer.transports.bcode_transport import BCodeTransport
+
+def decode_recording(path):
+	'''returns the lists of requests and responses in the recording'''
+
+	decoded = {SENT: [], RECEIVED: []}
+	deserialisers = {}
+	for direction in decoded:
+		deserialisers[direction] = AsyncBCodeDeserialiser()
+		deserialisers[direction].register_cb(decoded[direction].append)
+
+	for direction, seconds, chunk in read_recording(path):
+		deserialisers[direction].push_data(chunk)
+
+	return decoded[SENT], decoded[RECEIVED]
+
+def prepare(path, dispatched):
+	'''returns a replay channel wired up to a container that expects every
+	response in the recording at path'''
+
+	requests, responses = decode_recording(path)
+
+	clonedAs = dict((r['id'], r['new-session']) for r in responses if 'new-session' in r)
+
+	def count(*args):
+		dispatched[0] += 1
+
+	def register(session, request):
+		session._callbacks.register({'id': request['id'],
+			'value': count, 'out': count, 'err': count, 'status': {}})
+
+	bySession = {}
+	for request in requests:
+		if 'session' in request:
+			bySession.setdefault(request['session'], []).append(request)
+
+	replay = ReplayChannel(path, realtime=False)
+	bcode = BCodeTransport(replay.send)
+	replay.add_callback(bcode.receive)
+	container = SessionContainer(bcode.send)
+	bcode.add_callback(container._accept_data)
+
+	# the sessions cloned during the recording are created by the replay,
+	# the ones that already existed have to be made up front
+	cloned = set(clonedAs.values())
+	for sessionId, sessionRequests in bySession.items():
+		if sessionId in cloned:
+			continue
+		session = NREPLSession(container, sessionId, container._idGen)
+		container._sessions[sessionId] = session
+		for request in sessionRequests:
+			register(session, request)
+
+	def new_session(session):
+		for request in bySession.get(session._sessionId, []):
+			register(session, request)
+
+	for request in requests:
+		if request['op'] == 'clone' and request['id'] in clonedAs:
+			container._newSessionCallbacks[request['id']] = new_session
+
+	return replay, len(responses)
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Replays a recording through the decode-and-dispatch path")
+	cliParser.add_argument("-r", "--repeat", type=int, help="The number of times to replay. Default = 5", default=5)
+	cliParser.add_argument("recording", help="The recording to replay")
+	args = cliParser.parse_args()
+
+	for i in range(args.repeat):
+		dispatched = [0]
+		replay, messages = prepare(args.recording, dispatched)
+		started = time.time()
+		delivered = replay.replay()
+		elapsed = time.time() - started
+		print "{0} bytes, {1} messages, {2} callbacks in {3:.3f}s: {4:.1f} MB/s, {5:.0f} messages/s".format(
+			delivered, messages, dispatched[0], elapsed,
+			delivered / elapsed / 1e6, messages / elapsed)
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+'''measures the cold-start cost of the client: the time it takes a fresh
+python process to import the package and, when a port is given, to connect
+to a nrepl and receive the result of its first eval, and to know the ops
+the nrepl supports, with a describe round trip and from the capability cache.
+
+every run happens in a new interpreter so that nothing is cached in-process.'''
+
+import argparse, subprocess, sys, os, shutil, tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+CHILD = '''
+import time, threading
+t0 = time.time()
+from pyjurer.session_container import create_bcode_over_tcp_session_container, stop_bcode_over_tcp_session_container
+t1 = time.time()
+t2 = t3 = t4 = t1
+if %(port)r is not None:
+	from pyjurer.capability_cache import CapabilityCache
+	result = threading.Event()
+	sessions = []
+	def new_session(s):
+		sessions.append(s)
+		s.eval('(+ 1 2)', value=lambda s, id_, v: result.set())
+	container = create_bcode_over_tcp_session_container(%(host)r, %(port)r)
+	container.create_new_session(new_session)
+	result.wait(%(timeout)r)
+	t2 = time.time()
+
+	described = threading.Event()
+	sessions[0].describe(lambda s, r: described.set())
+	described.wait(%(timeout)r)
+	t3 = time.time()
+
+	refreshed = threading.Event()
+	CapabilityCache(%(cache)r).capabilities(sessions[0], (%(host)r, %(port)r), lambda s, e: refreshed.set())
+	t4 = time.time()
+	refreshed.wait(%(timeout)r)
+	stop_bcode_over_tcp_session_container(container)
+print t1 - t0, t2 - t0, t3 - t2, t4 - t3
+'''
+
+def run_once(host, port, timeout, cache):
+	env = dict(os.environ)
+	env['PYTHONPATH'] = ROOT
+	output = subprocess.check_output(
+		[sys.executable, '-c', CHILD % {'host': host, 'port': port, 'timeout': timeout, 'cache': cache}],
+		env=env)
+	return [float(t) for t in output.split()]
+
+def percentile(values, p):
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Cold-start benchmark, from import to first eval result")
+	cliParser.add_argument("-n", "--hostname", help="The hostname to connect to. Default = 'localhost'", default="localhost")
+	cliParser.add_argument("-p", "--port", type=int, help="The nrepl port. Without it only the import is measured", default=None)
+	cliParser.add_argument("-r", "--runs", type=int, help="The number of fresh processes to start. Default = 20", default=20)
+	cliParser.add_argument("-t", "--timeout", type=float, help="Seconds to wait for the first eval. Default = 10", default=10.0)
+	args = cliParser.parse_args()
+
+	# every run after the first finds the capabilities in this cache
+	directory = tempfile.mkdtemp()
+	try:
+		cache = os.path.join(directory, 'capabilities.json')
+		results = [run_once(args.hostname, args.port, args.timeout, cache) for i in range(args.runs)]
+	finally:
+		shutil.rmtree(directory)
+
+	imports = [r[0] * 1000 for r in results]
+	evals = [r[1] * 1000 for r in results]
+	describes = [r[2] * 1000 for r in results]
+	cached = [r[3] * 1000 for r in results[1:]]
+
+	print "import:     p50 {0:.2f} ms, p90 {1:.2f} ms".format(percentile(imports, 0.5), percentile(imports, 0.9))
+	if args.port is not None:
+		print "first eval: p50 {0:.2f} ms, p90 {1:.2f} ms".format(percentile(evals, 0.5), percentile(evals, 0.9))
+		print "ops known by describe:          p50 {0:.2f} ms, p90 {1:.2f} ms".format(percentile(describes, 0.5), percentile(describes, 0.9))
+		if cached:
+			print "ops known by capability cache:  p50 {0:.2f} ms, p90 {1:.2f} ms".format(percentile(cached, 0.5), percentile(cached, 0.9))
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+'''submits evals to one session from many threads at once and checks that
+every response reaches the callbacks of the request it belongs to.
+
+the nrepl is an in-process echo that answers each eval with its code as the
+value, through a bencode transport on both ends and its own reply thread,
+the way the tcp channel's callback thread would deliver them.'''
+
+import argparse, os, sys, threading, time, Queue
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyjurer.session_container import SessionContainer
+from pyjurer.transports.bcode_transport import BCodeTransport
+
+class EchoNrepl(object):
+	'''decodes requests and answers them on its own thread'''
+
+	def __init__(self, clientReceive):
+		self._queue = Queue.Queue()
+		# the tcp channel serialises the writes of every thread through its
+		# send queue, this lock stands in for that
+		self._receiveLock = threading.Lock()
+		self._server = BCodeTransport(clientReceive, self._queue.put)
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def receive(self, raw):
+		with self._receiveLock:
+			self._server.receive(raw)
+
+	def _run(self):
+		while True:
+			data = self._queue.get()
+			id_ = data['id']
+			if data['op'] == 'clone':
+				self._server.send({'id': id_, 'session': '', 'new-session': 's1', 'status': ['done']})
+			else:
+				self._server.send({'id': id_, 'session': 's1', 'value': data['code']})
+				self._server.send({'id': id_, 'session': 's1', 'status': ['done']})
+
+def run(threads, requests):
+	'''returns (seconds, lost, misrouted)'''
+
+	wire = {}
+	client = BCodeTransport(lambda raw: wire['server'].receive(raw))
+	wire['server'] = EchoNrepl(client.receive)
+	container = SessionContainer(client.send)
+	client.add_callback(container._accept_data)
+
+	ready = threading.Event()
+	def new_session(s):
+		new_session.session = s
+		ready.set()
+	container.create_new_session(new_session)
+	ready.wait()
+	session = new_session.session
+
+	remaining = threading.Semaphore(0)
+	misrouted = []
+
+	def submitter(t):
+		for i in range(requests):
+			code = '(+ {0} {1})'.format(t, i)
+			def value(s, id_, v, code=code):
+				if v != code:
+					misrouted.append((code, v))
+			session.eval(code, value=value, done=lambda s, id_: remaining.release())
+
+	started = time.time()
+	workers = [threading.Thread(target=submitter, args=(t,)) for t in range(threads)]
+	for w in workers:
+		w.start()
+	for w in workers:
+		w.join()
+
+	lost = 0
+	deadline = started + 60
+	for i in range(threads * requests):
+		while not remaining.acquire(False):
+			if time.time() > deadline:
+				lost = threads * requests - i
+				break
+			time.sleep(0.0005)
+		if lost:
+			break
+
+	return time.time() - started, lost, len(misrouted)
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Multi-threaded submission stress benchmark")
+	cliParser.add_argument("-t", "--threads", type=int, help="The number of submitting threads. Default = 32", default=32)
+	cliParser.add_argument("-r", "--requests", type=int, help="The evals submitted per thread. Default = 1000", default=1000)
+	args = cliParser.parse_args()
+
+	seconds, lost, misrouted = run(args.threads, args.requests)
+	total = args.threads * args.requests
+	print "{0} evals from {1} threads in {2:.2f}s ({3:.0f}/s), lost {4}, misrouted {5}".format(
+		total, args.threads, seconds, total / seconds, lost, misrouted)
+	sys.exit(1 if lost or misrouted else 0)
@@ -0,0 +1,295 @@
+#! /usr/bin/env python
+'''admission control for the requests a SessionContainer submits, so a
+busy client cannot flood a shared nrepl with more than it can take.
+
+a request is admitted when there are tokens for it in the requests/s and
+bytes/s buckets and it stays within the cap on requests in flight, on the
+connection and on its session. otherwise it waits in a queue, in the order
+it was submitted, or, once the queue is full, is rejected straight away
+with AdmissionRejected.
+
+the cap on the connection can adapt to the latency of the requests, the
+time from submitting to 'done': it grows by one for every cap's worth of
+requests that finished within the target latency and halves when one
+took longer, at most once per target latency (aimd).
+
+the decisions are made under a lock, the requests are sent after it is let
+go of, in the order they were admitted, by one thread at a time'''
+
+import logging, threading, time, collections
+
+logger = logging.getLogger(__name__)
+
+# ops that are never held back: they cancel or feed what is in flight already
+BYPASS_OPS = frozenset(['interrupt', 'stdin', 'close'])
+
+class AdmissionRejected(Exception):
+	'''raised by submit when a request can neither be admitted nor queued'''
+
+class TokenBucket(object):
+	'''rate tokens a second, of which at most burst can be saved up'''
+
+	def __init__(self, rate, burst=None):
+		self.rate = float(rate)
+		self.burst = float(burst if burst is not None else rate)
+		self._tokens = self.burst
+		self._updated = time.time()
+
+	def _refill(self, now):
+		self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+		self._updated = now
+
+	def wait_time(self, n, now):
+		'''the seconds until n tokens are there, 0 when they are there now.
+		a request larger than the burst only needs a full bucket'''
+
+		self._refill(now)
+		n = min(n, self.burst)
+		if self._tokens >= n:
+			return 0.0
+		return (n - self._tokens) / self.rate
+
+	def take(self, n, now):
+		self._refill(now)
+		self._tokens -= min(n, self.burst)
+
+def request_size(data):
+	'''an estimate of the bytes a request takes on the wire'''
+
+	size = 0
+	for k, v in data.iteritems():
+		size += len(k)
+		if isinstance(v, (int, long)):
+			size += 8
+		else:
+			try:
+				size += len(v)
+			except TypeError:
+				pass
+	return size
+
+class AdmissionController(object):
+	'''decides when the requests of one connection are sent'''
+
+	def __init__(self, requestsPerSecond=None, bytesPerSecond=None,
+		maxInFlight=None, maxInFlightPerSession=None, maxQueued=1000,
+		targetLatency=None, minInFlight=1):
+		'''requestsPerSecond, bytesPerSecond => optional rates, with a burst of one second
+		maxInFlight => optional cap on the requests that are sent and not done yet
+		maxInFlightPerSession => optional cap like maxInFlight, per session
+		maxQueued => the requests that can wait before new ones are rejected, 0 rejects
+		everything that cannot be sent straight away
+		targetLatency => optional seconds. when given the cap on the connection
+		adapts between minInFlight and maxInFlight, starting at maxInFlight'''
+
+		self._requests = None if requestsPerSecond is None else TokenBucket(requestsPerSecond)
+		self._bytes = None if bytesPerSecond is None else TokenBucket(bytesPerSecond)
+		self._maxInFlight = maxInFlight
+		self._limit = maxInFlight
+		self._minInFlight = minInFlight
+		self._maxPerSession = maxInFlightPerSession
+		self._maxQueued = maxQueued
+		self._targetLatency = targetLatency
+		if not targetLatency is None and maxInFlight is None:
+			raise ValueError('an adaptive cap needs maxInFlight')
+
+		self._lock = threading.RLock()
+		self._queue = collections.deque()
+		self._inFlight = {}
+		self._inFlightPerSession = {}
+		# admitted and waiting to be sent by whichever thread is sending
+		self._outbox = collections.deque()
+		self._sending = False
+		self._timer = None
+		self._increase = 0.0
+		self._lastDecrease = 0.0
+
+		self._counters = dict.fromkeys(('admitted', 'queued', 'rejected', 'completed',
+			'bypassed', 'increases', 'decreases'), 0)
+		self._queuedSeconds = 0.0
+
+	def metrics(self):
+		'''returns a snapshot of the decisions made so far and the current state'''
+
+		with self._lock:
+			result = dict(self._counters)
+			result.update({
+				'in_flight': len(self._inFlight),
+				'queue_length': len(self._queue),
+				'limit': self._limit,
+				'queued_seconds': self._queuedSeconds
+			})
+			return result
+
+	def submit(self, data, send):
+		'''sends data with send now, later or raises AdmissionRejected'''
+
+		if data.get('op') in BYPASS_OPS:
+			with self._lock:
+				self._counters['bypassed'] += 1
+			send(data)
+			return
+
+		with self._lock:
+			# what is queued goes first, so requests are sent in order
+			if not self._queue and self._admissible(data, time.time()) == 0:
+				self._send(data, send, None)
+			elif len(self._queue) >= self._maxQueued:
+				self._counters['rejected'] += 1
+				logger.debug('rejecting request {0}, {1} queued'.format(data.get('id'), len(self._queue)))
+				raise AdmissionRejected('{0} requests are queued already'.format(len(self._queue)))
+			else:
+				self._counters['queued'] += 1
+				self._queue.append((data, send, time.time()))
+				self._drain()
+		self._flush()
+
+	def _admissible(self, data, now):
+		'''0 when data can be sent now, the seconds to wait when only tokens are
+		missing and None when it has to wait for something to finish'''
+
+		if not self._limit is None and len(self._inFlight) >= self._limit:
+			return None
+		if not self._maxPerSession is None and \
+			self._inFlightPerSession.get(data.get('session'), 0) >= self._maxPerSession:
+			return None
+
+		wait = 0.0
+		if not self._requests is None:
+			wait = max(wait, self._requests.wait_time(1, now))
+		if not self._bytes is None:
+			wait = max(wait, self._bytes.wait_time(request_size(data), now))
+		return wait
+
+	def _send(self, data, send, queuedAt):
+		now = time.time()
+		if not self._requests is None:
+			self._requests.take(1, now)
+		if not self._bytes is None:
+			self._bytes.take(request_size(data), now)
+		if not queuedAt is None:
+			self._queuedSeconds += now - queuedAt
+
+		session = data.get('session')
+		self._inFlight[data['id']] = (session, now)
+		self._inFlightPerSession[session] = self._inFlightPerSession.get(session, 0) + 1
+		self._counters['admitted'] += 1
+		self._outbox.append((data, send))
+
+	def _flush(self):
+		'''sends what was admitted, called without the lock. a thread that
+		finds another one sending leaves what it admitted to that one'''
+
+		with self._lock:
+			if self._sending:
+				return
+			self._sending = True
+		data = None
+		try:
+			while True:
+				with self._lock:
+					if not self._outbox:
+						self._sending = False
+						return
+					data, send = self._outbox.popleft()
+				send(data)
+		except:
+			with self._lock:
+				self._sending = False
+				# never sent, so never answered either
+				if not data is None:
+					self._release(data['id'])
+			raise
+
+	def _drain(self):
+		'''sends what is queued for as long as it is admissible. requests of a
+		session at its cap are passed over for those of other sessions'''
+
+		now = time.time()
+		wait = None
+		skipped = []
+		while self._queue:
+			data, send, queuedAt = self._queue.popleft()
+			w = self._admissible(data, now)
+			if w == 0:
+				self._send(data, send, queuedAt)
+				continue
+			skipped.append((data, send, queuedAt))
+			if w is not None:
+				# out of tokens, nothing else can go either
+				wait = w
+				break
+			if not self._limit is None and len(self._inFlight) >= self._limit:
+				break
+		self._queue.extendleft(reversed(skipped))
+
+		if not wait is None and self._timer is None:
+			self._timer = threading.Timer(wait, self._timer_fired)
+			self._timer.daemon = True
+			self._timer.start()
+
+	def _timer_fired(self):
+		with self._lock:
+			self._timer = None
+			self._drain()
+		self._flush()
+
+	def completed(self, id_):
+		'''called when the request id_ is done, sends what can go now'''
+
+		with self._lock:
+			entry = self._release(id_)
+			if entry is None:
+				return
+			session, sentAt = entry
+			self._counters['completed'] += 1
+
+			if not self._targetLatency is None:
+				self._adapt(time.time() - sentAt)
+			self._drain()
+		self._flush()
+
+	def _release(self, id_):
+		'''takes id_ off the requests in flight, returns its (session, sent at)
+		or None when it was not in flight'''
+
+		entry = self._inFlight.pop(id_, None)
+		if entry is None:
+			return None
+		session = entry[0]
+		self._inFlightPerSession[session] -= 1
+		if self._inFlightPerSession[session] <= 0:
+			del self._inFlightPerSession[session]
+		return entry
+
+	def reset(self):
+		'''forgets the requests in flight and drops the queued ones, which
+		will never be answered once the connection is gone'''
+
+		with self._lock:
+			if self._inFlight or self._queue:
+				logger.debug('releasing {0} requests in flight, dropping {1} queued'.format(
+					len(self._inFlight), len(self._queue)))
+			self._inFlight.clear()
+			self._inFlightPerSession.clear()
+			self._queue.clear()
+			self._outbox.clear()
+			if not self._timer is None:
+				self._timer.cancel()
+				self._timer = None
+
+	def _adapt(self, latency):
+		now = time.time()
+		if latency > self._targetLatency:
+			if now - self._lastDecrease >= self._targetLatency and self._limit > self._minInFlight:
+				self._limit = max(self._minInFlight, self._limit // 2)
+				self._lastDecrease = now
+				self._increase = 0.0
+				self._counters['decreases'] += 1
+				logger.debug('latency {0:.3f}s, in-flight cap down to {1}'.format(latency, self._limit))
+		elif self._limit < self._maxInFlight:
+			self._increase += 1.0 / self._limit
+			if self._increase >= 1.0:
+				self._limit += 1
+				self._increase = 0.0
+				self._counters['increases'] += 1
@@ -0,0 +1,199 @@
+#! /usr/bin/env python
+'''evaluates the same form on many nrepls at once, for example on every
+worker of a fleet, and gathers what each of them answered:
+
+python broadcast.py -t 5 '(flush-caches!)' worker1:7888 worker2:7888
+
+every host gets a connection and a session of its own on a thread of its
+own. all of them share one deadline, and a host that is slow or down is
+reported as such without holding up the others'''
+
+import argparse, json, logging, socket, sys, threading, time, Queue
+
+from session_container import create_bcode_over_tcp_session_container, stop_bcode_over_tcp_session_container
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10.0
+# seconds a host's connection is given to send the interrupt and the close
+# once the eval is over or given up on
+STOP_TIMEOUT = 1.0
+
+class HostResult(object):
+	'''what one host answered. status is "done", "eval-error", "timeout",
+	"unreachable" or "error", in the last two cases error holds the reason'''
+
+	__slots__ = ('endpoint', 'values', 'out', 'err', 'status', 'error', 'elapsed')
+
+	def __init__(self, endpoint):
+		self.endpoint = endpoint
+		self.values = []
+		self.out = []
+		self.err = []
+		self.status = 'done'
+		self.error = None
+		self.elapsed = None
+
+	def to_json(self):
+		return json.dumps({
+			'host': '{0}:{1}'.format(*self.endpoint),
+			'value': self.values,
+			'out': ''.join(self.out),
+			'err': ''.join(self.err),
+			'status': self.status,
+			'error': self.error,
+			'elapsed_ms': None if self.elapsed is None else round(self.elapsed * 1000, 3)
+		})
+
+def _eval_on_host(index, endpoint, code, started, deadline, results):
+	'''connects to endpoint, evals code in a new session and puts index and
+	the HostResult on results. gives up at deadline, interrupting the eval
+	and closing the session on the way out'''
+
+	result = HostResult(endpoint)
+	# what the callbacks fill in, copied into result once, so the callbacks
+	# that come in after the deadline do not touch a result handed out
+	answered = HostResult(endpoint)
+	container = None
+	session = None
+	id_ = None
+	try:
+		# a host that is down must not hold the thread past the deadline
+		container = create_bcode_over_tcp_session_container(*endpoint,
+			connectTimeout=max(0.001, deadline - time.time()))
+
+		finished = threading.Event()
+		sessions = []
+		def new_session(s):
+			sessions.append(s)
+			finished.set()
+		container.create_new_session(new_session)
+
+		if finished.wait(max(0, deadline - time.time())):
+			finished.clear()
+			session = sessions[0]
+			def error(s, id_):
+				answered.status = 'eval-error'
+			id_ = session.eval(code,
+				value=lambda s, id_, v: answered.values.append(v),
+				stdout=lambda s, id_, out: answered.out.append(out),
+				stderr=lambda s, id_, err: answered.err.append(err),
+				error=error,
+				done=lambda s, id_: finished.set())
+
+			if finished.wait(max(0, deadline - time.time())):
+				id_ = None
+			else:
+				result.status = 'timeout'
+		else:
+			result.status = 'timeout'
+	except (socket.error, EnvironmentError), e:
+		logger.debug('unable to reach {0}: {1}'.format(endpoint, e))
+		result.status = 'unreachable'
+		result.error = str(e)
+	except Exception, e:
+		logger.exception('the eval on {0} failed'.format(endpoint))
+		result.status = 'error'
+		result.error = str(e)
+	finally:
+		result.elapsed = time.time() - started
+		result.values = list(answered.values)
+		result.out = list(answered.out)
+		result.err = list(answered.err)
+		if result.status == 'done':
+			result.status = answered.status
+		results.put((index, result))
+		if not session is None:
+			# best effort, the host may be gone by now
+			try:
+				if not id_ is None:
+					session.interrupt(interrupt_id=id_)
+				session.close()
+			except Exception, e:
+				logger.debug('unable to close the session on {0}: {1}'.format(endpoint, e))
+		if not container is None:
+			# flushes the interrupt and the close, within STOP_TIMEOUT
+			stop_bcode_over_tcp_session_container(container, timeout=STOP_TIMEOUT)
+
+def _broadcast(endpoints, code, timeout):
+	'''generates the position in endpoints and the HostResult of each of
+	them, see broadcast_as_completed'''
+
+	started = time.time()
+	deadline = started + timeout
+	results = Queue.Queue()
+
+	for index, endpoint in enumerate(endpoints):
+		thread = threading.Thread(target=_eval_on_host,
+			args=(index, endpoint, code, started, deadline, results))
+		# a host that does not even accept the connection must not keep
+		# the process alive
+		thread.daemon = True
+		thread.start()
+
+	# by position, an endpoint given twice is evaluated on twice
+	pending = set(range(len(endpoints)))
+	while pending:
+		remaining = deadline - time.time()
+		if remaining <= 0:
+			break
+		try:
+			index, result = results.get(True, remaining)
+		except Queue.Empty:
+			break
+		if index in pending:
+			pending.discard(index)
+			yield index, result
+
+	# in the order they were given, to keep the output stable
+	for index, endpoint in enumerate(endpoints):
+		if index in pending:
+			result = HostResult(endpoint)
+			result.status = 'timeout'
+			result.elapsed = time.time() - started
+			yield index, result
+
+def broadcast_as_completed(endpoints, code, timeout=DEFAULT_TIMEOUT):
+	'''evals code on every (host, port) in endpoints concurrently and
+	generates a HostResult for each of them as soon as it is known. the
+	hosts that have not answered within timeout seconds of the call are
+	generated last, with the status "timeout". an endpoint given more than
+	once gets a result for each time'''
+
+	for index, result in _broadcast(list(endpoints), code, timeout):
+		yield result
+
+def broadcast(endpoints, code, timeout=DEFAULT_TIMEOUT):
+	'''like broadcast_as_completed, but waits for all of them and returns
+	the results in the order of endpoints, one for each of them'''
+
+	endpoints = list(endpoints)
+	results = [None] * len(endpoints)
+	for index, result in _broadcast(endpoints, code, timeout):
+		results[index] = result
+	return results
+
+def parse_endpoint(text, defaultHost='localhost'):
+	'''turns "host:port" or "port" into (host, port)'''
+
+	host, sep, port = text.rpartition(':')
+	return (host or defaultHost, int(port))
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="Evaluates a form on many nrepls at once")
+	cliParser.add_argument("-ll", "--logLevel", help="The logging verbosity", default='WARNING', choices=['DEBUG', 'WARNING', 'INFO', 'ERROR', 'CRITICAL'])
+	cliParser.add_argument("-t", "--timeout", type=float, help="Seconds to wait for all hosts. Default = {0}".format(DEFAULT_TIMEOUT), default=DEFAULT_TIMEOUT)
+	cliParser.add_argument("form", help="The clojure form to evaluate")
+	cliParser.add_argument("hosts", nargs='+', help="The nrepls, as host:port")
+	args = cliParser.parse_args()
+
+	effectiveLogLevel = getattr(logging, args.logLevel.upper(), None)
+	logging.basicConfig(level=effectiveLogLevel, stream=sys.stderr)
+
+	failed = 0
+	for result in broadcast_as_completed([parse_endpoint(h) for h in args.hosts], args.form, args.timeout):
+		if result.status != 'done':
+			failed += 1
+		sys.stdout.write(result.to_json() + '\n')
+		sys.stdout.flush()
+	sys.exit(1 if failed else 0)
@@ -0,0 +1,180 @@
+#! /usr/bin/env python
+'''remembers, on disk, what every nrepl the client talked to said about
+itself in answer to describe: the ops it supports and the versions of the
+nrepl, clojure and java it runs. a short-lived process can then decide
+what to do on a connection straight away, without a describe round trip.
+
+the cache is keyed by endpoint. it cannot know a server's version before
+asking, so a cached entry is used as it is, and a describe is sent in the
+background to refresh it only once it is older than MAX_AGE. when the
+nrepl answers a request for an op it was cached to support with
+'unknown-op', the entry is dropped and described again straight away.
+
+several processes share the file: a write re-reads it under a lock and
+changes only the entry it is about, so the entries other processes wrote
+in the meantime are kept'''
+
+import json, logging, os, tempfile, threading, time, weakref
+
+try:
+	import fcntl
+except ImportError:
+	# no locking between processes, a write still merges what it reads
+	fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# the age in seconds after which an entry is described again
+MAX_AGE = 24 * 60 * 60
+
+def default_path():
+	'''the cache file under $XDG_CACHE_HOME, ~/.cache by default'''
+
+	base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(base, 'pyjurer', 'capabilities.json')
+
+def endpoint_key(endpoint):
+	'''turns (host, port) or a uri into the string the cache is keyed by'''
+
+	if isinstance(endpoint, tuple):
+		return '{0}:{1}'.format(*endpoint)
+	return endpoint
+
+class CapabilityCache(object):
+	'''the describe results of nrepls by endpoint, kept in a json file'''
+
+	def __init__(self, path=None, maxAge=MAX_AGE):
+		'''path => the file to keep the cache in, default_path() by default
+		maxAge => the age in seconds after which an entry is described again'''
+
+		self._path = default_path() if path is None else path
+		self._maxAge = maxAge
+		self._lock = threading.Lock()
+		self._entries = self._read()
+		# the endpoints each session is watched for, so it is watched once
+		self._watched = weakref.WeakKeyDictionary()
+
+	def _read(self):
+		try:
+			with open(self._path) as f:
+				entries = json.load(f)
+			if isinstance(entries, dict):
+				return entries
+			logger.warn("ignoring the malformed capability cache '{0}'".format(self._path))
+		except (IOError, OSError):
+			pass
+		except ValueError:
+			logger.warn("ignoring the malformed capability cache '{0}'".format(self._path))
+		return {}
+
+	def _write(self, key, entry):
+		'''sets the entry of key, or drops it when entry is None, in the cache
+		file as it is now, under a lock on a file next to it, and takes what
+		the other processes wrote along. the cache is written to a temporary
+		file that then replaces the cache file, so another process never reads
+		half of it. called with the lock held'''
+
+		if entry is None:
+			self._entries.pop(key, None)
+		else:
+			self._entries[key] = entry
+
+		directory = os.path.dirname(self._path)
+		try:
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+			with open(self._path + '.lock', 'a') as lock:
+				if not fcntl is None:
+					fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+				entries = self._read()
+				if entry is None:
+					entries.pop(key, None)
+				else:
+					entries[key] = entry
+				fd, temporary = tempfile.mkstemp(dir=directory, prefix='.capabilities-')
+				with os.fdopen(fd, 'w') as f:
+					json.dump(entries, f, sort_keys=True)
+				os.rename(temporary, self._path)
+			self._entries = entries
+		except (IOError, OSError), e:
+			logger.warn("unable to write the capability cache '{0}': {1}".format(self._path, e))
+
+	def lookup(self, endpoint):
+		'''returns the cached {'ops': [...], 'versions': {...}, 'fetched': seconds}
+		of endpoint, or None'''
+
+		with self._lock:
+			return self._entries.get(endpoint_key(endpoint))
+
+	def supports(self, endpoint, op):
+		'''True or False when endpoint's ops are cached, None when they are not'''
+
+		entry = self.lookup(endpoint)
+		if entry is None:
+			return None
+		return op in entry['ops']
+
+	def store(self, endpoint, described):
+		'''caches the result of a describe, returns True when it changed
+		what was cached'''
+
+		entry = {
+			'ops': sorted(described.get('ops', [])),
+			'versions': described.get('versions', {}),
+			'fetched': time.time()
+		}
+		key = endpoint_key(endpoint)
+		with self._lock:
+			old = self._entries.get(key)
+			changed = old is None or old['ops'] != entry['ops'] or old['versions'] != entry['versions']
+			self._write(key, entry)
+		if changed and not old is None:
+			logger.info('the capabilities of {0} changed'.format(key))
+		return changed
+
+	def invalidate(self, endpoint):
+		key = endpoint_key(endpoint)
+		with self._lock:
+			if key in self._entries:
+				self._write(key, None)
+
+	def capabilities(self, session, endpoint, described=None):
+		'''returns the cached capabilities of the nrepl session is connected to
+		at endpoint, or None, and refreshes them with a describe on session in
+		the background when they are missing or older than maxAge. described
+		is called with the session and the fresh entry once it is in, straight
+		away when the cached one is fresh.
+
+		the session is watched from then on, once however many times it is
+		passed in: when it gets an 'unknown-op' for
+		an op that was cached as supported the entry is dropped and described
+		again'''
+
+		key = endpoint_key(endpoint)
+		cached = self.lookup(key)
+		if cached is None or time.time() - cached['fetched'] > self._maxAge:
+			self._refresh(session, key, described)
+		elif not described is None:
+			described(session, cached)
+
+		with self._lock:
+			keys = self._watched.setdefault(session, set())
+			if key in keys:
+				return cached
+			keys.add(key)
+
+		def unknown_op(s, op):
+			if self.supports(key, op):
+				logger.info("{0} does not know '{1}' after all".format(key, op))
+				self.invalidate(key)
+				self._refresh(s, key, None)
+		session.add_unknown_op_listener(unknown_op)
+
+		return cached
+
+	def _refresh(self, session, key, described):
+		def received(s, result):
+			self.store(key, result)
+			if not described is None:
+				described(s, self.lookup(key))
+		session.describe(received)
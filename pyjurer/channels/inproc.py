@@ -0,0 +1,111 @@
+# /usr/bin/env python
+'''channels that connect two ends in the same process, without a socket,
+for embedding a nrepl or a stand-in of one and for testing.
+
+loopback_pair() returns two connected LoopbackChannels. what is sent on
+one is delivered to the callbacks of the other, on a thread of its own
+like the Tcp channel's callback thread. like a socket's recv, an empty
+string is delivered when the other end is stopped.
+
+a server can also listen() under a name, after which connect(name) gives
+a new channel of which the other end is handed to the server'''
+
+import threading, logging, Queue
+
+LOOPBACK_STOP_TIMEOUT = 1.0 # seconds stop waits for the chunk being delivered
+
+_listenersLock = threading.Lock()
+_listeners = {}
+
+class LoopbackChannel(object):
+	'''one end of an in-process connection'''
+
+	def __init__(self, dataReceivedCallback=None):
+		self._logger = logging.getLogger(__name__ + '.LoopbackChannel')
+		self._peer = None
+		self._received = Queue.Queue()
+		self._thread = None
+		self._stopped = False
+
+		self._callbacks = []
+		if dataReceivedCallback != None:
+			self.add_callback(dataReceivedCallback)
+
+	def add_callback(self, callback):
+		self._callbacks.append(callback)
+
+	def callback_internal(self, bytes):
+		map(lambda f: f(bytes), self._callbacks)
+
+	def _deliver(self):
+		while True:
+			received = self._received.get()
+			if received is None:
+				return
+			self.callback_internal(received)
+
+	def start(self):
+		'''starts delivering what the other end sends, what it sent before
+		this is delivered first'''
+
+		self._thread = threading.Thread(target=self._deliver)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self, flush=True, timeout=LOOPBACK_STOP_TIMEOUT):
+		'''stops delivering and tells the other end with an empty string.
+		what was sent is with the other end already, so there is nothing to
+		flush. waits at most timeout seconds for the callbacks of the chunk
+		being delivered'''
+
+		if self._stopped:
+			return
+		self._stopped = True
+		if not self._peer._stopped:
+			self._peer._received.put('')
+		self._received.put(None)
+		if not self._thread is None and self._thread is not threading.current_thread():
+			self._thread.join(timeout)
+
+	def send(self, data, session=None):
+		if self._stopped or self._peer._stopped:
+			self._logger.debug('dropping {0} bytes sent on a stopped channel'.format(len(data)))
+			return
+		if isinstance(data, list):
+			# a frame in parts, see BCodeTransport.send. parts that are
+			# not strings, like an mmap, are copied out here
+			data = ''.join(part if isinstance(part, str) else part[:] for part in data)
+		self._peer._received.put(data)
+
+def loopback_pair():
+	'''returns two LoopbackChannels connected to each other, not started'''
+
+	a, b = LoopbackChannel(), LoopbackChannel()
+	a._peer, b._peer = b, a
+	return a, b
+
+def listen(name, accept):
+	'''makes name connectable. accept is called with the server end of every
+	connection made to it, which it has to start'''
+
+	with _listenersLock:
+		if name in _listeners:
+			raise ValueError("'{0}' is already listened on".format(name))
+		_listeners[name] = accept
+
+def unlisten(name):
+	with _listenersLock:
+		_listeners.pop(name, None)
+
+def connect(name):
+	'''returns the client end of a new connection to the server listening
+	under name, not started yet'''
+
+	with _listenersLock:
+		accept = _listeners.get(name)
+	if accept is None:
+		raise ValueError("nothing listens on 'inproc://{0}'".format(name))
+
+	client, server = loopback_pair()
+	accept(server)
+	return client
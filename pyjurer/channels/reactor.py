@@ -0,0 +1,344 @@
+# /usr/bin/env python
+'''one i/o thread that serves the sockets of any number of connections,
+for processes that keep many of them open. a Tcp channel started in its
+own mode has two threads, a socket thread and a callback thread, that are
+idle most of the time but still cost a stack each and compete for the GIL.
+
+the reactor waits on every socket at once with epoll, or with select where
+there is no epoll, reads and writes them without blocking and hands what
+it read to a small pool of dispatch threads. the chunks of one connection
+are handed on by one dispatch thread at a time and in the order they were
+read, so a connection's transport sees them exactly as it would from its
+own callback thread'''
+
+import collections, errno, logging, select, socket, threading, Queue
+
+from tcp import _ReceiveBuffer, _drain_wakeup
+
+logger = logging.getLogger(__name__)
+
+REACTOR_DISPATCH_THREADS = 2
+# the chunks of one connection handed on before the next connection gets a turn
+DISPATCH_BATCH = 16
+# seconds unregister waits for what was sent to be written before closing anyway
+STOP_TIMEOUT = 1.0
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+class _EpollPoller(object):
+	def __init__(self):
+		self._epoll = select.epoll()
+
+	def _mask(self, write):
+		return select.EPOLLIN | (select.EPOLLOUT if write else 0)
+
+	def register(self, fd, write=False):
+		self._epoll.register(fd, self._mask(write))
+
+	def modify(self, fd, write):
+		self._epoll.modify(fd, self._mask(write))
+
+	def unregister(self, fd):
+		self._epoll.unregister(fd)
+
+	def poll(self):
+		'''waits for events, returns a list of (fd, readable, writable)'''
+		try:
+			events = self._epoll.poll(-1)
+		except IOError, e:
+			if e.errno == errno.EINTR:
+				return []
+			raise
+		# a hang up or an error shows when the socket is read
+		readMask = select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR
+		return [(fd, bool(mask & readMask), bool(mask & select.EPOLLOUT)) for fd, mask in events]
+
+	def close(self):
+		self._epoll.close()
+
+class _SelectPoller(object):
+	def __init__(self):
+		self._read = set()
+		self._write = set()
+
+	def register(self, fd, write=False):
+		self._read.add(fd)
+		self.modify(fd, write)
+
+	def modify(self, fd, write):
+		if write:
+			self._write.add(fd)
+		else:
+			self._write.discard(fd)
+
+	def unregister(self, fd):
+		self._read.discard(fd)
+		self._write.discard(fd)
+
+	def poll(self):
+		try:
+			readable, writable, failed = select.select(self._read, self._write, [])
+		except select.error, e:
+			if e.args[0] == errno.EINTR:
+				return []
+			raise
+		writable = set(writable)
+		return [(fd, fd in readable, fd in writable) for fd in set(readable) | writable]
+
+	def close(self):
+		pass
+
+class _Connection(object):
+	'''the state the reactor keeps for one socket. everything but the inbox
+	is only touched on the i/o thread'''
+
+	def __init__(self, isocket, callback, receiveBuffer):
+		self.socket = isocket
+		self.fd = isocket.fileno()
+		self.callback = callback
+		self.receiveBuffer = receiveBuffer
+
+		# what is waiting to be written, and how much of the first of it was
+		self.outgoing = collections.deque()
+		self.offset = 0
+		self.writing = False
+
+		self.lock = threading.Lock()
+		self.inbox = collections.deque()
+		self.scheduled = False
+
+		self.closing = None
+		self.closed = False
+
+class Reactor(object):
+	'''serves the sockets registered with it on one thread'''
+
+	def __init__(self, dispatchThreads=REACTOR_DISPATCH_THREADS):
+		'''dispatchThreads => the number of threads that hand what was read on'''
+
+		self._poller = _EpollPoller() if hasattr(select, 'epoll') else _SelectPoller()
+		self._connections = {}
+		self._commands = collections.deque()
+		self._woken = False
+		self._running = True
+
+		self._wakeupReader, self._wakeupWriter = socket.socketpair()
+		self._wakeupReader.setblocking(0)
+		self._wakeupWriter.setblocking(0)
+		self._poller.register(self._wakeupReader.fileno())
+
+		self._dispatchQueue = Queue.Queue()
+		self._dispatchers = []
+		for i in range(dispatchThreads):
+			thread = threading.Thread(target=self._dispatch, name='pyjurer-dispatch-{0}'.format(i))
+			thread.daemon = True
+			thread.start()
+			self._dispatchers.append(thread)
+
+		self._thread = threading.Thread(target=self._run, name='pyjurer-reactor')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def register(self, isocket, callback, receiveBuffer=None):
+		'''starts serving the connected isocket, callback is called with every
+		chunk read from it and with an empty string once the other side closed
+		it. returns the connection to send on and unregister'''
+
+		isocket.setblocking(0)
+		connection = _Connection(isocket, callback,
+			_ReceiveBuffer() if receiveBuffer is None else receiveBuffer)
+		self._call(self._add, connection)
+		return connection
+
+	def send(self, connection, contents):
+		'''writes contents, a string, an mmap or a list of them, to connection'''
+		self._call(self._write, connection, contents)
+
+	def unregister(self, connection, timeout=STOP_TIMEOUT, flush=True):
+		'''closes connection once what was sent on it is written, or after
+		timeout seconds, or straight away when flush is False. nothing is
+		handed on from it afterwards'''
+
+		closed = threading.Event()
+		self._call(self._close, connection, closed, not flush)
+		if not closed.wait(timeout):
+			logger.warn('closing a connection with {0} unsent messages'.format(len(connection.outgoing)))
+			self._call(self._close, connection, closed, True)
+			closed.wait(timeout)
+		connection.closed = True
+
+	def close(self):
+		'''closes every connection and stops the threads'''
+
+		self._running = False
+		self._wake()
+		self._thread.join()
+		for thread in self._dispatchers:
+			self._dispatchQueue.put(None)
+		for thread in self._dispatchers:
+			thread.join()
+
+	def _call(self, method, *args):
+		'''has the i/o thread call method with args, in the order of the calls'''
+
+		self._commands.append((method, args))
+		# one wakeup at a time is enough, the i/o thread clears the flag
+		# before it runs the commands
+		if not self._woken:
+			self._woken = True
+			self._wake()
+
+	def _wake(self):
+		try:
+			self._wakeupWriter.send('x')
+		except socket.error:
+			# the buffer is full, there is a wakeup pending already
+			pass
+
+	def _run(self):
+		wakeupFd = self._wakeupReader.fileno()
+		while self._running:
+			self._woken = False
+			while self._commands:
+				method, args = self._commands.popleft()
+				method(*args)
+
+			for fd, readable, writable in self._poller.poll():
+				if fd == wakeupFd:
+					_drain_wakeup(self._wakeupReader)
+					continue
+				connection = self._connections.get(fd)
+				if connection is None:
+					continue
+				if writable:
+					self._flush(connection)
+				if readable and self._connections.get(fd) is connection:
+					self._read(connection)
+
+		for connection in self._connections.values():
+			self._lost(connection)
+		self._poller.close()
+		self._wakeupReader.close()
+		self._wakeupWriter.close()
+
+	def _add(self, connection):
+		self._connections[connection.fd] = connection
+		self._poller.register(connection.fd)
+
+	def _drop(self, connection):
+		if self._connections.get(connection.fd) is connection:
+			del self._connections[connection.fd]
+			self._poller.unregister(connection.fd)
+			connection.socket.close()
+		if not connection.closing is None:
+			connection.closing.set()
+
+	def _close(self, connection, closed, force):
+		connection.closing = closed
+		if force or not connection.outgoing:
+			self._drop(connection)
+
+	def _read(self, connection):
+		try:
+			received = connection.receiveBuffer.read(connection.socket)
+		except socket.error, e:
+			if e.errno in _WOULD_BLOCK:
+				return
+			logger.debug('connection closed: {0}'.format(e))
+			received = ''
+
+		if len(received) == 0:
+			logger.debug('connection closed by the other side')
+			self._lost(connection)
+		else:
+			self._deliver(connection, received)
+
+	def _lost(self, connection):
+		'''drops connection when it was not unregistered, and tells its
+		callback with an empty string, like the tcp channel's own threads
+		and the in-process channels do'''
+
+		self._drop(connection)
+		self._deliver(connection, '')
+
+	def _deliver(self, connection, received):
+		with connection.lock:
+			connection.inbox.append(received)
+			if connection.scheduled:
+				return
+			connection.scheduled = True
+		self._dispatchQueue.put(connection)
+
+	def _write(self, connection, contents):
+		if self._connections.get(connection.fd) is not connection:
+			logger.debug('dropping a message sent on a closed connection')
+			return
+		if isinstance(contents, list):
+			connection.outgoing.extend(contents)
+		else:
+			connection.outgoing.append(contents)
+		if not connection.writing:
+			self._flush(connection)
+
+	def _flush(self, connection):
+		'''writes what the socket takes, and waits for it to be writable
+		again when it does not take everything'''
+
+		outgoing = connection.outgoing
+		while outgoing:
+			contents = outgoing[0]
+			try:
+				if connection.offset == 0:
+					sent = connection.socket.send(contents)
+				else:
+					sent = connection.socket.send(buffer(contents, connection.offset))
+			except socket.error, e:
+				if e.errno in _WOULD_BLOCK:
+					break
+				logger.debug('connection closed: {0}'.format(e))
+				self._lost(connection)
+				return
+			connection.offset += sent
+			if connection.offset >= len(contents):
+				outgoing.popleft()
+				connection.offset = 0
+
+		writing = len(outgoing) > 0
+		if writing != connection.writing:
+			connection.writing = writing
+			self._poller.modify(connection.fd, writing)
+		if not writing and not connection.closing is None:
+			self._drop(connection)
+
+	def _dispatch(self):
+		while True:
+			connection = self._dispatchQueue.get()
+			if connection is None:
+				return
+			for i in range(DISPATCH_BATCH):
+				with connection.lock:
+					if not connection.inbox:
+						connection.scheduled = False
+						break
+					received = connection.inbox.popleft()
+				if connection.closed:
+					continue
+				try:
+					connection.callback(received)
+				except Exception:
+					logger.exception('the callback of a connection failed')
+			else:
+				# let the other connections have a turn first
+				self._dispatchQueue.put(connection)
+
+_shared = None
+_sharedLock = threading.Lock()
+
+def shared_reactor():
+	'''the reactor of the process, started on first use'''
+
+	global _shared
+	with _sharedLock:
+		if _shared is None:
+			_shared = Reactor()
+		return _shared
@@ -0,0 +1,173 @@
+# /usr/bin/env python
+'''records the bytes that go over a channel and replays them later without
+a nrepl on the other end.
+
+a recording is an append-only file that starts with MAGIC, followed by one
+record per chunk: a 13 byte header packed as RECORD_HEADER (the direction,
+SENT or RECEIVED, the seconds since the recording started and the length)
+and then the chunk itself, exactly as it was passed to send() or to the
+channel's callbacks'''
+
+import threading, logging, struct, time
+
+from tcp import TCP_STOP_TIMEOUT
+
+MAGIC = 'pyjurer-rec-1\n'
+RECORD_HEADER = struct.Struct('<cdI')
+SENT = '>'
+RECEIVED = '<'
+
+# python 2 has no monotonic clock, the wall clock is the best there is there
+_clock = getattr(time, 'monotonic', time.time)
+
+def read_recording(path):
+	'''generates (direction, seconds, bytes) for every chunk in the recording'''
+
+	with open(path, 'rb') as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError("'{0}' is not a recording".format(path))
+
+		while True:
+			header = f.read(RECORD_HEADER.size)
+			if len(header) < RECORD_HEADER.size:
+				return
+			direction, seconds, length = RECORD_HEADER.unpack(header)
+			chunk = f.read(length)
+			if len(chunk) < length:
+				# the recorder was stopped in the middle of a write
+				return
+			yield direction, seconds, chunk
+
+class RecordingChannel:
+	'''wraps a channel, like Tcp, and appends every chunk sent and received
+	through it to a recording'''
+
+	def __init__(self, channel, path):
+		'''channel => the channel to wrap, supporting send, add_callback, start & stop
+		path => the file to record to. an existing recording is appended to'''
+
+		self._logger = logging.getLogger(__name__ + '.RecordingChannel')
+		self._channel = channel
+		self._path = path
+		self._lock = threading.Lock()
+		self._file = None
+		self._started = None
+
+		self._callbacks = []
+		channel.add_callback(self.callback_internal)
+
+	def _record(self, direction, data):
+		with self._lock:
+			if self._file is None:
+				return
+			self._file.write(RECORD_HEADER.pack(direction, _clock() - self._started, len(data)))
+			self._file.write(data)
+
+	def add_callback(self, callback):
+		self._callbacks.append(callback)
+
+	def callback_internal(self, bytes):
+		self._record(RECEIVED, bytes)
+		map(lambda f: f(bytes), self._callbacks)
+
+	def start(self):
+		'''opens the recording and starts the wrapped channel. the recording
+		is opened first so that nothing received is missed, and closed again
+		when the channel fails to start'''
+
+		self._file = open(self._path, 'ab')
+		try:
+			if self._file.tell() == 0:
+				self._file.write(MAGIC)
+			self._started = _clock()
+			self._channel.start()
+		except:
+			with self._lock:
+				self._file.close()
+				self._file = None
+			raise
+
+	def stop(self, flush=True, timeout=TCP_STOP_TIMEOUT):
+		'''stops the wrapped channel, passing flush and timeout on, and
+		closes the recording'''
+
+		self._channel.stop(flush=flush, timeout=timeout)
+		with self._lock:
+			if not self._file is None:
+				self._file.close()
+				self._file = None
+		self._logger.debug("recording '{0}' closed".format(self._path))
+
+	def send(self, data, session=None):
+		if isinstance(data, list):
+			# a frame in parts, see BCodeTransport.send
+			for part in data:
+				self._record(SENT, part)
+		else:
+			self._record(SENT, data)
+		self._channel.send(data)
+
+class ReplayChannel:
+	'''a channel that plays back the received chunks of a recording to its
+	callbacks instead of talking to a nrepl. what is sent to it is ignored'''
+
+	def __init__(self, path, realtime=True, dataReceivedCallback=None):
+		'''path => the recording to play back
+		realtime => when True the chunks are delivered at the pace they were
+		recorded at, otherwise as fast as the callbacks take them'''
+
+		self._logger = logging.getLogger(__name__ + '.ReplayChannel')
+		self._path = path
+		self._realtime = realtime
+		self._mustStop = threading.Event()
+		self._thread = None
+		self.finished = threading.Event()
+
+		self._callbacks = []
+		if dataReceivedCallback != None:
+			self.add_callback(dataReceivedCallback)
+
+	def add_callback(self, callback):
+		self._callbacks.append(callback)
+
+	def callback_internal(self, bytes):
+		map(lambda f: f(bytes), self._callbacks)
+
+	def replay(self):
+		'''plays the recording back on the calling thread, returns the number
+		of bytes delivered'''
+
+		delivered = 0
+		started = _clock()
+		for direction, seconds, chunk in read_recording(self._path):
+			if direction != RECEIVED:
+				continue
+			if self._realtime:
+				delay = seconds - (_clock() - started)
+				if delay > 0 and self._mustStop.wait(delay):
+					break
+			if self._mustStop.is_set():
+				break
+			self.callback_internal(chunk)
+			delivered += len(chunk)
+
+		self.finished.set()
+		return delivered
+
+	def start(self):
+		'''plays the recording back on a thread of its own'''
+
+		self._thread = threading.Thread(target=self.replay)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self, flush=True, timeout=TCP_STOP_TIMEOUT):
+		'''stops the playback, waiting at most timeout seconds for the chunk
+		being delivered. there is nothing to flush'''
+
+		self._mustStop.set()
+		if not self._thread is None and self._thread is not threading.current_thread():
+			self._thread.join(timeout)
+
+	def send(self, data, session=None):
+		self._logger.debug('ignoring {0} bytes sent during a replay'.format(len(data)))
@@ -1,45 +1,125 @@
 # /usr/bin/env python
 
-import unittest, threading, logging, Queue, socket
+import threading, logging, Queue, socket, select
 
 TCP_CHANNEL_TIMEOUT = 1 # seconds, float value
-TCP_READ_BUFFER_SIZE = 4098
+TCP_CONNECT_TIMEOUT = 5.0 # seconds a connect may take before start gives up
+TCP_STOP_TIMEOUT = 1.0 # seconds stop waits for what is queued to be sent
+TCP_READ_BUFFER_SIZE = 16384 # the initial size of the receive buffer
+TCP_MAX_READ_BUFFER_SIZE = 4 * 1024 * 1024
+TCP_SHRINK_AFTER = 64 # consecutive small reads before the receive buffer shrinks
 
 def callbackThreadMain(receiveQueue, mustStopEvent, dataReceivedCallback):
 	'''this method is responsible for callbacks for data received from the socket.
 	It will read read data from receiveQueue and push it on via dataReceivedCallback(byte[])
-	It will check the value of mustStopEvent and exit once it is signalled
+	It will check the value of mustStopEvent and exit once it is signalled.
+	None on receiveQueue wakes it up to do so
 
 	The onus is on dataReceivedCallback's implementation not to hang.
 	'''
 
 	logger = logging.getLogger(__name__ + 'callbackThreadMain')
 
-	while not mustStopEvent.wait(0.5):
-		logger.debug('iterating in callbackThreadMain')
-
-		if receiveQueue.empty():
-			logger.debug('receive queue is empty...')
+	while not mustStopEvent.is_set():
+		# block on the queue itself so that data is handed on as soon
+		# as it arrives instead of on the next poll of mustStopEvent
+		try:
+			received = receiveQueue.get(True, 0.5)
+		except Queue.Empty:
+			continue
+		if received is None:
 			continue
 
-		logger.debug('apparently, the receive queue is not empty')
-		received = ''
-		while not receiveQueue.empty():
-			try:
-				received = received + receiveQueue.get(False)
-			except Queue.Empty:
-				pass
+		# every chunk is handed on as it is, the deserialiser keeps the
+		# pieces of an incomplete frame and joins them only once
 		logger.debug('calling the callback method with {0} bytes of data'.format(len(received)))
 		dataReceivedCallback(received)
 
-
 	logger.debug('stopping on callbackThreadMain')
 
-def socketThreadMain(isocket, sendQueue, receiveQueue):
+def _send_all(isocket, contents):
+	'''sends all of contents, a string or any object supporting the buffer
+	interface like an mmap, on isocket. what is left after a partial send
+	is sent through a view on contents rather than a copy of it'''
+
+	length = len(contents)
+	sent = 0
+	view = None
+	while sent < length:
+		try:
+			if view is None:
+				sent += isocket.send(contents)
+				if sent < length:
+					try:
+						view = memoryview(contents)
+					except TypeError:
+						# python 2's mmap only has the old buffer interface
+						view = buffer(contents)
+			elif isinstance(view, memoryview):
+				sent += isocket.send(view[sent:])
+			else:
+				sent += isocket.send(buffer(contents, sent))
+		except socket.timeout:
+			# the other side is not reading fast enough, keep trying
+			pass
+
+class _ReceiveBuffer(object):
+	'''a preallocated buffer that the socket is read into with recv_into, so
+	what is read is copied out of it once, into a string of exactly the size
+	that was read.
+
+	the buffer doubles, up to maxSize, every time a read fills it, so a large
+	response takes few system calls. it halves again, down to the initial
+	size, after TCP_SHRINK_AFTER reads in a row used less than a quarter of it'''
+
+	def __init__(self, size=TCP_READ_BUFFER_SIZE, maxSize=TCP_MAX_READ_BUFFER_SIZE):
+		self._minSize = size
+		self._maxSize = max(size, maxSize)
+		self._smallReads = 0
+		self._allocate(size)
+
+	def _allocate(self, size):
+		self.size = size
+		self._buffer = bytearray(size)
+		self._view = memoryview(self._buffer)
+
+	def read(self, isocket):
+		'''reads what is available on isocket, returns it as a string'''
+
+		if hasattr(isocket, 'recv_into'):
+			length = isocket.recv_into(self._buffer, self.size)
+			received = self._view[:length].tobytes()
+		else:
+			received = isocket.recv(self.size)
+			length = len(received)
+		self._adapt(length)
+		return received
+
+	def _adapt(self, length):
+		if length == self.size and self.size < self._maxSize:
+			self._allocate(min(self.size * 2, self._maxSize))
+			self._smallReads = 0
+		elif length < self.size // 4 and self.size > self._minSize:
+			self._smallReads += 1
+			if self._smallReads >= TCP_SHRINK_AFTER:
+				self._allocate(max(self.size // 2, self._minSize))
+				self._smallReads = 0
+		else:
+			self._smallReads = 0
+
+def _drain_wakeup(wakeup):
+	try:
+		while wakeup.recv(4096):
+			pass
+	except socket.error:
+		pass
+
+def socketThreadMain(isocket, sendQueue, receiveQueue, wakeup=None, receiveBuffer=None):
 	'''this method will perform the communications with a socket-like object
 	and perform sending and receiving of data via the passed Queues.
 
-	isocket => an object supporting send(byte[]) : int, recv(int) : byte[] & close()
+	isocket => an object supporting send(byte[]) : int, recv(int) : byte[] & close().
+	when it supports recv_into as well, that is used instead of recv
 
 	sendQueue => a Queue object with which this thread is controlled
 
@@ -58,14 +138,25 @@ def socketThreadMain(isocket, sendQueue, receiveQueue):
 		"contents": string/bytes to be sent
 	}
 
-	receiveQueue => a queue containing raw bytes/string read from the isocket
+	receiveQueue => a queue containing raw bytes/string read from the isocket,
+	and an empty string once the other side closed it, after which the
+	thread stops
+
+	wakeup => optional non-blocking socket that becomes readable whenever
+	something is put on sendQueue. when it is given the thread waits on both
+	sockets instead of blocking in isocket.recv until it times out
+
+	receiveBuffer => optional _ReceiveBuffer to read into, one with the
+	default sizes is created when it is not given
 
 	'''
 
 	logger = logging.getLogger(__name__ + 'socketThreadMain')
 
+	if receiveBuffer is None:
+		receiveBuffer = _ReceiveBuffer()
+
 	mustStop = False
-	received = ''
 	while not mustStop:
 		logger.debug('iterating in thread main method')
 
@@ -75,8 +166,8 @@ def socketThreadMain(isocket, sendQueue, receiveQueue):
 			logger.debug('looking for something to send...')
 			try:
 				stuffToSend = sendQueue.get_nowait() # raises Queue.Empty if there is nothing to read
-				logger.debug("found an instruction on the sendQueue '{0}'".format(
-					stuffToSend))
+				logger.debug("found an instruction of type '{0}' on the sendQueue".format(
+					stuffToSend['type']))
 
 				if stuffToSend['type'] == 'control':
 					if stuffToSend['op'] == 'stop':
@@ -85,48 +176,73 @@ def socketThreadMain(isocket, sendQueue, receiveQueue):
 						break
 				elif stuffToSend['type'] == 'message':
 					messageContents = stuffToSend['contents']
-					logger.debug(
-						"Received something to send on the socket: '{0}'".format(
-							messageContents))
-					while len(messageContents) > 0:
-						sent = isocket.send(messageContents)
-						messageContents = messageContents[sent:]
+					if isinstance(messageContents, list):
+						for part in messageContents:
+							_send_all(isocket, part)
+					else:
+						_send_all(isocket, messageContents)
 			except Queue.Empty, e:
 				logger.debug("nothing to send atm")
 				hasStuffToSend = False
+			except socket.error, e:
+				# the other side went away or stop shut the socket down
+				# because it would not take what was left to send
+				logger.debug("unable to send: {0}".format(e))
+				mustStop = True
+				break
 
 		# if we don't have anything else to send
 		# and we did not get a request to stop then 
 		# lets try reading for a while
-		received = ''
 		if not mustStop:
 			logger.debug('looking to read something from the socket')
 			moreToRead = True
 			# try to read everything from the isocket
 			# that we can read now without waiting to long for
 			while moreToRead:
+				if wakeup is not None:
+					readable = select.select([isocket, wakeup], [], [], isocket.gettimeout())[0]
+					if wakeup in readable:
+						_drain_wakeup(wakeup)
+						if not isocket in readable:
+							break
+					if not readable:
+						break
 				try:
-					received = received + isocket.recv(TCP_READ_BUFFER_SIZE)
-					logger.debug("Have something from the socket: '{0}'".format(
-						received))
+					received = receiveBuffer.read(isocket)
 				except socket.timeout:
 					logger.debug("isocket timed out waiting for incoming bytes")
+					break
+				except socket.error, e:
+					logger.debug("unable to read: {0}".format(e))
+					received = ''
+
+				logger.debug("Have {0} bytes from the socket".format(len(received)))
+				if len(received) == 0:
+					# the other side is gone, which the callbacks are told
+					# with an empty string, like the in-process channels do
+					logger.debug("the other side closed the connection")
+					receiveQueue.put('')
+					mustStop = True
+					break
+
+				# go back to sending as soon as there is something
+				# queued, so pipelined requests are not held back
+				# for as long as responses keep streaming in. when we
+				# can wait on the wakeup socket there is no reason to
+				# hold on to what was read either
+				if wakeup is not None or not sendQueue.empty():
 					moreToRead = False
 
-			if len(received) == 0:
-				continue
-
-			# we've received everything that we can right now
-			# let's try sending it back
-			try:
-				receiveQueue.put_nowait(received)
-				received = ''
-			except Queue.Full:
-				# we can't send it back right now because the queue is full
-				# we're not doing anything with this
-				# since we can just put it next time round
-				logger.debug("Can't place the received contents on the out queue because it's full")
-				pass
+				# every chunk goes on the queue as it was read, rather
+				# than being concatenated with the ones before it
+				try:
+					receiveQueue.put_nowait(received)
+				except Queue.Full:
+					# we can't send it back right now because the queue is full
+					# we're not doing anything with this
+					logger.debug("Can't place the received contents on the out queue because it's full")
+					pass
 
 	logger.debug("stopping the thread")
 	isocket.close()
@@ -134,12 +250,22 @@ def socketThreadMain(isocket, sendQueue, receiveQueue):
 class Tcp:
 	'''provides an abstraction over a tcp/ip connection'''
 
-	def __init__(self, host, port, dataReceivedCallback=None):
+	def __init__(self, host, port, dataReceivedCallback=None, nodelay=True,
+		sendBufferSize=None, receiveBufferSize=None, maxReadSize=TCP_MAX_READ_BUFFER_SIZE,
+		reactor=None, connectTimeout=TCP_CONNECT_TIMEOUT):
 		'''creates a new TcpChannel which can send and receive data
 		to and from a tcp/ip socket.
 
 		host => the hostname or address to connect to
-		port => the port number to connect to on host'''
+		port => the port number to connect to on host
+		connectTimeout => seconds start waits for the connection before it
+		raises socket.timeout, None to wait as long as the system does
+		nodelay => sets TCP_NODELAY, so small requests are not held back by
+		nagle's algorithm waiting for the acks of earlier ones
+		sendBufferSize, receiveBufferSize => optional SO_SNDBUF and SO_RCVBUF
+		maxReadSize => the size the receive buffer can grow to
+		reactor => optional reactor.Reactor that serves the socket instead of two
+		threads of the channel's own, or True for the one the process shares'''
 
 		self._logger = logging.getLogger(__name__ + '.Tcp_logger')
 		self._socketSendQueue = Queue.Queue()
@@ -147,6 +273,16 @@ class Tcp:
 
 		self._host = host
 		self._port = port
+		self._nodelay = nodelay
+		self._sendBufferSize = sendBufferSize
+		self._receiveBufferSize = receiveBufferSize
+		self._maxReadSize = maxReadSize
+		self._reactor = reactor
+		self._connectTimeout = connectTimeout
+		self._connection = None
+		# created by start, unless the channel is served by a reactor
+		self._wakeupReader = None
+		self._wakeupWriter = None
 
 		self._callbacks = []
 		if dataReceivedCallback != None:
@@ -158,12 +294,38 @@ class Tcp:
 	def callback_internal(self, bytes):
 		map(lambda f: f(bytes), self._callbacks)
 
+	def _connect(self):
+		'''opens the connected socket, called by start'''
+		isocket = socket.create_connection((self._host, self._port), self._connectTimeout)
+		isocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if self._nodelay else 0)
+		return isocket
+
 	def start(self):
 		'''starts the socket and threads'''
-		self._socket = socket.create_connection((self._host, self._port))
+		self._socket = self._connect()
 		self._socket.settimeout(0.5)
+		if not self._sendBufferSize is None:
+			self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._sendBufferSize)
+		if not self._receiveBufferSize is None:
+			self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._receiveBufferSize)
+
+		if not self._reactor is None:
+			# imported here, the reactor imports from this module
+			from reactor import shared_reactor
+			if self._reactor is True:
+				self._reactor = shared_reactor()
+			self._connection = self._reactor.register(self._socket, self.callback_internal,
+				_ReceiveBuffer(maxSize=self._maxReadSize))
+			return
+
+		# the socket thread waits on this pair as well as on the socket
+		# so that it can send as soon as something is queued
+		self._wakeupReader, self._wakeupWriter = socket.socketpair()
+		self._wakeupReader.setblocking(0)
+		self._wakeupWriter.setblocking(0)
 		
-		self._socketThread = threading.Thread(target=socketThreadMain, args = (self._socket, self._socketSendQueue, self._socketReceiveQueue))
+		self._socketThread = threading.Thread(target=socketThreadMain, args = (self._socket, self._socketSendQueue, self._socketReceiveQueue, self._wakeupReader,
+			_ReceiveBuffer(maxSize=self._maxReadSize)))
 		self._socketThread.daemon = True
 		self._socketThread.start();
 
@@ -172,21 +334,49 @@ class Tcp:
 		self._callbackThread.daemon = True
 		self._callbackThread.start();
 
-	def stop(self):
-		'''stops the tcp thread and the socket and waits for it to clean itself up'''
+	def stop(self, flush=True, timeout=TCP_STOP_TIMEOUT):
+		'''stops the tcp thread and the socket and waits for it to clean itself up
+
+		flush => whether what was queued is sent before the socket is closed,
+		for at most timeout seconds. when it is False it is dropped instead'''
+
 		self._logger.debug('stopping the Tcp')
+		if not self._connection is None:
+			self._reactor.unregister(self._connection, timeout, flush)
+			self._connection = None
+			return
+
+		if not flush:
+			dropped = 0
+			try:
+				while True:
+					self._socketSendQueue.get_nowait()
+					dropped += 1
+			except Queue.Empty:
+				pass
+			if dropped:
+				self._logger.debug('dropped {0} unsent messages'.format(dropped))
+
 		self._socketSendQueue.put(
 			{
 				'type': 'control', 
 				'op': 'stop'
 			})
+		self._wake()
 		try:
+			# the thread is woken up by the stop message and may well have
+			# finished already, in which case join returns straight away
+			self._logger.debug('waiting for the tcp thread to stop itself...')
+			self._socketThread.join(timeout)
 			if self._socketThread.isAlive():
-				self._logger.debug('waiting for the tcp thread to stop itself...')
+				# the other side does not take what is left to send
+				self._logger.warn('closing a connection with unsent messages')
+				try:
+					self._socket.shutdown(socket.SHUT_RDWR)
+				except socket.error:
+					pass
 				self._socketThread.join()
-				self._logger.debug('tcp thread stopped :)')
-			else:
-				self._logger.warn('the socket thread was not alive anymore when the stop() method was called.')
+			self._logger.debug('tcp thread stopped :)')
 		except:
 			self._logger.warn('it looks like the socket was never started')
 
@@ -194,128 +384,35 @@ class Tcp:
 			if self._callbackThread.isAlive():
 				self._logger.debug('waiting for the callback thread to stop')
 				self._callbackMustStopvent.set()
+				# wakes it up rather than waiting for its next poll
+				self._socketReceiveQueue.put(None)
 				self._callbackThread.join()
 			else:
 				self._logger.warn('the callback thread was not alive anymore when the stop() method was called')
 		except:
 			self._logger.warn('it looks like the socket was never started')
 		
+		if not self._wakeupReader is None:
+			self._wakeupReader.close()
+			self._wakeupWriter.close()
 		self._logger.debug('done stopping, all done.')
 
+	def _wake(self):
+		try:
+			self._wakeupWriter.send('x')
+		except (socket.error, AttributeError):
+			# either there is a wakeup pending already (the buffer is
+			# full) or the channel has not been started
+			pass
+
 	def send(self, data, session=None):
+		if not self._connection is None:
+			self._reactor.send(self._connection, data)
+			return
 		# self._sessions.add(session)
 		self._socketSendQueue.put(
 			{
 				'type': 'message',
 				'contents': data
 			})
-
-
-mockLogger = logging.getLogger(__name__ + 'mocks')
-
-class MockSocket:
-
-	def __init__(self, recvs):
-		'''recvs => list of items. items must be either strings or the value True.
-		When True is read, a Queue.Empty will be raised
-
-		sends => similarly a list of items. items must be strings or the Value True.
-		When True is encountered, a Queue.Empty is raised'''
-		self._recvs = recvs
-		self._sends = []
-		self._closeCalled = False
-
-
-	def send(self, bs):
-		mockLogger.debug("Mock socket sending something: '{0}'".format(bs))
-		self._sends.append(bs)
-		return len(bs)
-
-	def recv(self, i):
-		if len(self._recvs) == 0:
-			mockLogger.debug("MockSocket raising timeout")
-			raise socket.timeout
-
-		res = self._recvs.pop(0)
-
-		if res == None:
-			mockLogger.debug("MockSocket raising timeout")
-			raise socket.timeout
-
-		mockLogger.debug("Mocket socket recv'ing something: '{0}'".format(res))
-		return res
-
-	def close(self):
-		self._closeCalled = True
-
-class MockQueue:
-
-	def __init__(self, gets, putsAllows):
-		'''gets => a list of things that will be read. Must be either a None or 
-		python item. For every None a Queue.Empty will be raised
-
-		putsAllows => an item corresponding to every puts invocation. True
-		accepts the put and False raises an Queue.Full'''
-		self._gets = gets
-		self._puts = []
-		self._putsAllows = putsAllows
-
-	def get_nowait(self):
-		res = self._gets.pop(0)
-		if res == None:
-			mockLogger.debug('MockQueue raising Queue.Empty')
-			raise Queue.Empty
-		mockLogger.debug("MockQueue getting '{0}'".format(res))
-		return res
-
-	def put_nowait(self, received):
-		allow = self._putsAllows.pop(0)
-		if allow:
-			mockLogger.debug("MockQueue putting: '{0}'".format(received))
-			self._puts.append(received)
-		else:
-			mockLogger.debug("MockQueue refusing to put, raising Queue.Full")
-			raise Queue.Full
-
-
-class TcpTests(unittest.TestCase):
-	def test_thread_read_1(self):
-		socketReceives = ['1234']
-		socket = MockSocket(socketReceives)
-
-		sendQueue = MockQueue(
-			[
-				None,  
-				{'type': 'message', 'contents': 'aoeu'},
-				None,
-				{'type': 'control', 'op': 'stop'}
-			], 
-			None)
-		receiveQueue = MockQueue(None, [True])
-		
-		stoppedEvent = threading.Event()
-
-		socketThreadMain(socket, sendQueue, receiveQueue, stoppedEvent)
-
-		self.assertTrue(stoppedEvent.is_set())
-		self.assertEquals('1234', receiveQueue._puts.pop())
-		self.assertEquals(1, len(socket._sends))
-		self.assertEquals('aoeu', socket._sends[0])
-
-
-
-
-if __name__ == '__main__':
-	logging.basicConfig(level=logging.DEBUG)
-	unittest.main()
-
-
-
-
-
-
-
-
-
-
-
+		self._wake()
@@ -0,0 +1,33 @@
+# /usr/bin/env python
+'''a channel over a unix domain socket, for nrepls on the same host. it
+works exactly like the Tcp channel, without the tcp/ip stack in between'''
+
+import logging, socket
+
+from tcp import Tcp, TCP_MAX_READ_BUFFER_SIZE, TCP_CONNECT_TIMEOUT
+
+class UnixSocket(Tcp):
+	'''provides an abstraction over a connection to a unix domain socket'''
+
+	def __init__(self, path, dataReceivedCallback=None,
+		sendBufferSize=None, receiveBufferSize=None, maxReadSize=TCP_MAX_READ_BUFFER_SIZE,
+		reactor=None, connectTimeout=TCP_CONNECT_TIMEOUT):
+		'''path => the file system path of the socket to connect to
+
+		the other parameters are the same as for Tcp'''
+
+		Tcp.__init__(self, None, None, dataReceivedCallback,
+			sendBufferSize=sendBufferSize, receiveBufferSize=receiveBufferSize,
+			maxReadSize=maxReadSize, reactor=reactor, connectTimeout=connectTimeout)
+		self._logger = logging.getLogger(__name__ + '.UnixSocket_logger')
+		self._path = path
+
+	def _connect(self):
+		isocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			isocket.settimeout(self._connectTimeout)
+			isocket.connect(self._path)
+		except socket.error:
+			isocket.close()
+			raise
+		return isocket
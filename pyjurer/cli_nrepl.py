@@ -1,7 +1,210 @@
 #! /usr/bin/env python
 # a python-based nrepl client for clojure
+'''reads clojure forms from files or stdin, pipelines them over a single
+nrepl connection and writes one json record per form to stdout:
 
-from session_container import create_bcode_over_tcp_session
+{"form": 0, "code": "(+ 1 2)", "value": ["3"], "out": "", "err": "",
+ "status": "done", "latency_ms": 0.81}
 
-session = create_bcode_over_tcp_session('localhost', )
+status is "done", "eval-error" or "timeout"'''
 
+import argparse, json, logging, sys, threading, time
+
+from forms import split_forms_incrementally
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 64
+
+class _Record(object):
+	'''accumulates the responses for one form'''
+
+	__slots__ = ('index', 'code', 'values', 'out', 'err', 'status', 'started')
+
+	def __init__(self, index, code):
+		self.index = index
+		self.code = code
+		self.values = []
+		self.out = []
+		self.err = []
+		self.status = 'done'
+		self.started = time.time()
+
+	def to_json(self, finished):
+		return json.dumps({
+			'form': self.index,
+			'code': self.code,
+			'value': self.values,
+			'out': ''.join(self.out),
+			'err': ''.join(self.err),
+			'status': self.status,
+			'latency_ms': round((finished - self.started) * 1000, 3)
+		})
+
+class BatchRunner(object):
+	'''evaluates a sequence of forms on one session, keeping at most
+	window of them in flight, and writes a json line per result'''
+
+	def __init__(self, session, output, window=DEFAULT_WINDOW):
+		'''session => an NREPLSession
+		output => file-like object that receives the json lines
+		window => the maximum number of evals that are sent but not done'''
+
+		self._session = session
+		self._output = output
+		self._window = window
+		self._outputLock = threading.Lock()
+		# the records in flight by index, which the window is counted in
+		self._pending = {}
+		self._allDone = threading.Condition(threading.Lock())
+		self.completed = 0
+		self.errors = 0
+
+	def _done(self, record):
+		self._allDone.acquire()
+		try:
+			if self._pending.pop(record.index, None) is None:
+				# already reported as timed out
+				return
+			self.completed += 1
+			if record.status != 'done':
+				self.errors += 1
+			self._allDone.notify_all()
+		finally:
+			self._allDone.release()
+		self._write(record)
+
+	def _write(self, record):
+		line = record.to_json(time.time()) + '\n'
+		self._outputLock.acquire()
+		try:
+			self._output.write(line)
+		finally:
+			self._outputLock.release()
+
+	def _time_out(self, records):
+		for record in records:
+			record.status = 'timeout'
+			self._write(record)
+		self._allDone.acquire()
+		try:
+			self.errors += len(records)
+		finally:
+			self._allDone.release()
+
+	def submit(self, index, code, timeout=None):
+		'''sends one form, blocking while the in-flight window is full for at
+		most timeout seconds. returns the id of the eval, or None when the
+		window did not open in time and the form was not sent'''
+
+		deadline = None if timeout is None else time.time() + timeout
+		self._allDone.acquire()
+		try:
+			while len(self._pending) >= self._window:
+				remaining = None if deadline is None else deadline - time.time()
+				if remaining is not None and remaining <= 0:
+					return None
+				self._allDone.wait(remaining)
+			record = _Record(index, code)
+			self._pending[index] = record
+		finally:
+			self._allDone.release()
+
+		def error(s, id_):
+			record.status = 'eval-error'
+
+		return self._session.eval(code,
+			value=lambda s, id_, v: record.values.append(v),
+			stdout=lambda s, id_, out: record.out.append(out),
+			stderr=lambda s, id_, err: record.err.append(err),
+			error=error,
+			done=lambda s, id_: self._done(record))
+
+	def run(self, forms, timeout=None):
+		'''submits every form in forms, in order, waiting at most timeout
+		seconds for room in the window each time. when none is made, the
+		nrepl is taken to be gone: the forms that are left are written out
+		with the status "timeout" without being sent and False is returned'''
+
+		forms = enumerate(forms)
+		for index, code in forms:
+			if self.submit(index, code, timeout) is None:
+				logger.warn('no form finished within {0} seconds, giving up'.format(timeout))
+				self._time_out([_Record(index, code)] + [_Record(i, c) for i, c in forms])
+				return False
+		return True
+
+	def wait(self, timeout=None):
+		'''waits for the in-flight forms. the ones that did not finish
+		within timeout are written out with the status "timeout". returns
+		True when everything finished'''
+
+		deadline = None if timeout is None else time.time() + timeout
+		self._allDone.acquire()
+		try:
+			while self._pending:
+				remaining = None if deadline is None else deadline - time.time()
+				if remaining is not None and remaining <= 0:
+					break
+				self._allDone.wait(remaining)
+
+			timedOut = sorted(self._pending.values(), key=lambda r: r.index)
+			self._pending.clear()
+		finally:
+			self._allDone.release()
+
+		self._time_out(timedOut)
+		return len(timedOut) == 0
+
+def read_forms(paths):
+	'''generates the forms of the files in paths, '-' meaning stdin. they
+	are read a line at a time and every form is generated as soon as its
+	last line is read, so the forms piped in are evaluated as they come'''
+
+	for path in paths:
+		if path == '-':
+			# readline, as iterating over the file reads ahead
+			for form in split_forms_incrementally(iter(sys.stdin.readline, '')):
+				yield form
+		else:
+			with open(path) as f:
+				for form in split_forms_incrementally(iter(f.readline, '')):
+					yield form
+
+if __name__ == '__main__':
+	from session_container import create_bcode_over_tcp_session_container, stop_bcode_over_tcp_session_container
+
+	cliParser = argparse.ArgumentParser(description="Evaluates clojure forms on a nrepl and writes the results as newline-delimited json")
+	cliParser.add_argument("-ll", "--logLevel", help="The logging verbosity", default='WARNING', choices=['DEBUG', 'WARNING', 'INFO', 'ERROR', 'CRITICAL'])
+	cliParser.add_argument("-n", "--hostname", help="The hostname to connect to. Default = 'localhost'", default="localhost")
+	cliParser.add_argument("-w", "--window", type=int, help="The maximum number of forms in flight. Default = {0}".format(DEFAULT_WINDOW), default=DEFAULT_WINDOW)
+	cliParser.add_argument("-t", "--timeout", type=float, help="Seconds to wait for the session, for room in the window and for outstanding results after the last form was sent", default=None)
+	cliParser.add_argument("-r", "--record", help="Appends the traffic of the connection to this file, see channels/recording.py", default=None)
+	cliParser.add_argument("port", type=int, help="The port to connect to")
+	cliParser.add_argument("files", nargs='*', default=['-'], help="Files to read forms from, '-' is stdin. Default = stdin")
+	args = cliParser.parse_args()
+
+	effectiveLogLevel = getattr(logging, args.logLevel.upper(), None)
+	logging.basicConfig(level=effectiveLogLevel, stream=sys.stderr)
+
+	sessionContainer = create_bcode_over_tcp_session_container(args.hostname, args.port, record=args.record)
+
+	sessionReady = threading.Event()
+	def new_session_callback(s):
+		new_session_callback.session = s
+		sessionReady.set()
+	sessionContainer.create_new_session(new_session_callback)
+	if not sessionReady.wait(args.timeout):
+		logger.error('no session within {0} seconds'.format(args.timeout))
+		stop_bcode_over_tcp_session_container(sessionContainer, flush=False)
+		sys.exit(1)
+
+	runner = BatchRunner(new_session_callback.session, sys.stdout, args.window)
+	try:
+		runner.run(read_forms(args.files), args.timeout)
+		runner.wait(args.timeout)
+	finally:
+		sys.stdout.flush()
+		stop_bcode_over_tcp_session_container(sessionContainer)
+
+	sys.exit(1 if runner.errors else 0)
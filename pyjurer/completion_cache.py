@@ -0,0 +1,253 @@
+#! /usr/bin/env python
+'''client-side cache for the lookups an editor makes on every keystroke:
+completions, symbol info and eldoc. completions are answered from a sorted
+index per namespace, searched with bisect, so a hit never leaves the process'''
+
+import bisect, logging, re, threading, time
+
+from forms import namespace_of
+
+logger = logging.getLogger(__name__)
+
+# prints the name of every var that can be referred to unqualified from the
+# namespace, one per line
+_PREFETCH_CODE = ("(clojure.core/doseq [[k v] (clojure.core/ns-map '{0}) "
+	":when (clojure.core/var? v)] (clojure.core/println k))")
+
+# seconds a namespace that could not be indexed is not tried again for
+PREFETCH_RETRY_INTERVAL = 30.0
+
+# what can be quoted into _PREFETCH_CODE as the name of a namespace
+_NAMESPACE = re.compile(r'''[^\s,()\[\]{}"';`~^@#\\:/0-9][^\s,()\[\]{}"';`~^@\\/]*\Z''')
+
+def _prefix_range(names, prefix):
+	'''returns the slice of the sorted list names that starts with prefix.
+	names are utf-8 encoded, which never contains the byte 0xff, so that
+	sorts after anything that starts with prefix'''
+
+	lo = bisect.bisect_left(names, prefix)
+	hi = bisect.bisect_left(names, prefix + '\xff', lo)
+	return names[lo:hi]
+
+class CompletionCache(object):
+	'''answers complete, info and eldoc requests for a session, going to
+	the nrepl only when the answer is not known locally.
+
+	completions for unqualified prefixes come from an index of every var
+	visible in the namespace, which is prefetched in the background the
+	first time the namespace is asked about and again whenever a file
+	declaring it is loaded with load_file on the session. other prefixes,
+	like 'str/jo', are asked for once and then narrowed down locally as
+	the prefix grows.
+
+	narrowing down by prefix drops the candidates a server that matches
+	fuzzily, or by camel case, would have for the longer prefix, so the
+	cache only does it once the completions the session got showed plain
+	prefix matching, and never again once they did not.
+
+	the prefetch evals run on a session of their own, so they neither
+	clobber *1 and *e on the session nor queue behind its evals'''
+
+	def __init__(self, session, prefetchSession=None):
+		'''session => the NREPLSession used for cache misses
+		prefetchSession => the NREPLSession the prefetch evals run on. by
+		default one is created on the first prefetch, on the container session
+		belongs to, and closed by close()'''
+
+		self._session = session
+		self._prefetchSession = prefetchSession
+		self._ownsPrefetchSession = prefetchSession is None
+		# the prefetches waiting for the prefetch session to be created
+		self._waiting = None
+		self._closed = False
+		# guards the caches, the callbacks come in on the channel's threads
+		self._lock = threading.Lock()
+		self._index = {}
+		self._prefetching = set()
+		# when each namespace that could not be indexed last failed
+		self._failed = {}
+		self._completions = {}
+		# whether the server matches prefixes plainly, None until it is known
+		self._plainMatching = None
+		self._info = {}
+		self._eldoc = {}
+
+		session.add_load_file_listener(self._file_loaded)
+
+	def lookup_completions(self, prefix, ns):
+		'''returns the sorted candidates for prefix in ns from the cache,
+		or None when they are not known locally'''
+
+		with self._lock:
+			names = self._completions.get((ns, prefix))
+			if names is not None:
+				return names
+			if not self._plainMatching:
+				return None
+
+			if '/' not in prefix:
+				names = self._index.get(ns)
+				if names is not None:
+					return _prefix_range(names, prefix)
+
+			# the candidates for a prefix are a subset of the candidates for
+			# any shorter prefix, so the longest cached one can be narrowed down
+			for i in range(len(prefix) - 1, -1, -1):
+				names = self._completions.get((ns, prefix[:i]))
+				if names is not None:
+					return _prefix_range(names, prefix)
+
+		return None
+
+	def complete(self, prefix, ns, completions):
+		'''calls completions with the session and the sorted list of candidate
+		names for prefix in ns, synchronously when they are cached'''
+
+		cached = self.lookup_completions(prefix, ns)
+		if cached is not None:
+			completions(self._session, cached)
+			return
+
+		if ns not in self._index:
+			self.prefetch(ns)
+
+		def received(s, result):
+			names = sorted(set(c['candidate'] for c in result))
+			plain = all(name.startswith(prefix) for name in names)
+			with self._lock:
+				self._completions[(ns, prefix)] = names
+				if not plain:
+					if self._plainMatching != False:
+						logger.debug("the server matches '{0}' fuzzily, completions are not narrowed down".format(prefix))
+					self._plainMatching = False
+				elif self._plainMatching is None:
+					self._plainMatching = True
+			completions(s, names)
+
+		self._session.complete(prefix, ns, completions=received)
+
+	def info(self, symbol, ns, info):
+		'''calls info with the session and the info map of symbol in ns,
+		synchronously when it is cached'''
+
+		self._cached_symbol_lookup(self._info, self._session.info, symbol, ns, info)
+
+	def eldoc(self, symbol, ns, eldoc):
+		'''calls eldoc with the session and the eldoc map of symbol in ns,
+		synchronously when it is cached'''
+
+		self._cached_symbol_lookup(self._eldoc, self._session.eldoc, symbol, ns, eldoc)
+
+	def _cached_symbol_lookup(self, cache, command, symbol, ns, callback):
+		key = (ns, symbol)
+		with self._lock:
+			cached = cache.get(key)
+		if not cached is None:
+			callback(self._session, cached)
+			return
+
+		def received(s, result):
+			with self._lock:
+				cache[key] = result
+			callback(s, result)
+
+		command(symbol, ns, received)
+
+	def prefetch(self, ns):
+		'''loads the index of the vars visible in ns in the background. a
+		namespace that could not be indexed is not tried again for
+		PREFETCH_RETRY_INTERVAL seconds, or until a file declaring it is
+		loaded, and a name that is not a symbol is never tried'''
+
+		if not _NAMESPACE.match(ns):
+			logger.debug("not indexing '{0}', which is not a namespace name".format(ns))
+			return
+		with self._lock:
+			if ns in self._prefetching:
+				return
+			failedAt = self._failed.get(ns)
+			if not failedAt is None and time.time() - failedAt < PREFETCH_RETRY_INTERVAL:
+				return
+			self._prefetching.add(ns)
+
+		out = []
+		def error(s, id_):
+			error.failed = True
+		error.failed = False
+
+		def done(s, id_):
+			with self._lock:
+				self._prefetching.discard(ns)
+				if error.failed:
+					self._failed[ns] = time.time()
+				else:
+					self._failed.pop(ns, None)
+					self._index[ns] = names = sorted(set(''.join(out).split()))
+			if error.failed:
+				logger.debug('unable to index {0}'.format(ns))
+			else:
+				logger.debug('indexed {0} symbols for {1}'.format(len(names), ns))
+
+		self._on_prefetch_session(lambda session: session.eval(_PREFETCH_CODE.format(ns),
+			stdout=lambda s, id_, v: out.append(v),
+			error=error, done=done))
+
+	def _on_prefetch_session(self, run):
+		'''calls run with the prefetch session, once it is created'''
+
+		with self._lock:
+			if self._closed:
+				return
+			session = self._prefetchSession
+			if session is None:
+				create = self._waiting is None
+				if create:
+					self._waiting = []
+				self._waiting.append(run)
+		if not session is None:
+			run(session)
+		elif create:
+			self._session._channel.create_new_session(self._prefetch_session_created)
+
+	def _prefetch_session_created(self, session):
+		with self._lock:
+			closed = self._closed
+			if not closed:
+				self._prefetchSession = session
+			waiting, self._waiting = self._waiting, None
+		if closed:
+			session.close()
+			return
+		for run in waiting:
+			run(session)
+
+	def close(self):
+		'''closes the prefetch session, when the cache created it. nothing is
+		prefetched afterwards'''
+
+		with self._lock:
+			self._closed = True
+			session = self._prefetchSession if self._ownsPrefetchSession else None
+			self._prefetchSession = None
+		if not session is None:
+			session.close()
+
+	def invalidate(self, ns):
+		'''forgets everything cached about ns, including the info about its
+		vars that was looked up from other namespaces'''
+
+		with self._lock:
+			self._index.pop(ns, None)
+			self._failed.pop(ns, None)
+			for key in [k for k in self._completions if k[0] == ns]:
+				self._completions.pop(key, None)
+			for cache in (self._info, self._eldoc):
+				for key in [k for k, v in cache.items() if k[0] == ns or v.get('ns') == ns]:
+					cache.pop(key, None)
+
+	def _file_loaded(self, session, fileContents):
+		ns = namespace_of(fileContents)
+		if ns is None:
+			return
+		self.invalidate(ns)
+		self.prefetch(ns)
@@ -0,0 +1,377 @@
+#! /usr/bin/env python
+'''reads the printed clojure values that evals answer with, edn, into
+python data:
+
+maps => dict, vectors and lists => list, sets => set, keywords => Keyword,
+symbols => Symbol, nil, true and false => None, True and False, integers
+=> int (with or without N, octal with a leading 0), decimals with M => decimal.Decimal, ratios =>
+fractions.Fraction, other numbers => float, strings and characters => str
+and tagged literals => TaggedLiteral, or what the tag's handler makes of
+the value, like uuid.UUID for #uuid.
+
+the keys of a namespaced map, #:ns{:a 1}, are qualified with its namespace
+like clojure does, {:ns/a 1}.
+
+a vector, map or set that is the key of a map or the member of a set is
+turned into a tuple, frozenset of items or frozenset, so it can be hashed.
+
+the text is split into tokens by one regular expression and read in one
+pass over them, built up on a stack instead of recursively, so deeply nested values do
+not run into the recursion limit. every keyword and symbol is made once
+and reused for as long as it is in use, the way clojure interns them,
+which saves both the parsing of their names and the memory of a
+collection that has the same keys over and over. the table they are
+interned in only holds them weakly, so the names of the values that are
+gone do not pile up.
+
+it is plain python. on the machine bench/bench_edn.py was last run on it
+reads about 4 MB of printed records a second, a third of the speed of
+json.loads on the same data, and a tenth of it on vectors of numbers. a
+4 MB collection has been seen to take 2.65 s on a first read, so values
+that big are better printed as json or kept on the server'''
+
+import decimal, fractions, itertools, re, uuid, weakref
+
+class _Named(object):
+	'''there is only ever one of each name, so names compare and hash by
+	identity'''
+
+	__slots__ = ('namespace', 'name', '__weakref__')
+
+	def __new__(cls, name, namespace=None):
+		text = name if namespace is None else '{0}/{1}'.format(namespace, name)
+		result = cls._interned.get(text)
+		if result is None:
+			result = object.__new__(cls)
+			result.namespace = namespace
+			result.name = name
+			result = cls._interned.setdefault(text, result)
+		return result
+
+	def __reduce__(self):
+		return (type(self), (self.name, self.namespace))
+
+	def __str__(self):
+		return self.name if self.namespace is None else '{0}/{1}'.format(self.namespace, self.name)
+
+class Keyword(_Named):
+	'''a keyword, :name or :namespace/name'''
+
+	__slots__ = ()
+	_interned = weakref.WeakValueDictionary()
+
+	def __repr__(self):
+		return ':' + str(self)
+
+class Symbol(_Named):
+	'''a symbol, name or namespace/name'''
+
+	__slots__ = ()
+	_interned = weakref.WeakValueDictionary()
+
+	def __repr__(self):
+		return str(self)
+
+class TaggedLiteral(object):
+	'''a value with a tag that has no handler, like #inst "2017-01-01T00:00:00.000-00:00"'''
+
+	__slots__ = ('tag', 'value')
+
+	def __init__(self, tag, value):
+		self.tag = tag
+		self.value = value
+
+	def __eq__(self, other):
+		return type(other) is TaggedLiteral and other.tag == self.tag and other.value == self.value
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash((self.tag, _hashable(self.value)))
+
+	def __repr__(self):
+		return '#{0} {1!r}'.format(self.tag, self.value)
+
+# the handlers of the tags that are read into something other than a TaggedLiteral
+TAG_HANDLERS = {
+	'uuid': uuid.UUID
+}
+
+def _split_name(text):
+	slash = text.find('/')
+	if slash <= 0 or text == '/':
+		return text, None
+	return text[slash + 1:], text[:slash]
+
+def keyword(text):
+	'''the Keyword for text, without the colon'''
+
+	return Keyword._interned.get(text) or Keyword(*_split_name(text))
+
+def symbol(text):
+	'''the Symbol for text'''
+
+	return Symbol._interned.get(text) or Symbol(*_split_name(text))
+
+_TOKEN = re.compile(r'''
+	(?:[\s,]|;[^\n]*(?:\n|\Z))*                  # whitespace, commas and comments
+	(
+		"(?:[^"\\]|\\.)*"                         # strings
+		|\#"(?:[^"\\]|\\.)*"                      # regular expressions
+		|\#[{_']                                  # sets, discards and vars
+		|\#\#?[^\s,()\[\]{}"\\;]+                 # tags and symbolic values
+		|\\(?:[a-z]{2,}|u[0-9a-fA-F]{4}|[\xc0-\xff][\x80-\xbf]+|.)   # characters
+		|[()\[\]{}]
+		|[^\s,()\[\]{}"\\;]+                      # numbers, keywords, symbols and constants
+		|.                                        # anything else, which is an error
+	)?''', re.VERBOSE | re.DOTALL)
+
+_ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{4}|.)', re.DOTALL)
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', '\\': '\\'}
+
+_CHARACTERS = {'newline': '\n', 'space': ' ', 'tab': '\t', 'return': '\r',
+	'backspace': '\b', 'formfeed': '\f'}
+
+_CONSTANTS = {'nil': None, 'true': True, 'false': False}
+_SYMBOLIC = {'##Inf': float('inf'), '##-Inf': float('-inf'), '##NaN': float('nan')}
+
+_DIGITS = '0123456789'
+
+# the kinds of the frames on the stack
+_LIST, _VECTOR, _MAP, _SET, _TAG, _DISCARD = range(6)
+_OPENERS = {'(': (_LIST, ')'), '[': (_VECTOR, ']'), '{': (_MAP, '}')}
+
+_NOTHING = object()
+
+def _unescape(match):
+	escaped = match.group(1)
+	if escaped[0] == 'u' and len(escaped) == 5:
+		return unichr(int(escaped[1:], 16)).encode('utf8')
+	try:
+		return _ESCAPES[escaped]
+	except KeyError:
+		raise ValueError('unsupported escape \\{0}'.format(escaped))
+
+def _string(token):
+	text = token[1:-1]
+	if '\\' in text:
+		text = _ESCAPE.sub(_unescape, text)
+	return text
+
+def _character(token):
+	name = token[1:]
+	if not name:
+		raise ValueError('a character needs a name')
+	if len(name) > 1:
+		if name in _CHARACTERS:
+			return _CHARACTERS[name]
+		if name[0] == 'u' and len(name) == 5:
+			return unichr(int(name[1:], 16)).encode('utf8')
+		if ord(name[0]) < 0xc0:
+			raise ValueError('unsupported character {0}'.format(token))
+	return name
+
+def _integer(text):
+	'''a decimal integer, or an octal one when it starts with a 0'''
+
+	digits = text.lstrip('+-')
+	if len(digits) > 1 and digits[0] == '0':
+		return int(text, 8)
+	return int(text)
+
+def _number(token):
+	if 'x' in token or 'X' in token:
+		return int(token, 16)
+	last = token[-1]
+	if last == 'M':
+		return decimal.Decimal(token[:-1])
+	if '.' in token or 'e' in token or 'E' in token:
+		return float(token)
+	if last == 'N':
+		return _integer(token[:-1])
+	if 'r' in token or 'R' in token:
+		radix, digits = token.replace('R', 'r').split('r')
+		sign = -1 if radix[0] == '-' else 1
+		return sign * int(digits, abs(int(radix)))
+	if '/' in token:
+		numerator, denominator = token.split('/')
+		return fractions.Fraction(int(numerator), int(denominator))
+	return _integer(token)
+
+def _hashable(value):
+	'''value, or a hashable equivalent of it'''
+
+	if isinstance(value, list):
+		return tuple(_hashable(v) for v in value)
+	if isinstance(value, dict):
+		return frozenset((_hashable(k), _hashable(v)) for k, v in value.iteritems())
+	if isinstance(value, set):
+		return frozenset(_hashable(v) for v in value)
+	return value
+
+def _make_map(items):
+	if len(items) % 2:
+		raise ValueError('a map needs an even number of forms')
+	pairs = iter(items)
+	try:
+		return dict(itertools.izip(pairs, pairs))
+	except TypeError:
+		pairs = iter(items)
+		return dict((_hashable(k), v) for k, v in itertools.izip(pairs, pairs))
+
+def _make_set(items):
+	try:
+		return set(items)
+	except TypeError:
+		return set(_hashable(v) for v in items)
+
+def _qualified(key, namespace):
+	if isinstance(key, _Named):
+		if key.namespace is None:
+			return type(key)(key.name, namespace)
+		if key.namespace == '_':
+			return type(key)(key.name)
+	return key
+
+def _namespaced_map(namespace):
+	'''the handler of #:namespace, which qualifies the keywords and symbols
+	that are the keys of the map after it and have no namespace of their
+	own. the namespace _ takes the one they have away'''
+
+	def qualify(value):
+		if not isinstance(value, dict):
+			raise ValueError('a namespaced map needs a map')
+		return dict((_qualified(k, namespace), v) for k, v in value.iteritems())
+	return qualify
+
+def _tag_handler(tag, handlers):
+	handler = handlers.get(tag)
+	if handler is None:
+		return lambda value: TaggedLiteral(tag, value)
+	return handler
+
+def loads(text, tags=None, ns=None):
+	'''reads the one value printed in text.
+
+	tags => optional handlers by tag, like {'inst': parse_instant}, that
+	are called with the value read after the tag, on top of TAG_HANDLERS
+	ns => optional namespace the text was printed in, which the keys of the
+	auto-resolved namespaced maps, #::{:a 1}, are qualified with. without it
+	they cannot be read'''
+
+	handlers = TAG_HANDLERS if tags is None else dict(TAG_HANDLERS, **tags)
+	# the keywords and symbols read so far by their tokens, a plain dict
+	# is quicker to look them up in than the weak tables they are interned in
+	named = {}
+	constants = _CONSTANTS
+	digits = _DIGITS
+	# [kind, items or tag handler, closer, append of the items or None]
+	stack = []
+	# the append of the collection being read, None when the value has to
+	# go through the tags and discards on the stack or is the result
+	append = None
+	tokens = _TOKEN.findall(text)
+	# the whitespace at the end is matched with no token
+	while tokens and not tokens[-1]:
+		tokens.pop()
+	tokens = iter(tokens)
+
+	for token in tokens:
+		c = token[0]
+
+		if c == ':':
+			value = named.get(token)
+			if value is None:
+				value = named[token] = keyword(token[1:])
+		elif c == '"':
+			if len(token) == 1:
+				raise ValueError('unterminated string')
+			value = _string(token)
+		elif c in '([{':
+			kind, closer = _OPENERS[c]
+			items = []
+			append = items.append
+			stack.append([kind, items, closer, append])
+			continue
+		elif c in ')]}':
+			if not stack or stack[-1][2] != c:
+				raise ValueError("unexpected '{0}'".format(c))
+			kind, items, closer, append = stack.pop()
+			if kind == _MAP:
+				value = _make_map(items)
+			elif kind == _SET:
+				value = _make_set(items)
+			else:
+				value = items
+			append = stack[-1][3] if stack else None
+		elif token.isdigit():
+			value = int(token) if c != '0' else _integer(token)
+		elif c in digits or ((c == '-' or c == '+') and len(token) > 1 and token[1] in digits):
+			value = _number(token)
+		elif c == '#':
+			if token == '#{':
+				items = []
+				append = items.append
+				stack.append([_SET, items, '}', append])
+				continue
+			elif token == '#_':
+				stack.append([_DISCARD, None, None, None])
+				append = None
+				continue
+			elif token == "#'":
+				stack.append([_TAG, _tag_handler('var', handlers), None, None])
+				append = None
+				continue
+			elif token == '#':
+				raise ValueError("unreadable '#'")
+			elif token[1] == '"':
+				value = TaggedLiteral('regex', token[2:-1])
+			elif token in _SYMBOLIC:
+				value = _SYMBOLIC[token]
+			elif token[1] == ':':
+				namespace = token[2:]
+				if namespace == ':':
+					if ns is None:
+						raise ValueError('#::{} needs the namespace it was printed in')
+					namespace = ns
+				elif not namespace or namespace[0] == ':':
+					raise ValueError('unsupported namespaced map {0}'.format(token))
+				stack.append([_TAG, _namespaced_map(namespace), None, None])
+				append = None
+				continue
+			else:
+				stack.append([_TAG, _tag_handler(token[1:], handlers), None, None])
+				append = None
+				continue
+		elif c == '\\':
+			value = _character(token)
+		elif token in constants:
+			value = constants[token]
+		else:
+			value = named.get(token)
+			if value is None:
+				value = named[token] = symbol(token)
+
+		if not append is None:
+			append(value)
+			continue
+
+		# applies the tags and discards waiting for the value
+		while stack and stack[-1][0] >= _TAG:
+			kind, handler, closer, append = stack.pop()
+			if kind == _DISCARD:
+				value = _NOTHING
+				break
+			value = handler(value)
+		append = stack[-1][3] if stack else None
+		if value is _NOTHING:
+			continue
+		if not append is None:
+			append(value)
+		elif not stack:
+			for token in tokens:
+				raise ValueError('more than one value')
+			return value
+
+	raise ValueError('the text ends before its value does')
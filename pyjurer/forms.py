@@ -0,0 +1,270 @@
+#! /usr/bin/env python
+'''splits clojure source text into its top-level forms without evaluating
+or fully parsing them. this is used to pipeline the forms of a file one
+eval at a time instead of sending the file as a whole'''
+
+_WHITESPACE = ' \t\r\n,'
+_DELIMITERS = _WHITESPACE + '()[]{}";'
+_CLOSERS = {'(': ')', '[': ']', '{': '}'}
+# the clauses of an ns form that load other namespaces
+_REQUIRE_CLAUSES = (':require', ':use', ':require-macros', ':use-macros')
+# the unfinished text past which split_forms_incrementally waits for half as
+# much again before it looks for the end of the form again
+_RESCAN_SIZE = 65536
+
+class IncompleteForm(ValueError):
+	'''the text ends inside a form, which more text may finish'''
+
+def _skip_ws(text, i):
+	'''returns the index of the first character at or after i which is not
+	whitespace or part of a comment'''
+
+	n = len(text)
+	while i < n:
+		c = text[i]
+		if c in _WHITESPACE:
+			i += 1
+		elif c == ';' or text.startswith('#!', i):
+			nl = text.find('\n', i)
+			i = n if nl == -1 else nl + 1
+		else:
+			break
+	return i
+
+def _token_end(text, i):
+	n = len(text)
+	while i < n and text[i] not in _DELIMITERS:
+		i += 1
+	return i
+
+def _string_end(text, i):
+	'''i points at the opening quote'''
+
+	i += 1
+	n = len(text)
+	while i < n:
+		c = text[i]
+		if c == '\\':
+			i += 2
+		elif c == '"':
+			return i + 1
+		else:
+			i += 1
+	raise IncompleteForm('unterminated string')
+
+def _next_form_end(text, i):
+	i = _skip_ws(text, i)
+	if i >= len(text):
+		raise IncompleteForm('expected a form at the end of the input')
+	return _form_end(text, i)
+
+def _form_end(text, i):
+	'''returns the index just past the form that starts at i'''
+
+	c = text[i]
+
+	if c in _CLOSERS:
+		closer = _CLOSERS[c]
+		i += 1
+		while True:
+			i = _skip_ws(text, i)
+			if i >= len(text):
+				raise IncompleteForm("unbalanced form, missing '{0}'".format(closer))
+			if text[i] == closer:
+				return i + 1
+			if text[i] in ')]}':
+				raise ValueError("unexpected '{0}' at offset {1}".format(text[i], i))
+			i = _form_end(text, i)
+
+	if c in ')]}':
+		raise ValueError("unexpected '{0}' at offset {1}".format(c, i))
+
+	if c == '"':
+		return _string_end(text, i)
+
+	if c == '\\':
+		# a character literal, the character itself may be a delimiter
+		return _token_end(text, i + 2)
+
+	if c in "'`@":
+		return _next_form_end(text, i + 1)
+
+	if c == '~':
+		return _next_form_end(text, i + (2 if text.startswith('~@', i) else 1))
+
+	if c == '^':
+		return _next_form_end(text, _next_form_end(text, i + 1))
+
+	if c == '#':
+		d = text[i + 1:i + 2]
+		if d in ('{', '(', '"'):
+			return _form_end(text, i + 1)
+		if d in ('_', "'", '='):
+			return _next_form_end(text, i + 2)
+		if d == '?':
+			return _next_form_end(text, i + (3 if text.startswith('#?@', i) else 2))
+		if d == '#':
+			return _token_end(text, i + 2)
+		if d == ':':
+			return _next_form_end(text, _token_end(text, i + 2))
+		# a tagged literal, the tag is followed by the form it applies to
+		return _next_form_end(text, _token_end(text, i + 1))
+
+	return _token_end(text, i)
+
+def split_forms(text):
+	'''generates the top-level forms in text as strings, in order
+
+	>>> list(split_forms('(ns foo) ; a comment\\n(defn f [x] "a ) string") :kw'))
+	['(ns foo)', '(defn f [x] "a ) string")', ':kw']
+
+	raises ValueError when the text ends inside an unfinished form'''
+
+	i = _skip_ws(text, 0)
+	while i < len(text):
+		end = _form_end(text, i)
+		yield text[i:end]
+		i = _skip_ws(text, end)
+
+def split_forms_incrementally(chunks):
+	'''generates the top-level forms in the strings chunks generates, like
+	split_forms does for all of them joined, each as soon as the chunk that
+	finishes it is read
+
+	>>> list(split_forms_incrementally(['(ns foo) (defn f\\n', '  [x])\\n', ':kw']))
+	['(ns foo)', '(defn f\\n  [x])', ':kw']
+
+	raises ValueError when the chunks end inside an unfinished form'''
+
+	text = ''
+	rescanAt = 0
+	for chunk in chunks:
+		text += chunk
+		if len(text) < rescanAt:
+			continue
+		# up to the end of the last form handed on, the whitespace and
+		# comments after it are skipped again with the next chunk
+		consumed = 0
+		try:
+			i = _skip_ws(text, 0)
+			while i < len(text):
+				end = _form_end(text, i)
+				if end >= len(text):
+					# a symbol or a number may go on in the next chunk
+					break
+				yield text[i:end]
+				consumed = end
+				i = _skip_ws(text, end)
+		except IncompleteForm:
+			pass
+		text = text[consumed:]
+		rescanAt = len(text) + len(text) // 2 if len(text) > _RESCAN_SIZE else 0
+
+	for form in split_forms(text):
+		yield form
+
+def _ns_form(text):
+	'''returns the first ns form in text, or None'''
+
+	for form in split_forms(text):
+		if form.startswith('(ns') and form[3:4] in _WHITESPACE:
+			return form
+	return None
+
+def _strip_meta(form):
+	while form.startswith('^'):
+		form = form[_skip_ws(form, _form_end(form, _skip_ws(form, 1))):]
+	return form
+
+def _namespace_in(text):
+	form = _ns_form(text)
+	if form is None:
+		return None
+	i = _skip_ws(form, 3)
+	while form.startswith('^', i):
+		i = _skip_ws(form, _form_end(form, i + 1))
+	return form[i:_token_end(form, i)] or None
+
+def _inside(form):
+	'''the forms inside a list or vector form'''
+
+	return list(split_forms(form[1:-1]))
+
+def _libspec_namespaces(spec, prefix=''):
+	'''the namespaces a libspec of a require or use refers to'''
+
+	spec = _strip_meta(spec)
+	if spec.startswith('#?'):
+		# a reader conditional, the clojure branch counts
+		splice = spec.startswith('#?@')
+		choices = _inside(spec[_skip_ws(spec, 3 if splice else 2):])
+		for feature, form in zip(choices[::2], choices[1::2]):
+			if feature in (':clj', ':default'):
+				if not splice:
+					return _libspec_namespaces(form, prefix)
+				return [n for s in _inside(form) for n in _libspec_namespaces(s, prefix)]
+		return []
+	if spec[:1] in ('(', '['):
+		parts = _inside(spec)
+		if not parts:
+			return []
+		lib = prefix + _strip_meta(parts[0])
+		rest = parts[1:]
+		if spec[0] == '[' and (not rest or rest[0].startswith(':')):
+			return [lib]
+		# a prefix list, (prefix a b) or [prefix [a :as x] b]
+		return [n for part in rest for n in _libspec_namespaces(part, lib + '.')]
+	if spec[:1] in (':', '"', ''):
+		# flags like :reload and the strings of npm libraries
+		return []
+	return [prefix + spec]
+
+def namespace_of(text, head=65536):
+	'''returns the name of the namespace declared by the first ns form in
+	text, or None if there is none. text can be anything that slices into
+	strings, like an mmap. only the first head characters are looked at,
+	unless the ns form starts there and continues past them
+
+	>>> namespace_of('; header\\n(ns ^:no-doc my.app.core\\n  (:require [clojure.string]))')
+	'my.app.core'
+	'''
+
+	return _in_head(_namespace_in, text, head)
+
+def required_namespaces(text, head=65536):
+	'''returns the namespaces that the :require and :use clauses of the
+	first ns form in text load, in order, or [] if there is no ns form.
+	head is the same as for namespace_of
+
+	>>> required_namespaces('(ns a.b (:require [a.c :as c] a.d [a.e [f :refer [g]] h]) (:use a.i))')
+	['a.c', 'a.d', 'a.e.f', 'a.e.h', 'a.i']
+	'''
+
+	def requires_in(start):
+		form = _ns_form(start)
+		if form is None:
+			return []
+		names = []
+		for clause in _inside(form)[2:]:
+			if not clause.startswith('('):
+				continue
+			parts = _inside(clause)
+			if parts and parts[0] in _REQUIRE_CLAUSES:
+				for spec in parts[1:]:
+					names.extend(_libspec_namespaces(spec))
+		return names
+
+	return _in_head(requires_in, text, head) or []
+
+def _in_head(read, text, head):
+	'''calls read with the first head characters of text, and with more of
+	them when the ns form continues past them'''
+
+	while True:
+		start = text[:head]
+		try:
+			return read(start)
+		except ValueError:
+			if len(start) < head or '(ns' not in start:
+				return None
+			head *= 4
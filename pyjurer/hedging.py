@@ -0,0 +1,243 @@
+#! /usr/bin/env python
+'''hedged evals over several sessions, for cutting the tail latency that a
+pause on one jvm adds to the evals it happens to be running.
+
+an eval marked idempotent goes to one session and, if it has not been
+answered after the hedge delay, the same eval goes to another session too.
+the attempt that answers first wins: only its responses reach the
+callbacks, and the other is cancelled, which interrupts it and discards
+its callbacks. the delay is the HEDGE_PERCENTILE of the latencies of the
+recent winning attempts, so about that share of evals is never hedged.
+
+to tell what hedging gains, BASELINE_FRACTION of the idempotent evals are
+never hedged, and the p99 of their latency is compared with that of the
+hedged ones in metrics'''
+
+import collections, itertools, logging, random, threading, time
+
+from scheduler import shared_scheduler
+
+logger = logging.getLogger(__name__)
+
+HEDGE_PERCENTILE = 95
+# the delay until there are MIN_SAMPLES latencies to take it from
+INITIAL_DELAY = 0.05
+MIN_SAMPLES = 20
+# the latencies kept, of attempts for the delay and of evals for the metrics
+LATENCY_WINDOW = 1000
+BASELINE_FRACTION = 0.05
+
+def percentile(values, p):
+	'''the nearest-rank p-th percentile of values, None if there are none'''
+
+	if not values:
+		return None
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))]
+
+class _HedgedRequest(object):
+	'''the attempts of one idempotent eval, the first of them to answer wins'''
+
+	__slots__ = ('started', 'attempts', 'winner', 'timer', 'finished')
+
+	def __init__(self):
+		self.started = time.time()
+		# [session, id, sent] by attempt, the id is None until it is sent
+		self.attempts = []
+		self.winner = None
+		self.timer = None
+		self.finished = False
+
+class HedgedEvaluator(object):
+	'''evals on a pool of sessions, round robin, hedging the idempotent ones.
+	the sessions can be on one server or spread over several, hedges go to
+	another session than the eval they hedge'''
+
+	def __init__(self, sessions, percentile=HEDGE_PERCENTILE, initialDelay=INITIAL_DELAY,
+		minDelay=0.0, maxDelay=None, minSamples=MIN_SAMPLES, window=LATENCY_WINDOW,
+		baselineFraction=BASELINE_FRACTION):
+		'''sessions => the NREPLSessions evals are spread over
+		percentile => the percentile of the recent attempt latencies that is the hedge delay
+		initialDelay => the delay until there are minSamples latencies
+		minDelay, maxDelay => the bounds of the delay, maxDelay None for none
+		window => how many latencies are kept
+		baselineFraction => the share of idempotent evals that are never hedged'''
+
+		if not sessions:
+			raise ValueError('a HedgedEvaluator needs sessions')
+		self._sessions = list(sessions)
+		self._percentile = percentile
+		self._minDelay = minDelay
+		self._maxDelay = maxDelay
+		self._minSamples = minSamples
+		self._baselineFraction = baselineFraction
+
+		self._lock = threading.Lock()
+		self._next = itertools.count()
+		self._attemptLatencies = collections.deque(maxlen=window)
+		self._hedgedLatencies = collections.deque(maxlen=window)
+		self._baselineLatencies = collections.deque(maxlen=window)
+		self._delay = initialDelay
+		self._sinceDelay = 0
+		self._counters = {'requests': 0, 'baseline': 0, 'hedged': 0, 'hedge_wins': 0}
+
+	def _session(self, other=None):
+		'''the next session round robin, one that is not other if there is one'''
+
+		session = self._sessions[self._next.next() % len(self._sessions)]
+		if session is other and len(self._sessions) > 1:
+			session = self._sessions[self._next.next() % len(self._sessions)]
+		return session
+
+	def delay(self):
+		'''the seconds an idempotent eval waits for an answer before it is hedged'''
+
+		with self._lock:
+			return self._delay
+
+	def _update_delay(self):
+		'''called with the lock held, takes the delay from the latencies every
+		now and then rather than sorting them for every eval'''
+
+		self._sinceDelay += 1
+		if len(self._attemptLatencies) < self._minSamples or self._sinceDelay < 10:
+			return
+		self._sinceDelay = 0
+		delay = max(self._minDelay, percentile(self._attemptLatencies, self._percentile))
+		self._delay = delay if self._maxDelay is None else min(delay, self._maxDelay)
+
+	def eval(self, lispCode, value=None, stdout=None, done=None, stderr=None, error=None,
+		idempotent=False):
+		'''evals lispCode on the next session, and hedges it on another one
+		when idempotent and it is not answered within delay(). the callbacks
+		are the same as NREPLSession.eval's and are only ever called with
+		the session and the id of the winning attempt.
+
+		:param idempotent: whether evaluating lispCode twice does no harm, and
+		so it can be hedged. an eval that is not is sent once, as is'''
+
+		if not idempotent:
+			return self._session().eval(lispCode, value=value, stdout=stdout, done=done,
+				stderr=stderr, error=error)
+
+		request = _HedgedRequest()
+		with self._lock:
+			self._counters['requests'] += 1
+			baseline = random.random() < self._baselineFraction
+			if baseline:
+				self._counters['baseline'] += 1
+			delay = self._delay
+
+		callbacks = (value, stdout, done, stderr, error)
+		id_ = self._attempt(request, lispCode, callbacks, baseline)
+		if not baseline and len(self._sessions) > 1:
+			with self._lock:
+				if request.winner is None:
+					# on the thread of the process's scheduler, not one per eval
+					request.timer = shared_scheduler().call_later(delay, self._hedge,
+						request, lispCode, callbacks)
+		return id_
+
+	def _attempt(self, request, lispCode, callbacks, baseline, other=None):
+		'''sends one attempt of request, returns its id'''
+
+		value, stdout, done, stderr, error = callbacks
+		session = self._session(other)
+		# an attempt is known before it is sent, as it can be answered
+		# before eval returns
+		with self._lock:
+			attempt = len(request.attempts)
+			entry = [session, None, time.time()]
+			request.attempts.append(entry)
+
+		def first(cb):
+			'''calls cb for the winning attempt, which is the first to answer'''
+
+			def answered(s, id_, *args):
+				if self._claim(request, attempt) and not cb is None:
+					cb(s, id_, *args)
+			return answered
+
+		def finished(s, id_):
+			if self._claim(request, attempt):
+				self._finish(request, attempt, baseline)
+				if not done is None:
+					done(s, id_)
+
+		id_ = session.eval(lispCode, value=first(value), stdout=first(stdout),
+			stderr=first(stderr), error=first(error), done=finished)
+		with self._lock:
+			entry[1] = id_
+			# another attempt won while this one was sent
+			lost = not request.winner is None and request.winner != attempt
+		if lost:
+			session.cancel(id_)
+		return id_
+
+	def _hedge(self, request, lispCode, callbacks):
+		with self._lock:
+			if not request.winner is None:
+				return
+			self._counters['hedged'] += 1
+			primary = request.attempts[0][0]
+		logger.debug('hedging an eval after {0:.1f} ms'.format((time.time() - request.started) * 1000))
+		try:
+			self._attempt(request, lispCode, callbacks, False, primary)
+		except Exception:
+			# the eval that is hedged is still on its way
+			logger.exception('sending a hedge failed')
+
+	def _claim(self, request, attempt):
+		'''returns whether attempt won, making it the winner when it is the
+		first to answer and cancelling the others'''
+
+		with self._lock:
+			if request.winner is None:
+				request.winner = attempt
+				if not request.timer is None:
+					request.timer.cancel()
+				# an attempt without an id yet cancels itself once it has one
+				losers = [(s, id_) for i, (s, id_, sent) in enumerate(request.attempts)
+					if i != attempt and not id_ is None]
+				if attempt > 0:
+					self._counters['hedge_wins'] += 1
+			elif request.winner == attempt:
+				return True
+			else:
+				return False
+
+		for session, id_ in losers:
+			session.cancel(id_)
+		return True
+
+	def _finish(self, request, attempt, baseline):
+		now = time.time()
+		with self._lock:
+			if request.finished:
+				return
+			request.finished = True
+			self._attemptLatencies.append(now - request.attempts[attempt][2])
+			(self._baselineLatencies if baseline else self._hedgedLatencies).append(now - request.started)
+			self._update_delay()
+
+	def metrics(self):
+		'''returns the counts of idempotent evals, baseline ones and hedges
+		sent and won, the hedge rate, the current delay and the p50 and p99
+		of the recent latencies of hedged and baseline evals in seconds, with
+		the improvement of the p99, which is None until there are MIN_SAMPLES
+		baseline latencies'''
+
+		with self._lock:
+			result = dict(self._counters)
+			hedged = list(self._hedgedLatencies)
+			baseline = list(self._baselineLatencies)
+			result['delay'] = self._delay
+		eligible = result['requests'] - result['baseline']
+		result['hedge_rate'] = float(result['hedged']) / eligible if eligible else 0.0
+		result['p50'] = percentile(hedged, 50)
+		result['p99'] = percentile(hedged, 99)
+		result['baseline_p99'] = percentile(baseline, 99) if len(baseline) >= self._minSamples else None
+		result['p99_improvement'] = None
+		if not result['baseline_p99'] is None and not result['p99'] is None:
+			result['p99_improvement'] = result['baseline_p99'] - result['p99']
+		return result
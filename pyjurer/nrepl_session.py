@@ -5,7 +5,11 @@ with such a NREPL"""
 
 from __future__ import nested_scopes
 
-import unittest, logging, itertools, threading, collections
+import logging, threading, mmap, os, time
+
+import edn
+from scheduler import shared_scheduler
+from transports.bcode import LazyDict, plain
 
 logger = logging.getLogger(__name__)
 
@@ -28,85 +32,443 @@ InterruptStatus._dict = {
             "interrupt-id-mismatch": InterruptStatus.INTERRUPT_ID_MISMATCH
         }
 
+# the response fields that are collected for the 'info' and 'eldoc' ops
+INFO_KEYS = ('name', 'ns', 'doc', 'arglists-str', 'file', 'line', 'column',
+    'resource', 'macro', 'special-form', 'see-also', 'added', 'deprecated',
+    'class', 'member', 'javadoc')
+ELDOC_KEYS = ('name', 'ns', 'eldoc', 'docstring', 'type', 'class', 'member')
+
+class _PendingTable(object):
+    '''the callback items of the requests that are waiting for responses,
+    keyed by id. the ids are spread over shards that each have their own
+    lock, so that threads submitting requests and the thread receiving the
+    responses rarely wait on each other'''
+
+    SHARDS = 16
+
+    def __init__(self, shards=SHARDS):
+        self._shards = [({}, threading.Lock()) for i in range(shards)]
+
+    def _shard(self, id_):
+        return self._shards[hash(id_) % len(self._shards)]
+
+    def put(self, id_, item):
+        table, lock = self._shard(id_)
+        with lock:
+            table[id_] = item
+
+    def get(self, id_):
+        '''returns the item registered under id_ or None'''
+        table, lock = self._shard(id_)
+        with lock:
+            return table.get(id_)
+
+    def pop(self, id_):
+        '''removes and returns the item registered under id_ or None'''
+        table, lock = self._shard(id_)
+        with lock:
+            return table.pop(id_, None)
+
+    def replace(self, id_, item):
+        '''registers item under id_ if something is, returns whether it was'''
+        table, lock = self._shard(id_)
+        with lock:
+            if not id_ in table:
+                return False
+            table[id_] = item
+            return True
+
+    def __contains__(self, id_):
+        return not self.get(id_) is None
+
+    def __len__(self):
+        return sum(len(table) for table, lock in self._shards)
+
+class _DispatchPlan(object):
+    '''the callbacks of one request, compiled when it is registered so
+    that a response is dispatched without looking at the callback item.
+
+    fields => (field, callback) pairs, called with the session, the id and the
+    value of the field, for the fields a response has
+    status => callbacks by status, called with the session and the id
+    done => the caller's done callback or None. the request is forgotten
+    before it is called
+    op => the name of the op, told to the session's unknown op listeners
+    when the request has no callback of its own for the 'unknown-op' status'''
+
+    __slots__ = ('fields', 'status', 'done', 'op')
+
+    def __init__(self, item, op=None):
+        self.fields = tuple((k, v) for k, v in item.iteritems() if k != 'id' and k != 'status')
+        self.status = dict(item.get('status', {}))
+        self.done = self.status.pop('done', None)
+        self.op = op
+
+# the plan of a discarded request, which drops its responses until its done
+_DISCARDED = _DispatchPlan({})
+
+def _lazy(cb):
+    '''marks the field callback cb as one that takes a LazyDict as it is,
+    for the session's own callbacks that only look at part of it'''
+    cb.lazy = True
+    return cb
+
 class _CallbackHandler:
     '''in internal class for communicating callback handlers'''
 
     def __init__(self, session):
-        self._registerDeque = collections.deque()
-        self._idCallbacks = {}
+        self._idCallbacks = _PendingTable()
         self._session = session
 
-    def register(self, item):
+    def register(self, item, op=None):
         '''registers a bunch of callbacks associated with an id.
 
         :param item: a map containing at least an 'id' which will be
         corresponded with the 'id' in a nrepl result data structure. 
         then also members called 'out' and 'value' which will be
         invoked when that id receives either stdout or a value from
-        the nrepl
+        the nrepl, and 'status', a map of callbacks by status
+        :param op: the name of the op sent
         '''
 
-        # we are hooking in ourselves to the status
-        # of 'done' after which we take the id out
-        # but we have to make sure that if there is 
-        # a registered listener against 'done' that
-        # it will be invoked too.
-        closeCb = lambda s, id_: self._done(s, id_)
-
-        if 'status' not in item:
-            item['status'] = {'done': closeCb}
-        elif 'done' not in item['status']:
-            item['status']['done'] = closeCb
-        else:
-            oldDone = item['status']['done']
-            def newDone(s, id_):
-                oldDone(s, id_)
-                closeCb(s, id_)
-            item['status']['done'] = newDone
+        # registration happens on the caller's thread before the request
+        # is sent, so the receiving thread always finds it in the table
+        self._idCallbacks.put(item['id'], _DispatchPlan(item, op))
+
+    def discard(self, id_):
+        '''stops calling the callbacks of the request id_. the responses it
+        still gets are dropped, and it is forgotten at its done. returns
+        whether the request was waiting for responses'''
 
-        self._registerDeque.appendleft(item)
+        return self._idCallbacks.replace(id_, _DISCARDED)
 
     def _done(self, session, id_):
-        logger.debug('status is done for id {0}'.format(id_))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('status is done for id {0}'.format(id_))
         self._idCallbacks.pop(id_)
 
-    def _read_registerQueue(self):
-        '''reads out all callbacks sent from the invoking threading
-        before trying to handle any callbacks for results'''
-        while True:
-            try:
-                item = self._registerDeque.pop()
-                self._idCallbacks[item['id']] = item
-            except IndexError:
-                break
-
     def accept_data(self, data):
-        self._read_registerQueue()
-
         id_ = data['id']
-        if not id_ in self._idCallbacks:
+        plan = self._idCallbacks.get(id_)
+        if plan is None:
             raise IndexError('{0} not registered as a session id'.format(id_))
 
-        cbitem = self._idCallbacks[id_]
-        for op in cbitem.keys():
-            # 'id' and 'status' is special
-            # 'id' because it is a value and not a callback
-            # and 'status' because it's a list of callbacks
-            # instead of a single callback
-            if op == "id" or op == "status":
-                continue
-
-            # anything else is assumed to be a function
-            # that takes three values, the session, the id 
-            # and the value in the data dict
-            if op in data:
-                cbitem[op](self._session, id_, data[op])
+        session = self._session
+        for field, cb in plan.fields:
+            if field in data:
+                value = data[field]
+                if type(value) is LazyDict and not getattr(cb, 'lazy', False):
+                    # the laziness stops here, callbacks get plain dicts
+                    value = plain(value)
+                cb(session, id_, value)
 
         # the status callbacks only take the session and the id
-        datastatus = data["status"] if "status" in data else []
-        for s in datastatus:
-            if s in cbitem['status']:
-                cbitem['status'][s](self._session, id_)
+        if 'status' in data:
+            for s in data['status']:
+                if s == 'done':
+                    # forget the request before the caller hears it is done,
+                    # so a caller waiting on done sees it fully cleaned up
+                    self._done(session, id_)
+                    if not plan.done is None:
+                        plan.done(session, id_)
+                else:
+                    cb = plan.status.get(s)
+                    if not cb is None:
+                        cb(session, id_)
+                    elif s == 'unknown-op' and not plan.op is None:
+                        session._unknown_op(plan.op)
+
+class _LatestSlot(object):
+    '''the state of one named latest-wins slot. generation is bumped on
+    every submission, so a request knows it was superseded when it no
+    longer matches.
+
+    a debounced submission sets pending, the send it holds back, and
+    deadline, when to make it. the slot has one call on the scheduler at a
+    time, timer, which a newer submission leaves armed: when it comes
+    before the deadline it is armed again for the rest of the time'''
+
+    __slots__ = ('generation', 'timer', 'inFlight', 'pending', 'deadline')
+
+    def __init__(self):
+        self.generation = 0
+        self.timer = None
+        self.inFlight = None
+        self.pending = None
+        self.deadline = None
+
+# the bytes of out and err a flight keeps to replay to the waiters that
+# join it late. once it has had more, it takes no more waiters
+FLIGHT_REPLAY_BYTES = 65536
+
+class _Flight(object):
+    '''one eval on the wire shared by every identical eval submitted while
+    it is in flight. the events it has had so far are kept, so a waiter that
+    joins late gets them first, and they are delivered under the flight's
+    lock, so every waiter sees them in the same order. once its out and err
+    go over FLIGHT_REPLAY_BYTES it stops keeping them and taking waiters'''
+
+    __slots__ = ('key', 'id', 'lock', 'waiters', 'events', 'replayed', 'landed')
+
+    def __init__(self, key):
+        self.key = key
+        self.id = None
+        self.lock = threading.RLock()
+        # dicts of callbacks by event
+        self.waiters = []
+        # (event, args), None once the flight takes no more waiters
+        self.events = []
+        self.replayed = 0
+        self.landed = False
+
+    def join(self, callbacks):
+        '''returns False when the flight takes no more waiters'''
+        with self.lock:
+            if self.events is None:
+                return False
+            for event, args in self.events:
+                cb = callbacks.get(event)
+                if not cb is None:
+                    cb(*args)
+            self.waiters.append(callbacks)
+            return True
+
+    def leave(self, done):
+        '''removes the waiter that was given done, returns how many are left'''
+        with self.lock:
+            for i, callbacks in enumerate(self.waiters):
+                if callbacks.get('done') is done:
+                    del self.waiters[i]
+                    break
+            return len(self.waiters)
+
+    def deliver(self, event, *args):
+        '''returns whether the flight still takes waiters'''
+        with self.lock:
+            if not self.events is None:
+                self.events.append((event, args))
+                if event in ('stdout', 'stderr'):
+                    self.replayed += len(args[-1])
+                    if self.replayed > FLIGHT_REPLAY_BYTES:
+                        self.events = None
+            for callbacks in self.waiters:
+                cb = callbacks.get(event)
+                if not cb is None:
+                    cb(*args)
+            return not self.events is None
+
+class _OutputCoalescer(object):
+    '''merges the consecutive out and err fragments of one request and hands
+    them to the stdout and stderr callbacks in one piece: once maxBytes are
+    buffered, once the oldest buffered fragment is interval seconds old, when
+    the other stream or any other response field arrives, and at done.
+
+    the interval is timed on the scheduler of the process, so a flush can
+    call the callbacks from its thread. the stdout and stderr callbacks and the
+    other callbacks of the request, which flushing wraps, are all called
+    under one lock, so none of them runs concurrently with another and
+    they are called in the order the responses came in'''
+
+    def __init__(self, stdout, stderr, maxBytes, interval):
+        self._callbacks = {'out': stdout, 'err': stderr}
+        self._maxBytes = maxBytes
+        self._interval = interval
+        self._lock = threading.RLock()
+        self._key = None
+        self._chunks = []
+        self._size = 0
+        self._timer = None
+        self._last = None
+
+    def collector(self, key):
+        '''returns the response callback buffering the fragments of key'''
+        return lambda s, id_, v: self._add(key, s, id_, v)
+
+    def flushing(self, cb):
+        '''returns cb wrapped to flush the buffered output before it is called,
+        under the lock the flushes of the timer take as well'''
+        def flushed(*args):
+            with self._lock:
+                self.flush()
+                cb(*args)
+        return flushed
+
+    def _add(self, key, session, id_, fragment):
+        with self._lock:
+            if self._key != key:
+                self.flush()
+                self._key = key
+            self._chunks.append(fragment)
+            self._size += len(fragment)
+            self._last = (session, id_)
+            if self._size >= self._maxBytes:
+                self.flush()
+            elif self._timer is None and self._interval:
+                self._timer = shared_scheduler().call_later(self._interval, self.flush)
+
+    def flush(self):
+        '''hands whatever is buffered to its callback'''
+        with self._lock:
+            if not self._timer is None:
+                self._timer.cancel()
+                self._timer = None
+            if len(self._chunks) == 0:
+                return
+            contents = ''.join(self._chunks)
+            self._chunks = []
+            self._size = 0
+            session, id_ = self._last
+            cb = self._callbacks[self._key]
+            if not cb is None:
+                cb(session, id_, contents)
+
+# the thresholds used when coalesce=True is passed to eval or load_file
+COALESCE_BYTES = 65536
+COALESCE_INTERVAL = 0.05
+
+def _decoding(value, decode):
+    '''wraps the value callback value to be called with what decode reads'''
+
+    def decoded(session, id_, printed):
+        try:
+            read = decode(printed)
+        except (ValueError, ArithmeticError) as e:
+            logger.warning("could not decode the value of {0}: {1}".format(id_, e))
+            read = printed
+        value(session, id_, read)
+    return decoded
+
+# the defaults of StdinStream
+STDIN_CHUNK_SIZE = 65536
+STDIN_WINDOW = 4
+
+def _utf8_tail(chunk):
+    '''the number of bytes of the utf-8 sequence chunk ends in the middle of,
+    0 when it ends on a character boundary'''
+    for i in range(1, min(4, len(chunk)) + 1):
+        byte = ord(chunk[-i])
+        if byte & 0xC0 != 0x80:
+            # the lead byte says how long its sequence is
+            length = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return i if byte >= 0xC0 and i < length else 0
+    return 0
+
+class StdinStream(object):
+    '''streams a file-like object, or an iterator of strings, to the stdin of
+    an eval, for code that reads all of *in*. pass it, or just the file or
+    iterator for the defaults, as the stdin of eval.
+
+    the input is read on a thread of its own, at most window chunks of at
+    most chunkSize bytes ahead of what was sent, so it is never all in
+    memory. the nrepl buffers the stdin it is sent and says 'need-input'
+    once its buffer is empty and the eval waits for more, so every
+    need-input allows window more chunks to be sent. the first window is
+    sent straight away, so the eval does not wait for a round trip before
+    it gets anything. the end of the input is sent as an empty stdin'''
+
+    def __init__(self, source, chunkSize=STDIN_CHUNK_SIZE, window=STDIN_WINDOW):
+        self._source = source
+        self._read = getattr(source, 'read', None)
+        self._pieces = None if not self._read is None else iter(source)
+        self._rest = ''
+        self._chunkSize = chunkSize
+        self._window = window
+
+        self._condition = threading.Condition()
+        self._credit = window
+        self._chunks = []
+        self._ended = False
+        self._stopped = False
+        self._session = None
+        self._thread = None
+        self.sent = 0
+
+    def start(self, session):
+        '''starts sending to session'''
+        self._session = session
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def need_input(self, session, id_):
+        '''the need-input status callback'''
+        with self._condition:
+            self._credit = self._window
+            self._condition.notify()
+
+    def stop(self, *args):
+        '''stops sending, called at done and by the session when the eval is
+        cancelled or superseded or its connection is gone. a read of the
+        source that is under way is finished first'''
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _next_chunk(self):
+        '''reads the next chunk, the empty string at the end of the input. a
+        chunk ends on a character boundary, the start of a utf-8 sequence cut
+        off at the end of it is held back for the next one'''
+        ended = False
+        if not self._read is None:
+            read = self._read(self._chunkSize - len(self._rest))
+            ended = len(read) == 0
+            chunk = self._rest + read
+            self._rest = ''
+        else:
+            parts = [self._rest] if self._rest else []
+            size = len(self._rest)
+            while size < self._chunkSize:
+                try:
+                    piece = self._pieces.next()
+                except StopIteration:
+                    ended = True
+                    break
+                parts.append(piece)
+                size += len(piece)
+            joined = ''.join(parts)
+            chunk = joined[:self._chunkSize]
+            self._rest = joined[self._chunkSize:]
+
+        if not ended and isinstance(chunk, str):
+            tail = _utf8_tail(chunk)
+            if 0 < tail < len(chunk):
+                self._rest = chunk[-tail:] + self._rest
+                chunk = chunk[:-tail]
+        return chunk
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not (self._credit > 0 and self._chunks) and \
+                    (self._ended or len(self._chunks) >= self._window):
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                send = self._credit > 0 and len(self._chunks) > 0
+                if send:
+                    self._credit -= 1
+                    chunk = self._chunks.pop(0)
+
+            if send:
+                self._session.stdin(chunk)
+                self.sent += len(chunk)
+                if len(chunk) == 0:
+                    # the end is sent again, once, on every need-input after it
+                    with self._condition:
+                        self._chunks.append('')
+                        self._credit = 0
+                continue
+
+            # reading happens outside the lock, so need-input never waits on it
+            try:
+                chunk = self._next_chunk()
+            except Exception:
+                logger.exception('unable to read the stdin of an eval, ending it')
+                chunk = ''
+            with self._condition:
+                self._chunks.append(chunk)
+                if len(chunk) == 0:
+                    self._ended = True
 
 class NREPLSession:
 
@@ -123,6 +485,20 @@ class NREPLSession:
         self._sessionClosing = False
 
         self._callbacks = _CallbackHandler(self)
+        self._loadFileListeners = []
+        self._unknownOpListeners = []
+
+        self._slotsLock = threading.Lock()
+        self._slots = {}
+
+        self._flightsLock = threading.Lock()
+        # the flights that take waiters by (code, dedup), and all of them by id
+        self._flights = {}
+        self._flightsById = {}
+
+        # the StdinStreams sending by the id of their eval
+        self._streamsLock = threading.Lock()
+        self._streams = {}
 
     def _stdout(self, session, output):
         logger.info('received stdout: {0}'.format(output))
@@ -130,7 +506,9 @@ class NREPLSession:
     def _receive_results(self, data):
         """Called by the channel when data is received that belongs to this session"""
 
-        logger.debug("Raw results: {0}".format(data))
+        # formatting every response costs more than dispatching it
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Raw results: {0}".format(data))
         self._callbacks.accept_data(data)
 
     def _generic_command(
@@ -139,8 +517,10 @@ class NREPLSession:
         extraResponse=None,
         extraStatus=None,
         value=None, stdout=None, stdin=None, 
-        done=None, closed=None):
-        '''internal method for constructing a data structure to be sent to the nrepl'''
+        done=None, closed=None, stderr=None, error=None,
+        coalesce=None):
+        '''internal method for constructing a data structure to be sent to the nrepl.
+        coalesce is None, True or (maxBytes, interval), see _OutputCoalescer'''
 
         data = {
             "op": optype,
@@ -167,6 +547,20 @@ class NREPLSession:
         if not stdout is None:
             callbackItem['out'] = stdout
 
+        if not stderr is None:
+            callbackItem['err'] = stderr
+
+        stream = None
+        if not stdin is None and not callable(stdin):
+            stream = stdin if isinstance(stdin, StdinStream) else StdinStream(stdin)
+            stdin = stream.need_input
+            with self._streamsLock:
+                self._streams[data['id']] = stream
+            if done is None:
+                done = lambda s, id_: self._stop_stream(id_)
+            else:
+                done = lambda s, id_, done=done: (self._stop_stream(id_), done(s, id_))
+
         if not stdin is None:
             callbackItem['status']['need-input'] = stdin
 
@@ -176,18 +570,63 @@ class NREPLSession:
         if not closed is None:
             callbackItem['status']['session-closed'] = closed
 
+        if not error is None:
+            callbackItem['status']['eval-error'] = error
+
         if not extraStatus is None:
             for s in extraStatus.keys():
                 callbackItem['status'][s] = extraStatus[s]
 
-        logger.debug("sending data structure to channel: {0}".format(data))
+        if coalesce:
+            self._coalesce(callbackItem, coalesce)
 
-        self._callbacks.register(callbackItem)
-        self._channel._submit(data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("sending data structure to channel: {0}".format(data))
+
+        self._callbacks.register(callbackItem, optype)
+        try:
+            self._channel._submit(data)
+        except Exception:
+            # rejected, by admission control for one, so it will never be done
+            self._callbacks._done(self, data['id'])
+            self._stop_stream(data['id'])
+            raise
+
+        if not stream is None:
+            stream.start(self)
 
         return data['id']
 
-    def eval(self, lispCode, value=None, stdout=None, stdin=None, done=None):
+    def _stop_stream(self, id_):
+        '''stops the StdinStream of the eval id_, if it has one'''
+
+        with self._streamsLock:
+            stream = self._streams.pop(id_, None)
+        if not stream is None:
+            stream.stop()
+
+    def _coalesce(self, callbackItem, coalesce):
+        '''routes the out and err of a callback item through an _OutputCoalescer'''
+
+        maxBytes, interval = (COALESCE_BYTES, COALESCE_INTERVAL) if coalesce is True else coalesce
+        coalescer = _OutputCoalescer(callbackItem.get('out'), callbackItem.get('err'),
+            maxBytes, interval)
+
+        status = callbackItem['status']
+        if not 'done' in status:
+            status['done'] = lambda s, id_: None
+        for k in status.keys():
+            status[k] = coalescer.flushing(status[k])
+        for k in callbackItem.keys():
+            if k in ('id', 'status'):
+                continue
+            if k in ('out', 'err'):
+                callbackItem[k] = coalescer.collector(k)
+            else:
+                callbackItem[k] = coalescer.flushing(callbackItem[k])
+
+    def eval(self, lispCode, value=None, stdout=None, stdin=None, done=None,
+        stderr=None, error=None, coalesce=None, decode=None, dedup=None):
         """evals lispcode in the nrepl, and calls value callback with the session and the result
 
         :param lispCode: the actual code that will be eval'd
@@ -196,17 +635,255 @@ class NREPLSession:
         :type value: function, taking two arguments, the first a session the second a python data structure
         :param stdout: callback invoked with the stdout contents
         :type stdout: function taking two parameters, the first is the session and the second is the string that makes up the stdout
-        :param stdin: callback invoked when content is required for stdin. With default value of None, the session will be notified that no more input from stdin is available
-        :type stdin: function, taking one parameter, the session
+        :param stdin: callback invoked when content is required for stdin. With default value of None, the session will be notified that no more input from stdin is available.
+        a file-like object, an iterator of strings or a StdinStream is streamed to stdin instead
+        :type stdin: function, taking one parameter, the session, or a source of input
         :param done: callback invoked when the session is finished processing this eval.
         :type done: function, taking one argument, the session
+        :param stderr: callback invoked with the stderr contents
+        :type stderr: function taking three parameters, the session, the id and the string that makes up the stderr
+        :param error: callback invoked when the eval threw an exception
+        :type error: function, taking two arguments, the session and the id
+        :param coalesce: merge consecutive stdout and stderr fragments into one
+        callback each, flushed after COALESCE_BYTES bytes, after COALESCE_INTERVAL
+        seconds, before any other callback and at done. True for those
+        thresholds or a (maxBytes, interval) tuple. flushes on the interval
+        happen on a timer thread
+        :type coalesce: bool or tuple
+        :param decode: reads each value before value is called with it, True
+        for edn.loads, which turns the printed clojure data into python data.
+        a value that cannot be read is logged and passed on as it was printed
+        :type decode: bool or function, taking the printed value
+        :param dedup: makes the eval single-flight: while an eval of the same
+        code with the same dedup key is in flight on this session, this one
+        is not sent but shares its responses, the ones that came before it
+        joined included, and its id. True for a key of its own. only for code
+        that reads, the caller that sent it decides on coalesce for all.
+        leave stops the callbacks of one of the evals sharing it
+        :type dedup: True or any hashable
 
         """
 
+        if decode and value:
+            value = _decoding(value, edn.loads if decode is True else decode)
+
+        if not dedup is None:
+            if not stdin is None:
+                raise ValueError('a single-flight eval cannot take stdin')
+            return self._eval_single_flight(lispCode, dedup, coalesce, {'value': value,
+                'stdout': stdout, 'stderr': stderr, 'error': error, 'done': done})
+
         return self._generic_command(
             "eval", 
             extraRequest={"code": lispCode}, 
-            value=value, stdout=stdout, stdin=stdin, done=done)
+            value=value, stdout=stdout, stdin=stdin, done=done,
+            stderr=stderr, error=error, coalesce=coalesce)
+
+    def _eval_single_flight(self, lispCode, dedup, coalesce, callbacks):
+        '''joins the flight of lispCode under dedup, sending its eval if there
+        is none in flight'''
+
+        key = (lispCode, dedup)
+        while True:
+            with self._flightsLock:
+                flight = self._flights.get(key)
+                sending = flight is None
+                if sending:
+                    flight = self._flights[key] = _Flight(key)
+                    # held until the id is known, so no one joins without it
+                    flight.lock.acquire()
+
+            if sending:
+                break
+            if flight.join(callbacks):
+                return flight.id
+
+        def landed(s, id_):
+            # forgotten before the waiters hear of it, so an eval submitted
+            # from their done callbacks starts a new flight
+            self._forget_flight(flight)
+            flight.deliver('done', s, id_)
+
+        def fanOut(event):
+            def delivered(*args):
+                if not flight.deliver(event, *args):
+                    self._forget_flight(flight, landed=False)
+            return delivered
+
+        try:
+            flight.waiters.append(callbacks)
+            flight.id = self._generic_command(
+                "eval",
+                extraRequest={"code": lispCode},
+                value=fanOut('value'), stdout=fanOut('stdout'), stderr=fanOut('stderr'),
+                error=fanOut('error'), done=landed, coalesce=coalesce)
+            with self._flightsLock:
+                # it can have been answered before the id was known
+                if not flight.landed:
+                    self._flightsById[flight.id] = flight
+        except Exception:
+            self._forget_flight(flight)
+            raise
+        finally:
+            flight.lock.release()
+        return flight.id
+
+    def _forget_flight(self, flight, landed=True):
+        '''stops identical evals from joining flight, and forgets it altogether
+        when it has landed'''
+
+        with self._flightsLock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if landed:
+                flight.landed = True
+                if self._flightsById.get(flight.id) is flight:
+                    del self._flightsById[flight.id]
+
+    def leave(self, id_, done):
+        '''stops calling the callbacks of the single-flight eval id_ that was
+        given done, and cancels the request once none of the evals sharing
+        it are left. returns whether the eval was in flight'''
+
+        with self._flightsLock:
+            flight = self._flightsById.get(id_)
+        if flight is None:
+            return False
+        if flight.leave(done) == 0:
+            self.cancel(id_)
+        return True
+
+    def _connection_lost(self):
+        '''called when the connection of the session is gone, after which none
+        of its requests is answered'''
+
+        with self._flightsLock:
+            self._flights.clear()
+            self._flightsById.clear()
+
+        # their evals will never need input again, nor be done
+        with self._streamsLock:
+            streams = self._streams.values()
+            self._streams.clear()
+        for stream in streams:
+            stream.stop()
+
+    def eval_latest(self, slot, lispCode, debounce=None,
+        value=None, stdout=None, stdin=None, done=None, stderr=None, error=None):
+        """evals lispCode in the named slot, where only the latest submission
+        counts. whatever was submitted to the slot before is cancelled: if it
+        has not been sent yet it is dropped, if it has it is interrupted and
+        nothing it still produces is delivered to its callbacks.
+
+        the nrepl can only interrupt the eval it is running, so a superseded
+        eval that is still queued behind another one on the session will run,
+        but its results are discarded all the same.
+
+        :param slot: any hashable naming the slot
+        :param debounce: optional number of seconds to hold the eval back
+        for. a newer submission to the slot within that time replaces it
+        before it is ever sent
+        :type debounce: float
+
+        the callbacks are the same as for eval
+        """
+
+        self._slotsLock.acquire()
+        try:
+            state = self._slots.get(slot)
+            if state is None:
+                state = self._slots[slot] = _LatestSlot()
+            state.generation += 1
+            generation = state.generation
+
+            stale = state.inFlight
+            state.inFlight = None
+
+            send = lambda: self._send_latest(state, generation, lispCode,
+                value, stdout, stdin, done, stderr, error)
+
+            if debounce:
+                state.pending = send
+                state.deadline = time.time() + debounce
+                if state.timer is None:
+                    state.timer = shared_scheduler().call_later(debounce, self._debounced, state)
+            else:
+                state.pending = None
+                if not state.timer is None:
+                    state.timer.cancel()
+                    state.timer = None
+        finally:
+            self._slotsLock.release()
+
+        if not stale is None:
+            logger.debug('interrupting superseded request {0}'.format(stale))
+            self._stop_stream(stale)
+            self.interrupt(interrupt_id=stale)
+
+        if not debounce:
+            send()
+
+    def _debounced(self, state):
+        '''makes the send a slot held back once its deadline is up'''
+
+        self._slotsLock.acquire()
+        try:
+            send = state.pending
+            if send is None:
+                return
+            remaining = state.deadline - time.time()
+            if remaining > 0:
+                # a newer submission moved the deadline on
+                state.timer = shared_scheduler().call_later(remaining, self._debounced, state)
+                return
+            state.timer = None
+            state.pending = None
+        finally:
+            self._slotsLock.release()
+
+        send()
+
+    def _send_latest(self, state, generation, lispCode,
+        value, stdout, stdin, done, stderr, error):
+        '''sends the eval for a slot submission unless it has been superseded'''
+
+        if state.generation != generation:
+            return
+
+        def current(cb):
+            if cb is None:
+                return None
+            def guarded(*args):
+                if state.generation == generation:
+                    cb(*args)
+            return guarded
+
+        def finished(s, id_):
+            self._slotsLock.acquire()
+            finished.called = True
+            if state.inFlight == id_:
+                state.inFlight = None
+            self._slotsLock.release()
+            if not done is None and state.generation == generation:
+                done(s, id_)
+        finished.called = False
+
+        # a file, an iterator or a StdinStream is streamed as it is
+        id_ = self.eval(lispCode,
+            value=current(value), stdout=current(stdout),
+            stdin=current(stdin) if callable(stdin) else stdin,
+            done=finished, stderr=current(stderr), error=current(error))
+
+        # the slot can have been superseded while the eval was being sent,
+        # before anyone could know its id to interrupt it
+        self._slotsLock.acquire()
+        superseded = state.generation != generation
+        if not superseded and not finished.called:
+            state.inFlight = id_
+        self._slotsLock.release()
+
+        if superseded and not finished.called:
+            self.interrupt(interrupt_id=id_)
 
     def close(self, closed=None):
         """closes a session, calls closed when complete"""
@@ -228,10 +905,80 @@ class NREPLSession:
         return self._generic_command(
             "describe", 
             extraResponse={
-                'versions': lambda s, v: addData('versions', v),
-                'ops': lambda s, v: addData('ops', v.keys()),
+                'versions': lambda s, id_, v: addData('versions', v),
+                # only the names of the ops, their descriptions stay undecoded
+                'ops': _lazy(lambda s, id_, v: addData('ops', v.keys())),
             },
-            done=lambda s: described(s, result))
+            done=lambda s, id_: described(s, result))
+
+    def complete(self, prefix, ns=None, completions=None, done=None):
+        '''asks the nrepl for the symbols that start with prefix, as seen
+        from the namespace ns. needs the 'complete' op (cider-nrepl)
+
+        :param completions: function callback, taking the session and a list
+        of maps, each with at least a 'candidate' key
+        '''
+
+        extra = {'prefix': prefix}
+        if not ns is None:
+            extra['ns'] = ns
+
+        result = []
+        def finished(s, id_):
+            if not completions is None:
+                completions(s, result)
+            if not done is None:
+                done(s, id_)
+
+        return self._generic_command(
+            "complete",
+            extraRequest=extra,
+            extraResponse={'completions': lambda s, id_, v: result.extend(v)},
+            done=finished)
+
+    def _symbol_command(self, op, symbol, ns, keys, callback, done):
+        '''sends an op that describes a symbol and calls back with a map of
+        the response fields in keys'''
+
+        extra = {'symbol': symbol}
+        if not ns is None:
+            extra['ns'] = ns
+
+        result = {}
+        def addData(k):
+            return lambda s, id_, v: result.__setitem__(k, v)
+
+        def finished(s, id_):
+            if not callback is None:
+                callback(s, result)
+            if not done is None:
+                done(s, id_)
+
+        return self._generic_command(
+            op,
+            extraRequest=extra,
+            extraResponse=dict((k, addData(k)) for k in keys),
+            done=finished)
+
+    def info(self, symbol, ns=None, info=None, done=None):
+        '''asks the nrepl for the documentation and location of symbol, as seen
+        from the namespace ns. needs the 'info' op (cider-nrepl)
+
+        :param info: function callback, taking the session and a map with
+        the fields in INFO_KEYS that the nrepl knew about
+        '''
+
+        return self._symbol_command("info", symbol, ns, INFO_KEYS, info, done)
+
+    def eldoc(self, symbol, ns=None, eldoc=None, done=None):
+        '''asks the nrepl for the arglists of symbol, as seen from the
+        namespace ns. needs the 'eldoc' op (cider-nrepl)
+
+        :param eldoc: function callback, taking the session and a map with
+        the fields in ELDOC_KEYS that the nrepl knew about
+        '''
+
+        return self._symbol_command("eldoc", symbol, ns, ELDOC_KEYS, eldoc, done)
 
     def interrupt(self, interrupt_id=None, result=None, done=None):
         '''Interrupts a running request on the nrepl bound with the current session. Calls back on result
@@ -248,17 +995,39 @@ class NREPLSession:
 
         extraRequest = None
         if not interrupt_id is None:
-        	extraRequest['interrupt-id'] = interrupt_id
+            extraRequest = {'interrupt-id': interrupt_id}
+
+        def resultCb(k):
+            return lambda s, id_: result(s, InterruptStatus.from_string(k))
 
         extraStatus = {}
-        for k in InterruptStatus._dict.keys():
-        	extraStatus[k] = lambda s: result(s, InterruptStatus.from_string(k))
+        if not result is None:
+            for k in InterruptStatus._dict.keys():
+                extraStatus[k] = resultCb(k)
 
-        return _generic_command(
-	        self, "interrupt", 
-	        extraRequest=extraRequest,
-	        extraStatus=extraStatus,
-	        done=None)
+        return self._generic_command(
+            "interrupt", 
+            extraRequest=extraRequest,
+            extraStatus=extraStatus,
+            done=done)
+
+    def cancel(self, id_):
+        '''interrupts the request id_ and stops delivering its responses to
+        its callbacks, done included. the nrepl only interrupts the eval the
+        session is running, one still queued behind it runs all the same
+        and what it produces is dropped. a single-flight eval is cancelled
+        for all the evals sharing it, see leave. returns whether the
+        request was waiting for responses'''
+
+        with self._flightsLock:
+            flight = self._flightsById.get(id_)
+        if not flight is None:
+            self._forget_flight(flight)
+        self._stop_stream(id_)
+        if not self._callbacks.discard(id_):
+            return False
+        self.interrupt(interrupt_id=id_)
+        return True
 
     def clone(self, newSessionCb):
         '''clones a session, calls newSessionCb with a new session instance'''
@@ -281,7 +1050,8 @@ class NREPLSession:
 
     def load_file(self, fileContents,
         fileName=None, filePath=None,
-        value=None, stdout=None, stdin=None, done=None):
+        value=None, stdout=None, stdin=None, done=None, stderr=None, coalesce=None,
+        error=None):
         '''loads the contents of a file into the session. optionally associates this
         with a name for the file and a relative path. Calls back with the value
 
@@ -293,6 +1063,9 @@ class NREPLSession:
         :type fileName: string
         :param filePath: optional, the relative path to the file
         :type filePath: string
+        :param stderr: optional callback, taking the session, the id and the stderr contents
+        :param coalesce: merges the stdout and stderr fragments, see eval
+        :param error: optional callback, taking the session and the id, invoked when loading the file threw an exception
 
         '''
 
@@ -306,166 +1079,73 @@ class NREPLSession:
         if not filePath is None:
             extra['file-path'] = filePath
 
-        self._generic_command(
+        def loaded(s, id_):
+            for listener in self._loadFileListeners:
+                listener(s, fileContents)
+            if not done is None:
+                done(s, id_)
+
+        return self._generic_command(
             "load-file",
             extraRequest=extra,
-            value=value, stdout=stdout, stdin=stdin, done=done)
-
-    def stdin(self, contents, stdin=None, done=None):
-        '''adds the contents of 'contents' to stdin on the nrepl session.
-        needInputCb will be called if more data is required to satisfy a read
-        operation on the session'''
-
-        self._generic_command(
-            "stdin", 
-            extraRequest={"stdin": contents},
-            stdin=stdin, done=done)
-
-class FakeListChannel(object):
-    """Channel that responds with a list of responses that are passed in as ctor arg"""
-
-    def __init__(self, responses):
-        self._responses = list(responses)
-        self._responses.reverse()
-
-    def processResult(self, session):
-        if len(self._responses) == 0:
-            raise Exception('not enough data')
-
-        nextData = self._responses.pop()
-        logger.debug("FaketListChannel: nextData = {0}".format(nextData))
-        for d in nextData:
-            session._receive_results(d)
-
-
-    def submit(self, data, session):
-        self.processResult(session)
-
-
-class NREPLSessionTests(unittest.TestCase):
+            value=value, stdout=stdout, stdin=stdin, done=loaded,
+            stderr=stderr, error=error, coalesce=coalesce)
 
-    def test_LoadFile(self):
-        session = NREPLSession(FakeListChannel([
-                [
-                    {"id": "0"}
-                ]
-                ]),
-            "1",
-            (str(i) for i in range(100)))
-
-        def called():
-            called.called = True
-        called.called = False
-
-        session.loadFile("this is the contents", called, "filename", "filepath")
-
-        self.assertTrue(called.called)
-
-    def test_happy_cases(self):
-        '''This tests that when a simple command is sent, it successfully 
-        receives the result and removes the callbacks when status 'done'
-        is received'''
-
-        # fake responses in reverse order
-        cbResponses = [
-            [
-                {"value": "6", "id": "0"},
-                {"value": "7", "id": "0"},
-                {"status": ["done"], "id": "0"}
-            ]
-        ]
-        channel = FakeListChannel(cbResponses)
-        session = NREPLSession(channel, "1", (str(i) for i in range(100)))
-
-        responses = []
-        session.eval("(+ 3 4)", lambda v: responses.append(v))
-
-        self.assertEquals(2, len(responses))
-        self.assertEquals("6", responses[0])
-        self.assertEquals("7", responses[1])
-        self.assertEquals(0, len(session._idBasedCallbacks))
-
-    def test_clone(self):
-        '''this tests that a session can clone itself'''
-        cbResponses = [
-            [
-                {"id": '1', "session": "1", "new-session": "2"}
-            ]
-        ]
-
-        channel = FakeListChannel(cbResponses)
-        session = NREPLSession(channel, '1', (str(i) for i in itertools.count(1)))
-
-        def accept_clone(clonedSession):
-            self.assertEquals('2', clonedSession._sessionId)
-            accept_clone.called = True
-        accept_clone.called = False
-
-        session.clone(accept_clone)
-        self.assertTrue(accept_clone.called)
-
-
-    def test_interrupt(self):
-
-        cbResponses = [
-            [{"id": "1", "status": ["interrupted"]}],
-            [{"id": "2", "status": ["session-idle"]}],
-            [{"id": "3", "status": ["interrupt-id-mismatch"]}]
-        ]
-
-        channel = FakeListChannel(cbResponses)
-        session = NREPLSession(channel, '2', (str(i) for i in itertools.count(1)))
-
-        statusii = iter([InterruptStatus.INTERRUPTED, InterruptStatus.SESSION_IDLE, InterruptStatus.INTERRUPT_ID_MISMATCH])
-
-        def received(i):
-            self.assertEquals(statusii.next(), i)
-            received.called = received.called + 1
-        received.called = 0
-
-        session.interrupt(received)
-        session.interrupt(received)
-        session.interrupt(received)
+    def load_file_path(self, path,
+        fileName=None, filePath=None,
+        value=None, stdout=None, stdin=None, done=None, stderr=None, coalesce=None,
+        error=None):
+        '''like load_file, but for a file on disk which is memory-mapped and
+        written to the connection straight from the mapping, so it is never
+        read into memory as a whole. the load-file listeners are called with
+        the mapping.
+
+        :param path: the path to the file to load
+        :type path: string
+        :param fileName: optional, the name of the file, the base name of path by default
+        :type fileName: string
 
-        self.assertEquals(3, received.called)
+        the other parameters are the same as for load_file
+        '''
 
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                contents = ''
+            else:
+                # the mapping stays valid after the file is closed, and is
+                # unmapped once the channel has sent it and lets go of it
+                contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-    def test_closing(self):
-        '''This tests that when a close is requested the close callbock will get fired'''
+        if fileName is None:
+            fileName = os.path.basename(path)
 
-        cbResponses = [
-            [],
-            [],
-            [
-                {"status": ["session-closed"]},
-                {"value": "7", "id": "0"},
-                {"status": ["done"], "id": "0"}
-            ]
-        ]
+        return self.load_file(contents, fileName=fileName, filePath=filePath,
+            value=value, stdout=stdout, stdin=stdin, done=done,
+            stderr=stderr, coalesce=coalesce, error=error)
 
-        channel = FakeListChannel(cbResponses)
-        session = NREPLSession(channel, "2", (str(i) for i in range(100)))
-
-        def receivedValue(data):
-            logger.debug("got data for request: {0}".format(data))
-            receivedValue.received = True
-        receivedValue.received = False
+    def add_load_file_listener(self, listener):
+        '''registers a function that is called with the session and the file's
+        contents every time a load_file on this session completes'''
 
-        session.eval("(+ 3 4)", receivedValue)
+        self._loadFileListeners.append(listener)
 
-        def setClosed():
-            logger.debug("Received session closed callback")
-            setClosed.closed = True
-        setClosed.closed = False
-        session.close(setClosed)
+    def add_unknown_op_listener(self, listener):
+        '''registers a function that is called with the session and the name of
+        the op every time the nrepl answers a request with the 'unknown-op' status'''
 
-        channel.processResult(session)
+        self._unknownOpListeners.append(listener)
 
-        self.assertEquals(True, setClosed.closed)
-        self.assertEquals(True, receivedValue.received)
+    def _unknown_op(self, op):
+        logger.debug("the nrepl does not know the op '{0}'".format(op))
+        for listener in self._unknownOpListeners:
+            listener(self, op)
 
+    def stdin(self, contents, stdin=None, done=None):
+        '''adds the contents of 'contents' to stdin on the nrepl session.
+        needInputCb will be called if more data is required to satisfy a read
+        operation on the session'''
 
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
-    logger.debug("starting unit tests")
-    unittest.main()
\ No newline at end of file
+        self._generic_command(
+            "stdin", 
+            extraRequest={"stdin": contents},
+            stdin=stdin, done=done)
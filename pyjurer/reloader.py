@@ -0,0 +1,522 @@
+#! /usr/bin/env python
+'''watches source directories and reloads the namespaces of the files that
+change into a running nrepl, without reloading everything.
+
+changes are picked up with inotify on linux, or by polling the files'
+stats where there is no inotify. a burst of changes, like an editor saving
+several files or a checkout touching hundreds, is collected until no more
+come for DEBOUNCE_QUIET seconds and reloaded at once. what is reloaded is
+the namespaces declared by the changed files and those that require them,
+directly or not, each after the namespaces it requires. the load-files are
+pipelined on one session kept for reloading, which runs them in order, and
+every reload is reported with how long it took from the first change'''
+
+import ctypes, ctypes.util, errno, logging, os, select, struct, sys, threading, time, Queue
+
+from forms import namespace_of, required_namespaces
+
+logger = logging.getLogger(__name__)
+
+SOURCE_EXTENSIONS = ('.clj', '.cljc')
+# seconds without a change that end a burst of them
+DEBOUNCE_QUIET = 0.05
+# seconds at most between the first change of a burst and its reload
+DEBOUNCE_MAX = 1.0
+# seconds between two polls of the files' stats
+POLL_INTERVAL = 0.5
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 04000
+IN_CLOEXEC = 02000000
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT = struct.Struct('iIII')
+
+def _is_source(name, extensions):
+	# skips the lock, backup and swap files of editors
+	return name.endswith(extensions) and not name.startswith('.')
+
+def _is_hidden(name):
+	return name.startswith('.')
+
+def _sources_under(top, extensions):
+	'''the source files under the directory top'''
+
+	for dirpath, dirnames, filenames in os.walk(top):
+		dirnames[:] = [d for d in dirnames if not _is_hidden(d)]
+		for name in filenames:
+			if _is_source(name, extensions):
+				yield os.path.join(dirpath, name)
+
+class _PollingWatcher(object):
+	'''stats every source file each time it polls. a directory is listed
+	again only when its mtime changed, which is when entries were added to
+	it or removed from it'''
+
+	def __init__(self, roots, extensions, interval=POLL_INTERVAL):
+		self._extensions = extensions
+		self._interval = interval
+		self._woken = threading.Event()
+		# path => mtime of the directories, (mtime, size, inode) of the files
+		self._dirs = {}
+		self._files = {}
+		for root in roots:
+			self._add_dir(root, set())
+
+	def _add_dir(self, path, changed):
+		try:
+			self._dirs[path] = os.stat(path).st_mtime
+			names = os.listdir(path)
+		except OSError:
+			self._dirs.pop(path, None)
+			return
+		for name in names:
+			self._add(os.path.join(path, name), name, changed)
+
+	def _add(self, path, name, changed):
+		if path in self._dirs or path in self._files or _is_hidden(name):
+			return
+		if os.path.isdir(path):
+			self._add_dir(path, changed)
+		elif _is_source(name, self._extensions):
+			try:
+				st = os.stat(path)
+			except OSError:
+				return
+			self._files[path] = (st.st_mtime, st.st_size, st.st_ino)
+			changed.add(path)
+
+	def changes(self, timeout=None):
+		'''waits up to timeout seconds, and no longer than the poll interval,
+		then returns the set of paths changed since the last call'''
+
+		self._woken.wait(self._interval if timeout is None else min(timeout, self._interval))
+		if self._woken.is_set():
+			return set()
+
+		changed = set()
+		for path, mtime in self._dirs.items():
+			try:
+				current = os.stat(path).st_mtime
+			except OSError:
+				# removed, its files are found missing below
+				del self._dirs[path]
+				continue
+			if current != mtime:
+				self._dirs[path] = current
+				try:
+					names = os.listdir(path)
+				except OSError:
+					continue
+				for name in names:
+					self._add(os.path.join(path, name), name, changed)
+
+		for path, signature in self._files.items():
+			try:
+				st = os.stat(path)
+			except OSError:
+				del self._files[path]
+				changed.add(path)
+				continue
+			current = (st.st_mtime, st.st_size, st.st_ino)
+			if current != signature:
+				self._files[path] = current
+				changed.add(path)
+		return changed
+
+	def wake(self):
+		'''makes changes return now, and from then on'''
+		self._woken.set()
+
+	def close(self):
+		pass
+
+def _load_libc():
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+		libc.inotify_init1.argtypes = [ctypes.c_int]
+		libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+		libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+		return libc
+	except (OSError, AttributeError):
+		return None
+
+_libc = _load_libc() if sys.platform.startswith('linux') else None
+
+class _InotifyWatcher(object):
+	'''has the kernel tell it about the changes in every directory under
+	the roots. new directories are watched as they appear'''
+
+	def __init__(self, roots, extensions):
+		self._roots = roots
+		self._extensions = extensions
+		self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self._fd < 0:
+			e = ctypes.get_errno()
+			raise OSError(e, os.strerror(e))
+		self._wakeupReader, self._wakeupWriter = os.pipe()
+		# watch descriptor => directory
+		self._dirs = {}
+		try:
+			for root in roots:
+				self._watch_tree(root, None)
+		except OSError:
+			self.close()
+			raise
+
+	def _watch_tree(self, top, changed):
+		'''watches top and the directories under it. the watch is added
+		before a directory is listed, so no file created in it is missed.
+		changed => a set the source files found are added to, or None'''
+
+		wd = _libc.inotify_add_watch(self._fd, top, _WATCH_MASK)
+		if wd < 0:
+			e = ctypes.get_errno()
+			if e in (errno.ENOENT, errno.ENOTDIR):
+				return
+			# ENOSPC is running out of fs.inotify.max_user_watches
+			raise OSError(e, '{0}: {1}'.format(os.strerror(e), top))
+		self._dirs[wd] = top
+		try:
+			names = os.listdir(top)
+		except OSError:
+			return
+		for name in names:
+			if _is_hidden(name):
+				continue
+			path = os.path.join(top, name)
+			if os.path.isdir(path):
+				self._watch_tree(path, changed)
+			elif not changed is None and _is_source(name, self._extensions):
+				changed.add(path)
+
+	def _unwatch_tree(self, top):
+		prefix = top + os.sep
+		for wd, path in self._dirs.items():
+			if path == top or path.startswith(prefix):
+				_libc.inotify_rm_watch(self._fd, wd)
+				del self._dirs[wd]
+
+	def changes(self, timeout=None):
+		'''waits up to timeout seconds, forever when it is None, for changes
+		and returns the set of paths that changed. a directory that was
+		removed or moved away is in there as itself'''
+
+		try:
+			readable, writable, failed = select.select([self._fd, self._wakeupReader], [], [], timeout)
+		except select.error as e:
+			if e.args[0] == errno.EINTR:
+				return set()
+			raise
+		if not self._fd in readable or self._wakeupReader in readable:
+			return set()
+
+		chunks = []
+		while True:
+			try:
+				chunks.append(os.read(self._fd, 65536))
+			except OSError as e:
+				if e.errno in (errno.EAGAIN, errno.EINTR):
+					break
+				raise
+		data = ''.join(chunks)
+
+		changed = set()
+		offset = 0
+		while offset < len(data):
+			wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+			name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip('\0')
+			offset += _EVENT.size + length
+
+			if mask & IN_Q_OVERFLOW:
+				logger.warning('inotify dropped events, treating every source file as changed')
+				for root in self._roots:
+					changed.update(_sources_under(root, self._extensions))
+				continue
+			top = self._dirs.get(wd)
+			if top is None:
+				continue
+			if mask & IN_IGNORED:
+				del self._dirs[wd]
+				continue
+			if _is_hidden(name):
+				continue
+
+			path = os.path.join(top, name)
+			if mask & IN_ISDIR:
+				if mask & (IN_CREATE | IN_MOVED_TO):
+					self._watch_tree(path, changed)
+				elif mask & (IN_DELETE | IN_MOVED_FROM):
+					self._unwatch_tree(path)
+					changed.add(path)
+			elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE) and \
+					_is_source(name, self._extensions):
+				changed.add(path)
+		return changed
+
+	def wake(self):
+		'''makes changes return now, and from then on'''
+		os.write(self._wakeupWriter, 'x')
+
+	def close(self):
+		for fd in (self._fd, self._wakeupReader, self._wakeupWriter):
+			os.close(fd)
+
+def create_watcher(roots, extensions=SOURCE_EXTENSIONS, polling=False, pollInterval=POLL_INTERVAL):
+	'''watches roots with inotify where it can, by polling otherwise'''
+
+	if not polling and not _libc is None:
+		try:
+			return _InotifyWatcher(roots, extensions)
+		except OSError as e:
+			logger.warning('inotify is not available, polling instead: {0}'.format(e))
+	return _PollingWatcher(roots, extensions, pollInterval)
+
+class NamespaceGraph(object):
+	'''the namespaces declared by the source files and the namespaces they
+	require, read from their ns forms'''
+
+	def __init__(self):
+		# path => (namespace, [required namespaces])
+		self._files = {}
+
+	def update(self, path):
+		'''reads the ns form of path again, forgets path when it is gone.
+		returns the namespaces path declared before and declares now'''
+
+		before = self._files.pop(path, (None, []))[0]
+		try:
+			with open(path, 'rb') as f:
+				text = f.read()
+		except (IOError, OSError):
+			return set(n for n in (before,) if n)
+		ns = namespace_of(text)
+		if not ns is None:
+			self._files[path] = (ns, required_namespaces(text))
+		return set(n for n in (before, ns) if n)
+
+	def affected(self, paths, dependents=True):
+		'''updates the graph for the changed paths and returns the (namespace,
+		path) of every namespace to reload, each after those it requires.
+		a path that is not a file any more is a source file or a directory
+		that was removed. dependents => also the namespaces that require
+		the changed ones, directly or not'''
+
+		changed = set()
+		for path in paths:
+			if not path in self._files and not os.path.isfile(path):
+				# a removed directory takes its files with it
+				prefix = path + os.sep
+				for known in [p for p in self._files if p.startswith(prefix)]:
+					changed |= self.update(known)
+			else:
+				changed |= self.update(path)
+
+		declared = dict((ns, path) for path, (ns, requires) in self._files.iteritems())
+		requiredBy = {}
+		for ns, requires in self._files.itervalues():
+			for required in requires:
+				requiredBy.setdefault(required, set()).add(ns)
+
+		affected = set(changed)
+		if dependents:
+			todo = list(changed)
+			while todo:
+				for dependent in requiredBy.get(todo.pop(), ()):
+					if not dependent in affected:
+						affected.add(dependent)
+						todo.append(dependent)
+		affected &= set(declared)
+
+		# orders them by their requires, from the namespaces nothing in
+		# the set requires, taking names in order where there is a choice
+		waitingFor = dict((ns, set(r for r in self._files[declared[ns]][1] if r in affected and r != ns))
+			for ns in affected)
+		order = []
+		ready = sorted(ns for ns, required in waitingFor.iteritems() if not required)
+		while ready:
+			ns = ready.pop(0)
+			order.append(ns)
+			del waitingFor[ns]
+			for dependent in sorted(requiredBy.get(ns, ())):
+				required = waitingFor.get(dependent)
+				if not required is None and ns in required:
+					required.discard(ns)
+					if not required:
+						ready.append(dependent)
+			ready.sort()
+		if waitingFor:
+			logger.warning('cyclic requires between {0}'.format(', '.join(sorted(waitingFor))))
+			order.extend(sorted(waitingFor))
+		return [(ns, declared[ns]) for ns in order]
+
+class ReloadReport(object):
+	'''what one reload did and how long it took. times are time.time()
+
+	paths => the changed paths, sorted
+	namespaces => the reloaded namespaces, in the order they were loaded
+	failed => the namespaces whose loading threw
+	errors => namespace => what loading it wrote to stderr
+	detected => when the first change was seen
+	started, finished => when the first load-file was sent and the last was done'''
+
+	def __init__(self, paths, namespaces, detected):
+		self.paths = sorted(paths)
+		self.namespaces = namespaces
+		self.failed = []
+		self.errors = {}
+		self.detected = detected
+		self.started = time.time()
+		self.finished = None
+
+	@property
+	def latency(self):
+		'''seconds from the first change to the end of the reload'''
+		return self.finished - self.detected
+
+	@property
+	def reload_time(self):
+		'''seconds the load-files took'''
+		return self.finished - self.started
+
+	def __repr__(self):
+		return 'ReloadReport({0} namespaces, {1} failed, {2:.1f} ms after the change)'.format(
+			len(self.namespaces), len(self.failed), self.latency * 1000)
+
+def _log_report(report):
+	if report.failed:
+		logger.warning('reloading {0} failed, {1:.1f} ms after the change'.format(
+			', '.join(report.failed), report.latency * 1000))
+	else:
+		logger.info('reloaded {0} in {1:.1f} ms, {2:.1f} ms after the change'.format(
+			', '.join(report.namespaces), report.reload_time * 1000, report.latency * 1000))
+
+class Reloader(object):
+	'''reloads the namespaces of the files under roots into session when
+	they change. session should be one of its own, so reloads do not wait
+	for the evals of other sessions to finish, or make them wait'''
+
+	def __init__(self, session, roots, reloaded=None, extensions=SOURCE_EXTENSIONS,
+		quiet=DEBOUNCE_QUIET, maxDelay=DEBOUNCE_MAX, dependents=True,
+		polling=False, pollInterval=POLL_INTERVAL):
+		'''session => the NREPLSession the namespaces are loaded into
+		roots => the source directories, the roots of the file paths sent with load-file
+		reloaded => called with a ReloadReport when a reload is done, logs it by default
+		extensions => the extensions of source files
+		quiet, maxDelay => the seconds without a change that end a burst of them,
+		and the seconds at most between the first change of a burst and its reload
+		dependents => whether the namespaces that require the changed ones are reloaded too
+		polling => polls the files' stats every pollInterval seconds even where there is inotify'''
+
+		self._session = session
+		self._roots = [os.path.abspath(r) for r in roots]
+		self._reloaded = _log_report if reloaded is None else reloaded
+		self._quiet = quiet
+		self._maxDelay = maxDelay
+		self._dependents = dependents
+		self._stopping = False
+
+		# the graph is only used on the watcher's thread after this
+		self._graph = NamespaceGraph()
+		for root in self._roots:
+			for path in _sources_under(root, extensions):
+				self._graph.update(path)
+		self._watcher = create_watcher(self._roots, extensions, polling, pollInterval)
+		self._thread = threading.Thread(target=self._run, name='pyjurer-reloader')
+		self._thread.daemon = True
+
+	def start(self):
+		self._thread.start()
+		return self
+
+	def stop(self):
+		'''stops watching, reloads already sent still finish'''
+
+		self._stopping = True
+		self._watcher.wake()
+		self._thread.join()
+		self._watcher.close()
+
+	def _run(self):
+		pending = set()
+		first = last = None
+		while not self._stopping:
+			timeout = None
+			if pending:
+				timeout = max(0, min(last + self._quiet, first + self._maxDelay) - time.time())
+			try:
+				paths = self._watcher.changes(timeout)
+			except Exception:
+				logger.exception('watching the sources failed')
+				return
+			now = time.time()
+			if paths:
+				if not pending:
+					first = now
+				pending |= paths
+				last = now
+			if pending and not self._stopping and (now >= last + self._quiet or now >= first + self._maxDelay):
+				try:
+					self._reload(pending, first)
+				except Exception:
+					logger.exception('reloading {0} failed'.format(', '.join(sorted(pending))))
+				pending = set()
+
+	def _file_path(self, path):
+		for root in self._roots:
+			if path.startswith(root + os.sep):
+				return os.path.relpath(path, root)
+		return None
+
+	def _reload(self, paths, detected):
+		order = self._graph.affected(paths, self._dependents)
+		if not order:
+			return
+
+		report = ReloadReport(paths, [ns for ns, path in order], detected)
+		lock = threading.Lock()
+		remaining = [len(order)]
+
+		def loaded():
+			with lock:
+				remaining[0] -= 1
+				if remaining[0] > 0:
+					return
+			report.finished = time.time()
+			self._reloaded(report)
+
+		def failed(ns):
+			with lock:
+				report.failed.append(ns)
+
+		def wrote_error(ns, err):
+			with lock:
+				report.errors[ns] = report.errors.get(ns, '') + err
+
+		for ns, path in order:
+			try:
+				self._session.load_file_path(path, filePath=self._file_path(path),
+					error=lambda s, id_, ns=ns: failed(ns),
+					stderr=lambda s, id_, err, ns=ns: wrote_error(ns, err),
+					done=lambda s, id_: loaded())
+			except (IOError, OSError) as e:
+				# removed between the change and the reload
+				logger.warning('cannot load {0}: {1}'.format(path, e))
+				failed(ns)
+				loaded()
+
+def create_reloader(container, roots, timeout=10, **options):
+	'''clones a session of container for reloading and returns a started
+	Reloader on it. the options are the same as Reloader's'''
+
+	created = Queue.Queue()
+	container.create_new_session(created.put)
+	session = created.get(True, timeout)
+	return Reloader(session, roots, **options).start()
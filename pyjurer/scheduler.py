@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+'''one thread that calls functions once their delay is up, for the timers
+sessions start on their requests, like the timed flush of coalesced
+output. a threading.Timer is a thread of its own, started and torn down
+for every one of them.
+
+the pending calls are kept in a heap by deadline. a cancelled call stays
+in the heap and is skipped when its deadline comes, unless the cancelled
+ones get to be most of the heap, which is then rebuilt without them.
+the calls are made one after the other on the scheduler's thread, so a
+call that takes long holds up the ones due after it'''
+
+import heapq, itertools, logging, threading, time
+
+logger = logging.getLogger(__name__)
+
+# the cancelled calls kept in the heap before it is rebuilt without them,
+# when they are half of it or more
+COMPACT_CANCELLED = 64
+
+class _Call(object):
+	'''a call to be made at deadline, which cancel() stops'''
+
+	__slots__ = ('deadline', 'function', 'args', 'cancelled', '_scheduler')
+
+	def __init__(self, scheduler, deadline, function, args):
+		self._scheduler = scheduler
+		self.deadline = deadline
+		self.function = function
+		self.args = args
+		self.cancelled = False
+
+	def cancel(self):
+		'''stops the call from being made, if it was not made yet'''
+		self._scheduler._cancel(self)
+
+class Scheduler(object):
+	'''calls functions at their deadlines, all of them on one thread'''
+
+	def __init__(self):
+		self._condition = threading.Condition(threading.Lock())
+		self._heap = []
+		self._order = itertools.count()
+		self._cancelled = 0
+		self._running = True
+
+		self._thread = threading.Thread(target=self._run, name='pyjurer-scheduler')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def call_later(self, delay, function, *args):
+		'''calls function with args on the scheduler's thread in delay
+		seconds. returns the call, to cancel it'''
+
+		call = _Call(self, time.time() + delay, function, args)
+		with self._condition:
+			# the order breaks ties, so calls due at once are made in turn
+			heapq.heappush(self._heap, (call.deadline, next(self._order), call))
+			if self._heap[0][2] is call:
+				self._condition.notify()
+		return call
+
+	def close(self):
+		'''stops the thread, the calls still pending are not made'''
+
+		with self._condition:
+			self._running = False
+			self._condition.notify()
+		self._thread.join()
+
+	def __len__(self):
+		'''the calls still pending'''
+		with self._condition:
+			return len(self._heap) - self._cancelled
+
+	def _cancel(self, call):
+		with self._condition:
+			if call.cancelled or call.function is None:
+				return
+			call.cancelled = True
+			self._cancelled += 1
+			if self._cancelled >= COMPACT_CANCELLED and self._cancelled * 2 >= len(self._heap):
+				self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+				heapq.heapify(self._heap)
+				self._cancelled = 0
+
+	def _run(self):
+		condition = self._condition
+		while True:
+			condition.acquire()
+			try:
+				call = None
+				while self._running:
+					if not self._heap:
+						condition.wait()
+						continue
+					deadline, order, first = self._heap[0]
+					if first.cancelled:
+						heapq.heappop(self._heap)
+						self._cancelled -= 1
+						continue
+					remaining = deadline - time.time()
+					if remaining > 0:
+						condition.wait(remaining)
+						continue
+					heapq.heappop(self._heap)
+					call = first
+					break
+				if call is None:
+					return
+				function, args = call.function, call.args
+				# made, so a late cancel has nothing to count
+				call.function = call.args = None
+			finally:
+				condition.release()
+
+			try:
+				function(*args)
+			except Exception:
+				logger.exception('a scheduled call failed')
+
+_shared = None
+_sharedLock = threading.Lock()
+
+def shared_scheduler():
+	'''the scheduler of the process, started on first use'''
+
+	global _shared
+	with _sharedLock:
+		if _shared is None:
+			_shared = Scheduler()
+		return _shared
@@ -1,24 +1,52 @@
 #! /usr/bin/env python
 
-import unittest, threading, itertools
+import sys, threading, itertools, urlparse
 
-from channels.tcp import Tcp
-from transports.bcode_transport import BCodeTransport
 from nrepl_session import NREPLSession
 
+class IdAllocator(object):
+	'''an iterator of unique request ids that any number of threads can
+	draw from at once.
+
+	calling next() on a generator from two threads at the same time raises
+	"generator already executing". itertools.count is implemented in C and
+	its next() runs under the GIL without releasing it, so it needs no lock
+
+	>>> ids = IdAllocator()
+	>>> ids.next(), ids.next()
+	('1', '2')
+	'''
+
+	def __init__(self, prefix=''):
+		'''prefix => optional string that every id starts with'''
+
+		self._counter = itertools.count(1)
+		self._prefix = prefix
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		return self._prefix + str(self._counter.next())
+
 class SessionContainer(object):
 	'''a nrepl-aware container for logic dealing with nrepl sessions.
 
 	this presents a callback-based api for interacting with nrepl'''
 
-	def __init__(self, sender, idGenerator):
+	def __init__(self, sender, idGenerator=None, admission=None):
 		'''creates a session container
 
 		sender => a function of one param that accepts python data for sending via the transport
-		idGenerator => an iterator that creates unique strings used for identifying nrepl instructions'''
+		idGenerator => an iterator that creates unique strings used for identifying nrepl instructions.
+		it is shared with the container's sessions, so it has to be safe to call from every thread
+		that submits requests. by default the container gets an IdAllocator of its own
+		admission => optional admission.AdmissionController that decides when the requests
+		of the sessions are sent. _submit raises admission.AdmissionRejected when it rejects one'''
 
 		self._sender = sender
-		self._idGen = idGenerator
+		self._admission = admission
+		self._idGen = IdAllocator() if idGenerator is None else idGenerator
 		self._newSessionLock = threading.Lock()
 		self._newSessionCallbacks = {}
 		self._sessions = {}
@@ -80,6 +108,9 @@ class SessionContainer(object):
 
 		sessionId = data['session']
 
+		if not self._admission is None and 'done' in data.get('status', ()):
+			self._admission.completed(id_)
+
 		if self._sessions.has_key(sessionId):
 			self._sessions[sessionId]._receive_results(data)
 		else:
@@ -96,6 +127,15 @@ class SessionContainer(object):
 			else:
 				self._handle_new_session_response(data, newSessionCallback)
 
+	def _connection_lost(self):
+		'''called when the connection is gone or stopped, after which none of
+		the requests in flight is answered'''
+
+		for session in self._sessions.values():
+			session._connection_lost()
+		if not self._admission is None:
+			self._admission.reset()
+
 	def _submit(self, data):
 		"""Submits data to the channel. Called by the session.
 
@@ -110,18 +150,71 @@ class SessionContainer(object):
 		if not sessionId in self._sessions:
 			raise ValueError('called _submit with data that references a session that was not created with this container')
 
-		self._sender(data)
+		if self._admission is None:
+			self._sender(data)
+		else:
+			self._admission.submit(data, self._sender)
 
 
-sessionidCreator = (str(i) for i in itertools.count(1))
+STOP_TIMEOUT = 1.0 # seconds stopping a container waits for what is queued to be sent
 
 tcp_sessions = {}
+bcode_transports = {}
+
+def stop_bcode_over_tcp_session_container(sessionContainer, flush=True, timeout=STOP_TIMEOUT):
+	'''stops the channel of sessionContainer. flush => whether what was
+	queued is sent first, for at most timeout seconds, or dropped'''
 
-def stop_bcode_over_tcp_session_container(sessionContainer):
 	tcp = tcp_sessions.pop(sessionContainer)
-	tcp.stop()
+	tcp.stop(flush=flush, timeout=timeout)
+	sessionContainer._connection_lost()
+	bcode_transports.pop(sessionContainer).close()
+
+# containers made with create_bcode_session_container are stopped the same way
+stop_bcode_session_container = stop_bcode_over_tcp_session_container
+
+def _create_bcode_session_container(channel, record, offloadThreshold, admission, lazyDecoding):
+	'''wires a SessionContainer to channel through a BCodeTransport and starts it'''
+
+	from transports.bcode_transport import BCodeTransport
+	from transports.async_bcode_deserialiser import DecodeError
+
+	if not record is None:
+		from channels.recording import RecordingChannel
+		channel = RecordingChannel(channel, record)
+
+	bcode = BCodeTransport(channel.send, offloadThreshold=offloadThreshold, lazy=lazyDecoding)
+	def receive(raw):
+		try:
+			bcode.receive(raw)
+		except DecodeError:
+			# nothing that comes after it can be read
+			sessionContainer._connection_lost()
+	channel.add_callback(receive)
+	sessionContainer = SessionContainer(bcode.send, admission=admission)
+	bcode.add_callback(sessionContainer._accept_data)
+	# like a socket's recv, channels hand on an empty string once the other end is gone
+	channel.add_callback(lambda raw: len(raw) == 0 and sessionContainer._connection_lost())
+
+	try:
+		channel.start()
+	except:
+		error = sys.exc_info()
+		# the error of the start is the one that matters
+		try:
+			channel.stop(flush=False, timeout=0)
+		except Exception:
+			pass
+		bcode.close()
+		raise error[0], error[1], error[2]
+
+	tcp_sessions[sessionContainer] = channel
+	bcode_transports[sessionContainer] = bcode
 
-def create_bcode_over_tcp_session_container(host, port):
+	return sessionContainer
+
+def create_bcode_over_tcp_session_container(host, port, record=None, offloadThreshold=None, admission=None,
+	lazyDecoding=False, **tcpOptions):
 	'''creates a new session and returns it. Connects with an NREPL that 
 	is hosted on host:port and uses bencode as the transport
 
@@ -129,26 +222,97 @@ def create_bcode_over_tcp_session_container(host, port):
 	:type host: string
 	:param port: the port number to connect to
 	:type port: int
+	:param record: optional path of a file that every chunk sent and received
+	on the connection is appended to, see channels.recording
+	:type record: string
+	:param offloadThreshold: optional number of bencode tokens from which response
+	frames are decoded in a worker process, see transports.offload
+	:type offloadThreshold: int
+	:param admission: optional admission.AdmissionController for the requests
+	sent on the connection
+	:type admission: AdmissionController
+	:param lazyDecoding: only decode the response fields the callbacks look up,
+	see transports.bcode.LazyDict
+	:type lazyDecoding: bool
+	:param tcpOptions: socket options passed on to channels.tcp.Tcp, like
+	nodelay, sendBufferSize, receiveBufferSize, maxReadSize, reactor and
+	connectTimeout
 	:return: An instance of SessionContainer that will communicate with the networked NREPL
 	that is configured to use bencoding.
 	:rtype: SessionContainer
 
 	''' 
 
-	tcp = Tcp(host, port)
-	bcode = BCodeTransport(tcp.send)
-	tcp.add_callback(bcode.receive)
-	sessionContainer = SessionContainer(bcode.send, sessionidCreator)
-	bcode.add_callback(sessionContainer._accept_data)
-
-	tcp.start()
-
-	tcp_sessions[sessionContainer] = tcp
-
-	return sessionContainer
+	# imported here so that users of SessionContainer with other
+	# channels do not pay for the socket and threading machinery
+	from channels.tcp import Tcp
+
+	return _create_bcode_session_container(Tcp(host, port, **tcpOptions), record, offloadThreshold, admission, lazyDecoding)
+
+def create_bcode_session_container(uri, record=None, offloadThreshold=None, admission=None,
+	lazyDecoding=False, **options):
+	'''like create_bcode_over_tcp_session_container, for the nrepl at uri:
+
+	tcp://host:port or nrepl://host:port => channels.tcp.Tcp
+	unix:///path/to/socket => channels.unix.UnixSocket
+	inproc://name => channels.inproc, the server that listens under name
+
+	:param options: passed on to the channel, see Tcp and UnixSocket
+	'''
+
+	parts = urlparse.urlsplit(uri)
+	if parts.scheme in ('tcp', 'nrepl'):
+		from channels.tcp import Tcp
+		channel = Tcp(parts.hostname, parts.port, **options)
+	elif parts.scheme == 'unix':
+		from channels.unix import UnixSocket
+		channel = UnixSocket(parts.path, **options)
+	elif parts.scheme == 'inproc':
+		from channels import inproc
+		channel = inproc.connect(parts.netloc)
+	else:
+		raise ValueError("unsupported nrepl uri '{0}'".format(uri))
+
+	return _create_bcode_session_container(channel, record, offloadThreshold, admission, lazyDecoding)
+
+def create_bcode_session_containers(uris, **options):
+	'''like create_bcode_session_container for every uri in uris, connecting
+	to all of them at once, so opening n containers takes about as long as
+	the slowest connect rather than the sum of them. returns the containers
+	in the order of uris.
+
+	when a connect fails, the containers that were opened are stopped and
+	the error of the first uri that failed is raised
+
+	:param options: passed on to create_bcode_session_container, for every uri
+	'''
+
+	uris = list(uris)
+	results = [None] * len(uris)
+
+	def connect(i):
+		try:
+			results[i] = (create_bcode_session_container(uris[i], **options), None)
+		except Exception:
+			results[i] = (None, sys.exc_info())
+
+	threads = [threading.Thread(target=connect, args=(i,), name='pyjurer-connect-{0}'.format(i))
+		for i in range(len(uris))]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	failures = [failure for container, failure in results if not failure is None]
+	if failures:
+		for container, failure in results:
+			if not container is None:
+				stop_bcode_session_container(container, flush=False)
+		raise failures[0][0], failures[0][1], failures[0][2]
+	return [container for container, failure in results]
 
 
 if __name__ == "__main__":
 	import doctest
 	doctest.testmod()
-
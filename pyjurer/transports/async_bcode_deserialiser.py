@@ -3,15 +3,149 @@
 '''class to interpret unknown lengths of bencoded strings
 keeps remnants around until more data is received'''
 
-import bcode
-import unittest
+import bcode, logging, threading
+
+logger = logging.getLogger(__name__)
+
+class DecodeError(ValueError):
+    '''raised by push_data when the data received is not bencode. there is
+    no telling where the next frame starts after that, so the deserialiser
+    drops what it has buffered and ignores everything pushed from then on'''
+
+class _Incomplete(Exception):
+    '''raised by frame_end when the buffer stops in the middle of a frame.
+    needed is the buffer length that is at least required to get further,
+    resume the offset of the token that could not be finished, depth the
+    nesting depth at that token and tokens the number of tokens walked up to
+    it, to pass to _walk to carry on from there'''
+
+    def __init__(this, needed, resume, depth, tokens):
+        Exception.__init__(this, needed)
+        this.needed = needed
+        this.resume = resume
+        this.depth = depth
+        this.tokens = tokens
+
+def _walk(data, start=0, depth=0, tokens=0, marks=None, base=0):
+    '''frame_end, returning the number of tokens in the value as well.
+
+    marks => optional list that the offset just past every token at the top
+    level of the dictionary being walked is appended to, plus base'''
+
+    n = len(data)
+    i = start
+    while True:
+        if i >= n:
+            raise _Incomplete(i + 1, i, depth, tokens)
+        c = data[i]
+        if c == 'd' or c == 'l':
+            depth += 1
+            i += 1
+            tokens += 1
+            continue
+        elif c == 'e':
+            if depth == 0:
+                raise ValueError("Unexpected 'e' at offset %d" % i)
+            depth -= 1
+            i += 1
+        elif c == 'i':
+            j = data.find('e', i)
+            if j == -1:
+                raise _Incomplete(n + 1, i, depth, tokens)
+            i = j + 1
+        elif c.isdigit():
+            j = data.find(':', i, i + 21)
+            if j == -1:
+                if n - i > 20:
+                    raise ValueError("Invalid string length at offset %d" % i)
+                raise _Incomplete(n + 1, i, depth, tokens)
+            end = j + 1 + int(data[i:j])
+            if end > n:
+                raise _Incomplete(end, i, depth, tokens)
+            i = end
+        else:
+            raise ValueError("Invalid initial delimiter %r at offset %d" % (c, i))
+
+        tokens += 1
+        if depth <= 1:
+            if depth == 0:
+                return i, tokens
+            if not marks is None:
+                marks.append(i + base)
+
+def frame_end(data, start=0, depth=0):
+    '''returns the index just past the bencoded value that starts at start.
+    only the structure is walked, the contents of strings are skipped over
+    using their length prefix, so this costs the number of tokens in the
+    value and not its size. raises _Incomplete if data ends before the value
+    does and ValueError if it is not bencode.
+
+    depth is the number of lists and dictionaries start is inside of, when
+    carrying on from where an _Incomplete stopped'''
+
+    return _walk(data, start, depth)[0]
+
+def frame_field(data, key, start=0):
+    '''returns the string value of key in the bencoded dictionary that starts
+    at start, walking only the dictionary's top level, without decoding the
+    other values. None when there is no such key or its value is not a string'''
+
+    if data[start] != 'd':
+        return None
+    i = start + 1
+    while data[i] != 'e':
+        name, i = bcode._decode_string(data, i)
+        if name == key and data[i].isdigit():
+            return bcode._decode_string(data, i)[0]
+        i = frame_end(data, i)
+    return None
 
 class AsyncBCodeDeserialiser:
 
 
-    def __init__(this):
+    def __init__(this, offload=None, lazy=False):
+        '''offload => optional transports.offload.OffloadDecoder. frames of
+        its threshold number of tokens or more are then decoded by it, and the frames
+        of the same request that come after such a frame are held back until
+        it is decoded. the frames of other requests are not, so the callbacks
+        can be called from the offload decoder's thread as well, but never
+        from two threads at the same time
+        lazy => decode the frames with bcode.lazy_bdecode, so the values no
+        callback looks up are never decoded'''
+
         this._cb = []
-        this._buffer = ''
+        this._lazy = lazy
+        # the data received after the part of the current frame that has
+        # been walked already, kept as a list of chunks that is only joined
+        # once there is enough of it to get further
+        this._chunks = []
+        this._size = 0
+        this._needed = 1
+        # the part of the current frame that has been walked, the nesting
+        # depth where the walk stopped and the tokens walked until there
+        this._walked = []
+        this._walkedSize = 0
+        this._depth = 0
+        this._tokens = 0
+        # the offsets in the current frame of the ends of its top-level
+        # keys and values, collected by the walk for lazy decoding
+        this._marks = [] if lazy else None
+
+        this._offload = offload
+        # the offload.Spool the current frame is written to when it has a
+        # string of the offload decoder's spoolSize, the spans of those
+        # strings in it as (offset of the token, offset, length), where the
+        # walk carries on from and the size the spool has to get to first
+        this._spool = None
+        this._spans = []
+        this._walkFrom = 0
+        this._spoolNeeded = 0
+        this._lock = threading.RLock()
+        # request id => the [decoded, value] slots of its frames that wait
+        # for an offloaded frame before them
+        this._waiting = {}
+        # set once something that is not bencode was received
+        this._corrupt = False
 
 
     def register_cb(this, cb):
@@ -21,48 +155,274 @@ class AsyncBCodeDeserialiser:
     def push_data(this, strData):
         '''Use this method to add more data to the internal buffer. When the buffer
         has enough data in it to deserialize into a complete python data structure
-        then the callback will be invoked with that data'''
-        this._buffer = this._buffer + strData
-        this._perform_data_stitching()
+        then the callback will be invoked with that data. raises DecodeError
+        when the data is not bencode, after which everything is ignored'''
+        if len(strData) == 0 or this._corrupt:
+            return
+        if not this._spool is None:
+            this._spool.write(strData)
+            if this._spool.size >= this._spoolNeeded:
+                this._resume_spooled()
+            return
+        this._chunks.append(strData)
+        this._size += len(strData)
+        if this._size >= this._needed:
+            this._perform_data_stitching()
 
 
     def _perform_data_stitching(this):
-        while len(this._buffer) > 0:
+        # the walk of a frame carries on from where it stopped last time,
+        # so a frame of many small tokens that comes in many chunks is
+        # walked, and copied, a bounded number of times instead of once
+        # for every chunk
+        buffer = this._chunks[0] if len(this._chunks) == 1 else ''.join(this._chunks)
+        pos = 0
+        this._needed = 1
+        spooling = None
+        try:
+            while pos < len(buffer):
+                try:
+                    end, tokens = _walk(buffer, pos, this._depth, this._tokens,
+                        this._marks, this._walkedSize - pos)
+                except ValueError, e:
+                    this._corrupted(e)
+                this._depth = 0
+                this._tokens = 0
+                if this._walked:
+                    this._walked.append(buffer[pos:end])
+                    frame = ''.join(this._walked)
+                    this._walked = []
+                    this._walkedSize = 0
+                else:
+                    frame = buffer[pos:end]
+                marks = this._marks
+                if this._lazy:
+                    this._marks = []
+                # consumed before the callbacks run, so that a callback
+                # raising does not get the same frame delivered again
+                pos = end
+                # decoding costs the number of tokens, a frame that is large
+                # because of a long string is decoded quickly enough inline
+                if not this._offload is None and tokens >= this._offload.threshold:
+                    this._decode_offloaded(frame)
+                    continue
+                try:
+                    value = bcode.lazy_bdecode(frame, marks) if this._lazy else bcode.bdecode(frame)
+                except ValueError, e:
+                    # the frame ends where the walk said, the next one is fine
+                    logger.error('dropping a frame of {0} bytes that is not bencode: {1}'.format(len(frame), e))
+                    continue
+                this._deliver(value)
+        except _Incomplete, e:
+            if this._spools(buffer, e.resume, e.needed):
+                spooling = e
+            else:
+                if e.resume > pos:
+                    this._walked.append(buffer[pos:e.resume])
+                    this._walkedSize += e.resume - pos
+                pos = e.resume
+                this._depth = e.depth
+                this._tokens = e.tokens
+                this._needed = e.needed - pos
+        finally:
+            if this._corrupt:
+                this._drop_buffered()
+            else:
+                rest = buffer[pos:] if pos > 0 and spooling is None else buffer
+                this._chunks = [rest] if len(rest) > 0 and spooling is None else []
+                this._size = len(this._chunks[0]) if this._chunks else 0
+
+        if not spooling is None:
+            this._start_spool(buffer, pos, spooling)
+
+
+    def _corrupted(this, e):
+        '''gives up on the data received, which is not bencode'''
+
+        logger.error('the data received is not bencode, dropping it and all that comes after it: {0}'.format(e))
+        this._corrupt = True
+        raise DecodeError(str(e))
+
+
+    def _drop_buffered(this):
+        this._chunks = []
+        this._size = 0
+        this._needed = 1
+        this._walked = []
+        this._walkedSize = 0
+        this._depth = 0
+        this._tokens = 0
+        if this._lazy:
+            this._marks = []
+        if not this._spool is None:
+            this._spool.close()
+            this._spool = None
+        this._spans = []
+
+
+    def _spools(this, data, token, needed):
+        '''whether the token at token in data, which ends at needed, is a string
+        long enough for its frame to be spooled'''
+
+        spoolSize = getattr(this._offload, 'spoolSize', None)
+        if spoolSize is None:
+            return False
+        return needed - token >= spoolSize and data[token].isdigit()
+
+
+    def _skip_spooled(this, data, base, e):
+        '''records the long string that e stopped at in data, which starts at
+        base in the spool, and carries on from after it'''
+
+        colon = data.index(':', e.resume)
+        this._spans.append((base + e.resume, base + colon + 1, e.needed - colon - 1))
+        this._walkFrom = this._spoolNeeded = base + e.needed
+        this._depth = e.depth
+        this._tokens = e.tokens + 1
+
+
+    def _start_spool(this, buffer, pos, e):
+        '''writes the current frame, up to the end of buffer, to a spool.
+        what comes in next is written to it as well until the frame is
+        complete, without being walked while the long string comes in'''
+
+        from offload import Spool
+
+        logger.debug('spooling a frame with a string of {0} bytes'.format(e.needed - e.resume))
+        spool = Spool()
+        for part in this._walked:
+            spool.write(part)
+        spool.write(buffer[pos:] if pos > 0 else buffer)
+        this._spool = spool
+        this._spans = []
+        this._skip_spooled(buffer, this._walkedSize - pos, e)
+        this._walked = []
+        this._walkedSize = 0
+        if this._lazy:
+            this._marks = []
+        if spool.size >= this._spoolNeeded:
+            this._resume_spooled()
+
+
+    def _resume_spooled(this):
+        '''walks what came in after the long strings of the spooled frame,
+        delivers the frame once it is complete and carries on with what
+        came after it'''
+
+        spool = this._spool
+        while True:
+            if this._depth == 0:
+                # the frame was the long string
+                end = this._walkFrom
+                rest = spool.read(end, spool.size - end)
+                break
+            tail = spool.read(this._walkFrom, spool.size - this._walkFrom)
             try:
-                temp = bcode.bdecode(this._buffer)
-            except ValueError:
-                temp = None
+                end, tokens = _walk(tail, 0, this._depth, this._tokens)
+                rest = tail[end:]
+                end += this._walkFrom
+                break
+            except ValueError, e:
+                this._drop_buffered()
+                this._corrupted(e)
+            except _Incomplete, e:
+                if this._spools(tail, e.resume, e.needed):
+                    this._skip_spooled(tail, this._walkFrom, e)
+                else:
+                    this._spoolNeeded = this._walkFrom + e.needed
+                    this._walkFrom += e.resume
+                    this._depth = e.depth
+                    this._tokens = e.tokens
+                if spool.size < this._spoolNeeded:
+                    return
+
+        this._spool = None
+        this._depth = 0
+        this._tokens = 0
+        try:
+            value = this._decode_spooled(spool, end)
+        except ValueError, e:
+            logger.error('dropping a spooled frame of {0} bytes that is not bencode: {1}'.format(end, e))
+            value = None
+        finally:
+            spool.close()
+        if not value is None:
+            this._deliver(value)
+        this.push_data(rest)
+
+
+    def _decode_spooled(this, spool, length):
+        '''decodes the first length bytes of spool. the rest of the frame is
+        read back and decoded with the long strings left out, and then they
+        are read back, each in one read, into where they go'''
+
+        parts = []
+        strings = {}
+        pos = 0
+        for i, (token, start, size) in enumerate(this._spans):
+            parts.append(spool.read(pos, token - pos))
+            # stands in for the string until it is read
+            placeholder = '\x00pyjurer-spooled-{0}-{1}'.format(id(spool), i)
+            parts.append('{0}:{1}'.format(len(placeholder), placeholder))
+            strings[placeholder] = (start, size)
+            pos = start + size
+        parts.append(spool.read(pos, length - pos))
+        this._spans = []
 
-            if temp == None:
-                return
-            temp_len = len(bcode.bencode(temp))
-            this._buffer = this._buffer[temp_len:]
-            map(lambda f: f(temp), this._cb)
+        def fill(value):
+            if isinstance(value, str):
+                span = strings.get(value)
+                return value if span is None else spool.read(*span)
+            elif isinstance(value, dict):
+                for k, v in value.iteritems():
+                    if isinstance(v, (str, dict, list)):
+                        value[k] = fill(v)
+            elif isinstance(value, list):
+                for i, v in enumerate(value):
+                    if isinstance(v, (str, dict, list)):
+                        value[i] = fill(v)
+            return value
 
-class AsyncBCodeDeserialiserTest(unittest.TestCase):
+        return fill(bcode.bdecode(''.join(parts)))
 
 
-    def setUp(self):        
-        self.received_data = []
-        self.ds = AsyncBCodeDeserialiser()
-        self.ds.register_cb(self.data_received)
+    def _deliver(this, data):
+        if this._offload is None:
+            map(lambda f: f(data), this._cb)
+            return
 
+        with this._lock:
+            slots = this._waiting.get(data.get('id')) if isinstance(data, dict) else None
+            if slots is None:
+                map(lambda f: f(data), this._cb)
+            else:
+                slots.append([True, data])
 
-    def test_pushing_fragments(self):
-        self.ds.push_data('4:ao')
-        self.ds.push_data('oe')
-        self.ds.push_data('5:3.uoe')
-        self.ds.push_data('l4:aoeu3')
-        self.ds.push_data(':oeue')
 
-        self.assertEqual(['aooe', '3.uoe', ['aoeu', 'oeu']], self.received_data)
-        
+    def _decode_offloaded(this, frame):
+        id_ = frame_field(frame, 'id')
+        slot = [False, None]
+        with this._lock:
+            this._waiting.setdefault(id_, []).append(slot)
+        logger.debug('offloading a frame of {0} bytes for {1}'.format(len(frame), id_))
+        this._offload.decode(frame, lambda data: this._offloaded(id_, slot, data))
 
-    def data_received(self, d):
-        self.received_data.append(d)
 
-if __name__ == '__main__':
-    
-    
-    unittest.main()
+    def _offloaded(this, id_, slot, data):
+        '''called by the offload decoder, delivers the frames of id_ that are
+        decoded, in the order they were received, up to the next one that is not'''
 
+        with this._lock:
+            slot[0] = True
+            slot[1] = data
+            slots = this._waiting[id_]
+            while slots and slots[0][0]:
+                decoded, value = slots.pop(0)
+                if value is None:
+                    continue
+                try:
+                    map(lambda f: f(value), this._cb)
+                except Exception:
+                    logger.exception('a callback failed for an offloaded frame of {0}'.format(id_))
+            if not slots:
+                del this._waiting[id_]
@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
 
 from warnings import warn
+import mmap
 
 # ---------------
 #    ENCODING
 # ---------------
 
 def _encode_dictionary(input):
+    # keys are written in sorted order, as the bencode spec asks, so every
+    # dict has exactly one encoding
     result = str()
-    for key, value in input.iteritems():
+    for key, value in sorted(input.iteritems()):
         result += bencode(key)+bencode(value)
     return 'd%se' % result
 
@@ -31,93 +34,220 @@ def _encode_string(input):
 #    DECODING
 # ---------------
 
-def _decode_dict(input):
-    result = dict()
-    remainder = input[1:]
-    while remainder[0] != 'e':
-        r = _decode_string(remainder)
-        key = r[0]
-        remainder = r[1]
-        
-        if remainder[0] == 'i':
-            r = _decode_integer(remainder)
-            value = r[0]
-            result[key] = value
-            remainder = r[1]
-        
-        elif remainder[0].isdigit():
-            r = _decode_string(remainder)
-            value = r[0]
-            result[key] = value
-            remainder = r[1]
-        
-        elif remainder[0] == 'l':
-            r = _decode_list(remainder)
-            value = r[0]
-            result[key] = value
-            remainder = r[1]
-        
-        elif remainder[0] == 'd':
-            r = _decode_dict(remainder)
-            value = r[0]
-            result[key] = value
-            remainder = r[1]
-        
-        else:
-            raise ValueError("Invalid initial delimiter '%r' found while decoding a dictionary" % ramainder[0])
-    
-    return (result,remainder[1:])
+# every decoder takes the input and the offset the value starts at, and
+# returns the value and the offset just past it. walking offsets instead of
+# slicing off the remainder after every token keeps decoding linear in the
+# size of the input
 
-def _decode_integer(input):
-    end = input.find('e')
-    if end>-1:
-        return (int(input[1:end]),input[end+1:])
-        end += 1
+def _decode_value(input, pos):
+    c = input[pos]
+    if c == 'i':
+        return _decode_integer(input, pos)
+    elif c.isdigit():
+        return _decode_string(input, pos)
+    elif c == 'l':
+        return _decode_list(input, pos)
+    elif c == 'd':
+        return _decode_dict(input, pos)
     else:
+        raise ValueError("Invalid initial delimiter %r at offset %d" % (c, pos))
+
+def _decode_dict(input, pos):
+    result = dict()
+    pos += 1
+    while input[pos] != 'e':
+        key, pos = _decode_string(input, pos)
+        result[key], pos = _decode_value(input, pos)
+    return (result, pos + 1)
+
+def _decode_integer(input, pos):
+    end = input.find('e', pos)
+    if end == -1:
         raise ValueError("Missing ending delimiter 'e'")
+    return (int(input[pos + 1:end]), end + 1)
 
-def _decode_list(input):
+def _decode_list(input, pos):
     result = list()
-    remainder = input[1:]
+    pos += 1
+    while input[pos] != 'e':
+        value, pos = _decode_value(input, pos)
+        result.append(value)
+    return (result, pos + 1)
+
+def _decode_string(input, pos):
+    colon = input.find(':', pos)
+    size = int(input[pos:colon])
+    start = colon + 1
+    end = start + size
+    if end > len(input):
+        raise ValueError("String does not have enough characters. Expecting %d but only got %d" % (size, len(input) - start))
+    return (input[start:end], end)
+
+
+
+# ---------------
+#  LAZY DECODING
+# ---------------
+
+# strings shorter than this are decoded while a dictionary is indexed, a
+# placeholder would cost more than the string itself
+LAZY_MIN_SIZE = 256
+
+def _skip_value(input, pos):
+    # returns the offset just past the list or dictionary at pos, walking
+    # only its structure, the contents of strings are skipped over
+    depth = 0
     while True:
-        if remainder[0] == 'i':
-            r = _decode_integer(remainder)
-            result.append(r[0])
-            remainder = r[1]
-        
-        elif remainder[0].isdigit():
-            r = _decode_string(remainder)
-            result.append(r[0])
-            remainder = r[1]
-        
-        elif remainder[0] == 'l':
-            r = _decode_list(remainder)
-            result.append(r[0])
-            remainder = r[1]
-        
-        elif remainder[0] == 'd':
-            r = _decode_dict(remainder)
-            result.append(r[0])
-            remainder = r[1]
-        
-        elif remainder[0] == 'e':
-            remainder = remainder[1:]
-            break
-        
+        c = input[pos]
+        if c == 'd' or c == 'l':
+            depth += 1
+            pos += 1
+            continue
+        elif c == 'e':
+            depth -= 1
+            pos += 1
+        elif c == 'i':
+            pos = input.index('e', pos) + 1
         else:
-            raise ValueError("Invalid initial delimiter '%r' found while decoding a list" % remainder[0])
-    
-    return (result,remainder)
+            colon = input.index(':', pos)
+            pos = colon + 1 + int(input[pos:colon])
+        if depth == 0:
+            return pos
+
+class _Undecoded(object):
+    # where the value of a key of a LazyDict starts in the input
+    __slots__ = ('input', 'pos')
+
+    def __init__(self, input, pos):
+        self.input = input
+        self.pos = pos
+
+class LazyDict(dict):
+    '''a decoded bencode dictionary whose dictionaries, lists and long
+    strings are only decoded when they are looked up. every key is there
+    from the start, so testing for a key or iterating over the keys does
+    not decode anything. a dictionary value is a LazyDict as well.
+
+    the values that are not decoded yet keep the whole input alive.
+
+    a LazyDict stays inside the dispatch of the responses: a session looks
+    up the fields its callbacks want and hands them a dictionary value as
+    plain(value). dict(lazy), other.update(lazy) and f(**lazy) would read
+    the storage of the dict directly and come out with the placeholders of
+    the values that are not decoded yet'''
+
+    def _decoded(self, key, value):
+        if type(value) is _Undecoded:
+            value = _decode_lazy(value.input, value.pos)[0]
+            dict.__setitem__(self, key, value)
+        return value
+
+    def decode_all(self):
+        '''decodes every value of this dictionary, not of the ones in it'''
+        for key, value in dict.items(self):
+            self._decoded(key, value)
+        return self
+
+    def __getitem__(self, key):
+        return self._decoded(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        return self._decoded(key, dict.get(self, key, default))
+
+    def pop(self, key, *default):
+        # decoded without being written back, the key is gone
+        return _decode_placeholder(dict.pop(self, key, *default))
+
+    def setdefault(self, key, default=None):
+        return self._decoded(key, dict.setdefault(self, key, default))
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        return (key, _decode_placeholder(value))
+
+    def items(self):
+        return dict.items(self.decode_all())
+
+    def iteritems(self):
+        return dict.iteritems(self.decode_all())
+
+    def values(self):
+        return dict.values(self.decode_all())
 
-def _decode_string(input):
-    start = input.find(':')+1
-    size = int(input[:start-1])
-    end = start+size
-    if end-start > len(input[start:]):
-        raise ValueError("String does not have enough characters. Expecting % but only got %" % len(input[start:]), size)
-    return (input[start:end], input[end:])
+    def itervalues(self):
+        return dict.itervalues(self.decode_all())
 
+    def copy(self):
+        # not dict(self), which would copy the placeholders, see the class
+        return dict(self.decode_all())
 
+    def __eq__(self, other):
+        return dict.__eq__(self.decode_all(), other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return dict.__repr__(self.decode_all())
+
+def _decode_placeholder(value):
+    # value, decoded when it is a placeholder
+    if type(value) is _Undecoded:
+        return _decode_lazy(value.input, value.pos)[0]
+    return value
+
+def plain(value):
+    '''value with every LazyDict in it, at any depth, turned into a dict
+    with all of its values decoded. anything else is returned as it is'''
+
+    if type(value) is not LazyDict:
+        return value
+    return dict((k, plain(v)) for k, v in value.iteritems())
+
+def _decode_lazy(input, pos):
+    if input[pos] == 'd':
+        return _index_dict(input, pos)
+    return _decode_value(input, pos)
+
+def _lazy_value(input, pos, end):
+    # the value at pos, which ends at end, or a placeholder for it
+    c = input[pos]
+    if c == 'i' or (c.isdigit() and end - pos < LAZY_MIN_SIZE):
+        return _decode_value(input, pos)[0]
+    return _Undecoded(input, pos)
+
+def _index_dict(input, pos):
+    result = LazyDict()
+    pos += 1
+    while input[pos] != 'e':
+        key, pos = _decode_string(input, pos)
+        c = input[pos]
+        if c == 'i':
+            end = input.index('e', pos) + 1
+        elif c.isdigit():
+            colon = input.index(':', pos)
+            end = colon + 1 + int(input[pos:colon])
+            if end > len(input):
+                raise ValueError("String does not have enough characters. Expecting %d but only got %d" % (end - colon - 1, len(input) - colon - 1))
+        elif c == 'd' or c == 'l':
+            end = _skip_value(input, pos)
+        else:
+            raise ValueError("Invalid initial delimiter %r at offset %d" % (c, pos))
+        dict.__setitem__(result, key, _lazy_value(input, pos, end))
+        pos = end
+    return (result, pos + 1)
+
+def _index_dict_marked(input, marks):
+    # like _index_dict for the dictionary that is all of input, given the
+    # offsets just past each of its keys and values, so nothing is walked
+    result = LazyDict()
+    pos = 1
+    for k in range(0, len(marks), 2):
+        key = _decode_string(input, pos)[0]
+        end = marks[k + 1]
+        dict.__setitem__(result, key, _lazy_value(input, marks[k], end))
+        pos = end
+    return result
 
 # -------------
 #    PUBLIC
@@ -133,7 +263,9 @@ def bencode(input):
     itype = type(input)
     
     if itype == type(str()) or itype == type(unicode()):
-        return _encode_string(input.encode('utf8'))
+        # a str is bytes already, encoding it again would decode it as
+        # ascii first and fail on utf-8 text, like a chunk of stdin
+        return _encode_string(input)
     
     elif itype == type(float()):
         return _encode_string(str(input))
@@ -159,17 +291,68 @@ def bdecode(input):
     '''
     
     input = input.strip()
-    
-    if input[0] == 'i':
-        return _decode_integer(input)[0]
-    
-    elif input[0].isdigit():
-        return _decode_string(input)[0]
-    
-    elif input[0] == 'l':
-        return _decode_list(input)[0]
+    return _decode_value(input, 0)[0]
+
+
+def lazy_bdecode(input, marks=None):
+    '''Decode strings from bencode format like bdecode, but return
+    dictionaries as LazyDicts, which decode their values on first use.
 
-    elif input[0] == 'd':
-        return _decode_dict(input)[0]
+    Keyword arguments:
+    input -- the input string to be decoded
+    marks -- optional offsets just past every key and value at the top
+    level of input, when it is a dictionary, as collected by the walk of
+    the asynchronous deserialiser. the top level is then not walked again
+    '''
+
+    if not marks is None and input[:1] == 'd':
+        return _index_dict_marked(input, marks)
+    input = input.strip()
+    return _decode_lazy(input, 0)[0]
+
+
+def _encode_parts(input, parts):
+    if isinstance(input, mmap.mmap):
+        parts.append('%d:' % len(input))
+        parts.append(input)
+    elif type(input) == type(dict()):
+        parts.append('d')
+        for key, value in sorted(input.iteritems()):
+            parts.append(bencode(key))
+            _encode_parts(value, parts)
+        parts.append('e')
+    elif type(input) in (type(list()), type(tuple())):
+        parts.append('l')
+        for each in input:
+            _encode_parts(each, parts)
+        parts.append('e')
     else:
-        raise ValueError("Invalid initial delimiter '%s'" % input[0])
+        parts.append(bencode(input))
+
+def bencode_parts(input):
+    '''Encode python types to bencode format like bencode, but leave the
+    contents of memory-mapped files where they are. Returns a list of the
+    encoded strings and the mmap objects, in order, which joined together
+    are what bencode would have returned.
+
+    Keyword arguments:
+    input -- the input value to be encoded
+    '''
+
+    parts = []
+    _encode_parts(input, parts)
+
+    # join the runs of encoded strings, so there are as few parts as possible
+    result = []
+    run = []
+    for part in parts:
+        if isinstance(part, str):
+            run.append(part)
+        else:
+            if run:
+                result.append(''.join(run))
+                run = []
+            result.append(part)
+    if run:
+        result.append(''.join(run))
+    return result
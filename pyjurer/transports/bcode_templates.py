@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+
+'''pre-encoded templates for the nrepl requests a session sends over and
+over. the op and the session of a request are the same every time, and so
+are the names of its fields, so all of that is encoded once per session,
+op and set of fields and only the values that change, like 'id' and
+'code', are encoded per request. the result is exactly what bcode.bencode
+returns for the same request'''
+
+import bcode, mmap
+
+# the fields whose values are part of a template, the other values are
+# encoded on every request
+STATIC_FIELDS = ('op', 'session')
+
+class _Template(object):
+	'''the encoding of one kind of request: literals holds the encoded text
+	before every variable field and after the last one, fields the names of
+	the variable fields in the order they are encoded in'''
+
+	__slots__ = ('literals', 'fields')
+
+	def __init__(self, data):
+		self.literals = []
+		self.fields = []
+
+		literal = ['d']
+		for key in sorted(data):
+			literal.append(bcode.bencode(key))
+			if key in STATIC_FIELDS:
+				literal.append(bcode.bencode(data[key]))
+			else:
+				self.literals.append(''.join(literal))
+				self.fields.append(key)
+				literal = []
+		literal.append('e')
+		self.literals.append(''.join(literal))
+
+	def encode(self, data):
+		'''returns the encoded request, or None if a value needs bencode_parts'''
+
+		literals = self.literals
+		out = []
+		for i, key in enumerate(self.fields):
+			out.append(literals[i])
+			value = data[key]
+			if type(value) is str:
+				# the bytes as they are, like bcode.bencode
+				out.append('%d:%s' % (len(value), value))
+			elif type(value) is mmap.mmap:
+				return None
+			else:
+				out.append(bcode.bencode(value))
+		out.append(literals[-1])
+		return ''.join(out)
+
+class RequestTemplates(object):
+	'''encodes requests through a cache of templates'''
+
+	# sessions come and go, so the cache is started over when it gets this big
+	MAX_TEMPLATES = 1024
+
+	def __init__(self):
+		self._templates = {}
+
+	def encode(self, data):
+		'''returns the request in data encoded as a string or, when one of its
+		values is a memory-mapped file, as a list of parts, see bcode.bencode_parts'''
+
+		if not 'op' in data:
+			return bcode.bencode(data)
+
+		# requests built by the same code have their fields in the same
+		# order, so this identifies the template without sorting anything
+		key = (data['op'], data.get('session')) + tuple(data)
+		template = self._templates.get(key)
+		if template is None:
+			if len(self._templates) >= self.MAX_TEMPLATES:
+				self._templates.clear()
+			template = self._templates[key] = _Template(data)
+
+		encoded = template.encode(data)
+		if encoded is None:
+			return bcode.bencode_parts(data)
+		return encoded
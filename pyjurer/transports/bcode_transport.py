@@ -4,27 +4,39 @@
 '''implements an NREPL transport using beencoding'''
 
 from async_bcode_deserialiser import AsyncBCodeDeserialiser
+from bcode_templates import RequestTemplates
+from offload import OffloadDecoder
 from transport import Transport
 
-import bcode, unittest, logging
+import bcode, logging
 
 class BCodeTransport(Transport):
 	'''implements beencoding and bedecoding over channels that may
 	send partial section of each data structure'''
 
-	def __init__(self, sendBytes, receivedDataCb=None):
+	def __init__(self, sendBytes, receivedDataCb=None, offloadThreshold=None, lazy=False):
 		'''initialises the transport
 
 		sendBytes => method of one param, taking a byte[] which is used to send bytes
-		receivedDataCb => method of one param, taking any python data when data is received'''
+		receivedDataCb => method of one param, taking any python data when data is received
+		offloadThreshold => optional number of tokens from which frames are decoded
+		in a worker process, see offload. the callbacks for those frames are called
+		from another thread than the channel's
+		lazy => hand the callbacks bcode.LazyDicts, whose values are only decoded
+		when they are looked up. fields no callback reads are never decoded'''
 
 		self._callbacks = []
 		if receivedDataCb != None:
 			self._callbacks.append(receivedDataCb)
 
-		self._bcode = AsyncBCodeDeserialiser()
+		self._offload = None
+		if not offloadThreshold is None:
+			self._offload = OffloadDecoder(offloadThreshold)
+
+		self._bcode = AsyncBCodeDeserialiser(self._offload, lazy)
 		self._bcode.register_cb(self.receive_internal)
 		self._sender = sendBytes
+		self._templates = RequestTemplates()
 
 	def receive_internal(self, data):
 		map(lambda f: f(data), self._callbacks)
@@ -33,9 +45,16 @@ class BCodeTransport(Transport):
 		self._callbacks.append(receivedDataCb)
 
 	def send(self, data):
-		'''sends the data encoded'''
+		'''sends the data encoded. nrepl requests are encoded through cached
+		templates of their fixed fields, see bcode_templates. when any of the
+		values in the data map is a memory-mapped file, the channel is sent a
+		list of parts instead of a string, with the mmap between the parts
+		encoded around it, so the file's contents are never copied into the frame'''
 
-		self._sender(bcode.bencode(data))
+		if isinstance(data, dict):
+			self._sender(self._templates.encode(data))
+		else:
+			self._sender(bcode.bencode(data))
 
 	def receive(self, raw):
 		'''accepts raw data and determines when to invoke the callback when
@@ -45,54 +64,8 @@ class BCodeTransport(Transport):
 
 		self._bcode.push_data(raw)
 
-class BCodeTransportUnitTests(unittest.TestCase):
-	def test_sends(self):
-		logger = logging.getLogger("{0}:BcodeTransportUnitTest:test_sends".format(__name__))
-
-		def sendBytes(bs):
-			logger.debug("sendBytes: {0}".format(bs))
-			sendBytes.received.append(bs)
-		sendBytes.received = []
-
-		def receivedData(data):
-			receivedData.data.append(data)
-		receivedData.data = []
-
-		t = BCodeTransport(sendBytes, receivedData)
-		t.send(4)
-		t.send(['1','2','3','4'])
-
-		self.assertEquals(0, len(receivedData.data))
-		self.assertEquals(bcode.bencode(4), sendBytes.received[0])
-		self.assertEquals(bcode.bencode(['1','2','3','4']), sendBytes.received[1])
-
-	def test_receives(self):
-		logger = logging.getLogger("{0}:BcodeTransportUnitTest:test_receives".format(__name__))
-
-		def sendBytes(bs):
-			logger.debug("sendBytes: {0}".format(bs))
-			sendBytes.received.append(bs)
-		sendBytes.received = []
-
-		def receivedData(data):
-			receivedData.data.append(data)
-		receivedData.data = []
-
-		t = BCodeTransport(sendBytes, receivedData)
-		t.receive('12:aoeuaoeuaoeu')
-		t.receive('12:aoeua')
-		t.receive('oeuaoeu')
-
-		self.assertEquals(0, len(sendBytes.received))
-
-		self.assertEquals(2, len(receivedData.data))
-		self.assertEquals('aoeuaoeuaoeu', receivedData.data[0])
-		self.assertEquals('aoeuaoeuaoeu', receivedData.data[1])
-
-
-if __name__ == '__main__':
-	logging.basicConfig(level=logging.DEBUG)
-	unittest.main()
-
-
+	def close(self):
+		'''stops the worker process that decodes large frames, if there is one'''
 
+		if not self._offload is None:
+			self._offload.close()
@@ -0,0 +1,234 @@
+#! /usr/bin/env python
+
+'''decodes very large bencoded frames in a worker process. decoding a frame
+of millions of tokens, like the describe of a nrepl with a lot of middleware
+or a large printed collection, takes the callback thread seconds of cpu that
+every other thread in the process competes with. a worker process decodes
+the frame from a temporary file, in shared memory where there is one, and
+writes the result back to it pickled in pieces, which are a lot cheaper to
+load than the frame is to decode. loading a large value with one
+cPickle.loads would hold the GIL for as long as that takes, reading and
+loading it one small piece at a time lets the other threads run in between.
+
+what is left is the cyclic garbage collector: a full collection walks every
+container in the process, and so every dict and list of a value this large,
+with the GIL held, on whichever thread happens to trigger it. that costs the
+same however the value was decoded, see bench/bench_offload.py'''
+
+import cPickle, logging, os, tempfile, threading
+
+import bcode
+
+logger = logging.getLogger(__name__)
+
+# frames of this many tokens or more are decoded in the worker process. the
+# time bdecode takes is proportional to the tokens in a frame, a frame that
+# is large because of one long string is decoded in no time
+OFFLOAD_THRESHOLD = 100000
+
+# the most values and containers loaded with one cPickle.loads
+PIECE_SIZE = 2000
+
+# strings of this many bytes or more, like the value of a large printed
+# string, are spooled to a file as their frame comes in and read back from
+# it with the GIL let go of. joined and sliced out of the frame in memory
+# they would be copied twice with it held
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# tmpfs on linux, so the frame never goes near a disk
+_FRAME_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+def _weigh(value):
+	'''the number of values and containers in value'''
+
+	if isinstance(value, dict):
+		return 1 + sum(_weigh(v) for v in value.itervalues()) + len(value)
+	elif isinstance(value, list):
+		return 1 + sum(_weigh(v) for v in value)
+	return 1
+
+def _split(value, weight, store):
+	'''runs in the worker: returns value as a tree of pickled pieces of at
+	most PIECE_SIZE values each, which store is called with, in order, and
+	returns a reference to. a piece is ('value', reference). a larger dict
+	or list is ('dict', parts) or ('list', parts), where each part is either
+	('items', reference to a pickled dict or list of small items) or
+	('item', key or None, piece)'''
+
+	if weight <= PIECE_SIZE or not isinstance(value, (dict, list)):
+		return ('value', store(cPickle.dumps(value, 2)))
+
+	isDict = isinstance(value, dict)
+	parts = []
+	small = {} if isDict else []
+	smallWeight = 0
+	for key, item in (value.iteritems() if isDict else enumerate(value)):
+		w = _weigh(item)
+		if w > PIECE_SIZE // 2:
+			if small:
+				parts.append(('items', store(cPickle.dumps(small, 2))))
+				small = {} if isDict else []
+				smallWeight = 0
+			parts.append(('item', key if isDict else None, _split(item, w, store)))
+			continue
+		if isDict:
+			small[key] = item
+		else:
+			small.append(item)
+		smallWeight += w
+		if smallWeight >= PIECE_SIZE:
+			parts.append(('items', store(cPickle.dumps(small, 2))))
+			small = {} if isDict else []
+			smallWeight = 0
+	if small:
+		parts.append(('items', store(cPickle.dumps(small, 2))))
+	return ('dict' if isDict else 'list', parts)
+
+def _join(piece, load):
+	'''loads what _split made, one small piece at a time, load is called
+	with the references in the order store returned them'''
+
+	kind = piece[0]
+	if kind == 'value':
+		return cPickle.loads(load(piece[1]))
+
+	result = {} if kind == 'dict' else []
+	for part in piece[1]:
+		if part[0] == 'items':
+			if kind == 'dict':
+				result.update(cPickle.loads(load(part[1])))
+			else:
+				result.extend(cPickle.loads(load(part[1])))
+		elif kind == 'dict':
+			result[part[1]] = _join(part[2], load)
+		else:
+			result.append(_join(part[2], load))
+	return result
+
+def _decode_file(path):
+	'''runs in the worker: decodes the frame in the file at path and writes
+	the pieces of its value, see _split, to the file instead. returns (True,
+	the tree of the pieces, by their length) or (False, the reason it
+	failed), since the pool of python 2 has no way to report exceptions to
+	a callback'''
+
+	try:
+		with open(path, 'rb') as f:
+			data = f.read()
+		value = bcode.bdecode(data)
+		del data
+		with open(path, 'wb') as f:
+			def store(pickled):
+				f.write(pickled)
+				return len(pickled)
+			return (True, _split(value, _weigh(value), store))
+	except Exception, e:
+		return (False, '{0}: {1}'.format(type(e).__name__, e))
+
+class Spool(object):
+	'''a frame written to a temporary file as it comes in, see SPOOL_SIZE. the
+	file's reads and writes let go of the GIL while they copy'''
+
+	def __init__(self):
+		fd, path = tempfile.mkstemp(prefix='pyjurer-spool-', dir=_FRAME_DIRECTORY)
+		# the file is there for as long as it is open
+		os.unlink(path)
+		self._file = os.fdopen(fd, 'w+b')
+		self.size = 0
+
+	def write(self, data):
+		self._file.seek(self.size)
+		self._file.write(data)
+		self.size += len(data)
+
+	def read(self, offset, length):
+		self._file.seek(offset)
+		return self._file.read(length)
+
+	def close(self):
+		self._file.close()
+
+def _decode_inline(frame):
+	'''decodes frame on this thread, returns None when it is not bencode'''
+
+	try:
+		return bcode.bdecode(frame)
+	except Exception, e:
+		logger.error('unable to decode a frame of {0} bytes: {1}: {2}'.format(
+			len(frame), type(e).__name__, e))
+		return None
+
+class OffloadDecoder(object):
+	'''decodes frames in a pool of worker processes'''
+
+	def __init__(self, threshold=OFFLOAD_THRESHOLD, processes=1, spoolSize=SPOOL_SIZE):
+		'''threshold => the number of tokens from which frames should be offloaded
+		processes => the number of worker processes
+		spoolSize => the size of the strings from which their frames are spooled,
+		None for never'''
+
+		self.threshold = threshold
+		self.spoolSize = spoolSize
+		self._processes = processes
+		self._lock = threading.Lock()
+		# started on the first offloaded frame, most connections never see
+		# one. the workers are forked from the channel's thread then, and
+		# may inherit locks other threads hold, but all they ever do is
+		# decode and pickle, which takes none of them
+		self._pool = None
+		self._closed = False
+
+	def decode(self, frame, callback):
+		'''decodes frame in a worker and calls callback with the value. callback
+		is called on a thread of the pool's. a frame the worker fails on is
+		decoded on that thread instead, and callback is called with None
+		when it is not bencode at all'''
+
+		fd, path = tempfile.mkstemp(prefix='pyjurer-frame-', dir=_FRAME_DIRECTORY)
+		with os.fdopen(fd, 'wb') as f:
+			f.write(frame)
+
+		def decoded(result):
+			ok, tree = result
+			value = None
+			try:
+				if ok:
+					# the pieces are read one by one, the GIL is let go of for every read
+					with open(path, 'rb') as f:
+						value = _join(tree, f.read)
+			except Exception:
+				logger.exception('unable to load an offloaded frame of {0} bytes'.format(len(frame)))
+				ok = False
+			finally:
+				os.unlink(path)
+			if not ok:
+				logger.warn('decoding a frame of {0} bytes inline, the worker failed: {1}'.format(
+					len(frame), tree))
+				value = _decode_inline(frame)
+			try:
+				callback(value)
+			except Exception:
+				# raising here would stop the pool's result thread for good
+				logger.exception('the callback for an offloaded frame failed')
+
+		with self._lock:
+			if self._pool is None and not self._closed:
+				# imported here, most connections never see a frame this large
+				import multiprocessing
+				self._pool = multiprocessing.Pool(self._processes)
+			pool = self._pool
+		if pool is None:
+			os.unlink(path)
+			callback(_decode_inline(frame))
+			return
+		pool.apply_async(_decode_file, (path,), callback=decoded)
+
+	def close(self):
+		'''stops the worker processes, the frames decoded afterwards are
+		decoded inline'''
+
+		with self._lock:
+			self._closed = True
+			if not self._pool is None:
+				self._pool.terminate()
+				self._pool = None
@@ -0,0 +1,364 @@
+#! /usr/bin/env python
+'''a stand-in for a clojure nrepl that speaks bencode over tcp on localhost,
+over a unix domain socket or over in-process channels. it does not
+evaluate anything: it answers the session ops the way a nrepl would, with
+responses whose size, fragmentation and latency can be set, so the client
+can be measured and tested without a jvm.
+
+supported ops: clone, close, describe, eval, interrupt, load-file & stdin.
+
+evals answer with their code as the value, or with a string of value_size
+bytes when that is set. code containing 'read-line' asks for input first
+and answers with the line it was given, code containing 'slurp' reads all
+of stdin, up to an empty one, and answers with its size and md5 and code
+containing 'throw' fails with an eval-error'''
+
+import argparse, hashlib, logging, os, random, socket, sys, threading, time, uuid, Queue
+
+from pyjurer.channels import inproc
+from pyjurer.transports import bcode
+from pyjurer.transports.async_bcode_deserialiser import AsyncBCodeDeserialiser
+
+logger = logging.getLogger(__name__)
+
+OPS = ('clone', 'close', 'describe', 'eval', 'interrupt', 'load-file', 'stdin')
+
+class _ChannelSocket(object):
+	'''lets a _Connection write to and close an in-process channel'''
+
+	def __init__(self, channel):
+		self._channel = channel
+
+	def sendall(self, data):
+		self._channel.send(data)
+
+	def close(self):
+		self._channel.stop()
+
+class _Connection(object):
+	'''one client connection, read on a thread of its own, or fed by the
+	callbacks of an in-process channel'''
+
+	def __init__(self, server, isocket):
+		self._server = server
+		self._socket = isocket
+		self._writeLock = threading.Lock()
+		self._sessions = {}
+		self._closed = False
+
+		self._deserialiser = AsyncBCodeDeserialiser()
+		self._deserialiser.register_cb(self._handle)
+
+	def run(self):
+		try:
+			while True:
+				data = self._socket.recv(65536)
+				if len(data) == 0:
+					break
+				self._deserialiser.push_data(data)
+		except socket.error, e:
+			logger.debug('connection closed: {0}'.format(e))
+		finally:
+			self.close()
+
+	def receive(self, data):
+		'''called with what an in-process channel received'''
+		if len(data) == 0:
+			self.close()
+		else:
+			self._deserialiser.push_data(data)
+
+	def close(self):
+		self._closed = True
+		for session in self._sessions.values():
+			session.close()
+		try:
+			self._socket.close()
+		except socket.error:
+			pass
+
+	def write(self, message):
+		'''sends a response, split into fragments when the server is set up to'''
+
+		data = bcode.bencode(message)
+		fragment = self._server.fragment
+		with self._writeLock:
+			if self._closed:
+				return
+			try:
+				if fragment is None:
+					self._socket.sendall(data)
+				else:
+					for i in range(0, len(data), fragment):
+						self._socket.sendall(data[i:i + fragment])
+			except socket.error, e:
+				logger.debug('unable to write a response: {0}'.format(e))
+
+	def _handle(self, message):
+		op = message.get('op')
+		id_ = message.get('id')
+		sessionId = message.get('session')
+
+		if op == 'clone':
+			session = _Session(self)
+			self._sessions[session.id] = session
+			self.write({'id': id_, 'session': sessionId or str(uuid.uuid4()),
+				'new-session': session.id, 'status': ['done']})
+			return
+
+		if op == 'describe':
+			self.write({'id': id_, 'session': sessionId or '',
+				'ops': dict((o, {}) for o in OPS),
+				'versions': {'nrepl': {'version-string': 'standin'}},
+				'status': ['done']})
+			return
+
+		session = self._sessions.get(sessionId)
+		if session is None:
+			self.write({'id': id_, 'session': sessionId or '',
+				'status': ['error', 'unknown-session', 'done']})
+			return
+
+		if op == 'eval':
+			session.evals.put(message)
+		elif op == 'load-file':
+			# answers with the size of the file instead of its last value
+			self.write({'id': id_, 'session': sessionId, 'value': str(len(message.get('file', '')))})
+			self.write({'id': id_, 'session': sessionId, 'status': ['done']})
+		elif op == 'stdin':
+			session.stdin.put(message.get('stdin', ''))
+			self.write({'id': id_, 'session': sessionId, 'status': ['done']})
+		elif op == 'interrupt':
+			session.interrupt(message)
+		elif op == 'close':
+			self._sessions.pop(sessionId).close()
+			self.write({'id': id_, 'session': sessionId, 'status': ['session-closed', 'done']})
+		else:
+			self.write({'id': id_, 'session': sessionId, 'op': op or '',
+				'status': ['error', 'unknown-op', 'done']})
+
+class _Session(object):
+	'''evaluates the evals of one session in order, on a thread of its own'''
+
+	def __init__(self, connection):
+		self.id = str(uuid.uuid4())
+		self.evals = Queue.Queue()
+		self.stdin = Queue.Queue()
+		self._connection = connection
+		self._server = connection._server
+		self._running = None
+		self._interrupted = threading.Event()
+		self._lock = threading.Lock()
+
+		thread = threading.Thread(target=self._run)
+		thread.daemon = True
+		thread.start()
+
+	def close(self):
+		self.evals.put(None)
+		self._interrupted.set()
+
+	def interrupt(self, message):
+		with self._lock:
+			running = self._running
+			wanted = message.get('interrupt-id')
+			if running is None:
+				status = 'session-idle'
+			elif wanted is not None and wanted != running:
+				status = 'interrupt-id-mismatch'
+			else:
+				status = 'interrupted'
+				self._interrupted.set()
+		self._connection.write({'id': message['id'], 'session': self.id, 'status': [status, 'done']})
+
+	def _send(self, id_, **fields):
+		fields['id'] = id_
+		fields['session'] = self.id
+		self._connection.write(fields)
+
+	def _run(self):
+		while True:
+			message = self.evals.get()
+			if message is None:
+				return
+			with self._lock:
+				self._running = message['id']
+				self._interrupted.clear()
+			try:
+				self._eval(message)
+			finally:
+				with self._lock:
+					self._running = None
+
+	def _wait_for_stdin(self, id_):
+		self._send(id_, status=['need-input'])
+		while not self._interrupted.is_set():
+			try:
+				return self.stdin.get(True, 0.05)
+			except Queue.Empty:
+				pass
+		return None
+
+	def _slurp(self, id_):
+		'''reads stdin the way a reader of *in* would, asking for more only
+		once all that was sent is read'''
+
+		digest = hashlib.md5()
+		size = 0
+		while True:
+			try:
+				piece = self.stdin.get_nowait()
+			except Queue.Empty:
+				piece = self._wait_for_stdin(id_)
+				if piece is None:
+					return None
+			if len(piece) == 0:
+				return '[{0} "{1}"]'.format(size, digest.hexdigest())
+			digest.update(piece)
+			size += len(piece)
+
+	def _eval(self, message):
+		id_ = message['id']
+		code = message.get('code', '')
+		server = self._server
+
+		pause = server.latency
+		if server.stall_rate and random.random() < server.stall_rate:
+			pause += server.stall
+		if pause and self._interrupted.wait(pause):
+			self._send(id_, status=['interrupted', 'done'])
+			return
+
+		value = code
+		if 'read-line' in code:
+			line = self._wait_for_stdin(id_)
+			if line is None:
+				self._send(id_, status=['interrupted', 'done'])
+				return
+			value = '"{0}"'.format(line.rstrip('\n'))
+		elif 'slurp' in code:
+			value = self._slurp(id_)
+			if value is None:
+				self._send(id_, status=['interrupted', 'done'])
+				return
+
+		for i in range(server.out_chunks):
+			self._send(id_, out=server.out_text)
+
+		if 'throw' in code:
+			self._send(id_, err='Exception thrown by the stand-in\n')
+			self._send(id_, ex='class java.lang.Exception', status=['eval-error'])
+		else:
+			if not server.value_size is None:
+				value = server.value_text
+			self._send(id_, value=value, ns='user')
+		self._send(id_, status=['done'])
+
+class StandinNrepl(object):
+	'''listens on localhost and serves every connection on its own thread'''
+
+	def __init__(self, host='127.0.0.1', port=0, value_size=None, out_chunks=0,
+		out_size=16, latency=0.0, fragment=None, path=None, stall_rate=0.0, stall=0.0):
+		'''path => optional path of a unix domain socket to listen on instead of host:port
+		value_size => optional size in bytes of every eval's value
+		out_chunks, out_size => the number and size of the out messages every eval prints
+		latency => seconds every eval takes, during which it can be interrupted
+		stall_rate, stall => the share of evals that take stall seconds longer, like a gc pause
+		fragment => optional maximum size of each write on the socket'''
+
+		self.value_size = value_size
+		self.value_text = '"{0}"'.format('x' * max(0, (value_size or 0) - 2))
+		self.out_chunks = out_chunks
+		self.out_text = 'o' * (out_size - 1) + '\n' if out_size > 0 else ''
+		self.latency = latency
+		self.stall_rate = stall_rate
+		self.stall = stall
+		self.fragment = fragment
+
+		self._path = path
+		if path is None:
+			self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			self._listener.bind((host, port))
+		else:
+			self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			self._listener.bind(path)
+		self._listener.listen(128)
+		self._connections = []
+		self._thread = None
+		self._inprocNames = []
+
+	@property
+	def address(self):
+		'''the (host, port) the server listens on, or the path of its socket'''
+		return self._listener.getsockname()
+
+	def listen_inproc(self, name):
+		'''serves the in-process connections made to inproc://name as well'''
+
+		def accept(channel):
+			connection = _Connection(self, _ChannelSocket(channel))
+			channel.add_callback(connection.receive)
+			self._connections.append(connection)
+			channel.start()
+		inproc.listen(name, accept)
+		self._inprocNames.append(name)
+		return self
+
+	def start(self):
+		self._thread = threading.Thread(target=self._accept)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		try:
+			self._listener.shutdown(socket.SHUT_RDWR)
+		except socket.error:
+			pass
+		self._listener.close()
+		if not self._path is None and os.path.exists(self._path):
+			os.unlink(self._path)
+		for name in self._inprocNames:
+			inproc.unlisten(name)
+		for connection in list(self._connections):
+			connection.close()
+
+	def _accept(self):
+		while True:
+			try:
+				isocket, address = self._listener.accept()
+			except socket.error:
+				return
+			if self._path is None:
+				isocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			connection = _Connection(self, isocket)
+			self._connections.append(connection)
+			thread = threading.Thread(target=connection.run)
+			thread.daemon = True
+			thread.start()
+
+if __name__ == '__main__':
+	cliParser = argparse.ArgumentParser(description="A stand-in nrepl for testing and benchmarking the client")
+	cliParser.add_argument("-p", "--port", type=int, help="The port to listen on. Default = any free port", default=0)
+	cliParser.add_argument("-u", "--unix", help="The path of a unix domain socket to listen on instead", default=None)
+	cliParser.add_argument("--value-size", type=int, help="The size in bytes of every value. Default = echo the code", default=None)
+	cliParser.add_argument("--out-chunks", type=int, help="The number of out messages per eval. Default = 0", default=0)
+	cliParser.add_argument("--out-size", type=int, help="The size of each out message. Default = 16", default=16)
+	cliParser.add_argument("--latency", type=float, help="Seconds every eval takes. Default = 0", default=0.0)
+	cliParser.add_argument("--fragment", type=int, help="Maximum bytes per socket write. Default = unlimited", default=None)
+	cliParser.add_argument("--stall-rate", type=float, help="The share of evals that stall. Default = 0", default=0.0)
+	cliParser.add_argument("--stall", type=float, help="Seconds a stalled eval takes longer. Default = 0", default=0.0)
+	args = cliParser.parse_args()
+
+	server = StandinNrepl(port=args.port, value_size=args.value_size, out_chunks=args.out_chunks,
+		out_size=args.out_size, latency=args.latency, fragment=args.fragment, path=args.unix,
+		stall_rate=args.stall_rate, stall=args.stall).start()
+	# what started it, like bench_load, reads the address from stdout
+	sys.stdout.write('{0}\n'.format(server.address if args.unix else server.address[1]))
+	sys.stdout.flush()
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		server.stop()
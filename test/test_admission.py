@@ -0,0 +1,168 @@
+import unittest
+import threading
+import time
+
+
+from pyjurer.admission import AdmissionController, AdmissionRejected, TokenBucket
+from pyjurer.session_container import SessionContainer
+
+
+def request(id_, session='s1', op='eval', code='(+ 1 2)'):
+	return {'op': op, 'id': id_, 'session': session, 'code': code}
+
+
+class AdmissionControllerTests(unittest.TestCase):
+	"""Unit tests for AdmissionController"""
+
+	def setUp(self):
+		self.sent = []
+
+	def send(self, data):
+		self.sent.append(data['id'])
+
+	def test_in_flight_cap_queues_in_order(self):
+		admission = AdmissionController(maxInFlight=2)
+		for i in range(5):
+			admission.submit(request(str(i)), self.send)
+		self.assertEquals(['0', '1'], self.sent)
+
+		admission.completed('0')
+		self.assertEquals(['0', '1', '2'], self.sent)
+		admission.completed('1')
+		admission.completed('2')
+		self.assertEquals(['0', '1', '2', '3', '4'], self.sent)
+
+		metrics = admission.metrics()
+		self.assertEquals(5, metrics['admitted'])
+		self.assertEquals(3, metrics['queued'])
+		self.assertEquals(3, metrics['completed'])
+		self.assertEquals(2, metrics['in_flight'])
+		self.assertEquals(0, metrics['queue_length'])
+
+	def test_full_queue_rejects(self):
+		admission = AdmissionController(maxInFlight=1, maxQueued=1)
+		admission.submit(request('1'), self.send)
+		admission.submit(request('2'), self.send)
+		self.assertRaises(AdmissionRejected, admission.submit, request('3'), self.send)
+		self.assertEquals(1, admission.metrics()['rejected'])
+
+	def test_session_cap_passes_over_busy_session(self):
+		admission = AdmissionController(maxInFlightPerSession=1)
+		admission.submit(request('1', 'a'), self.send)
+		admission.submit(request('2', 'a'), self.send)
+		admission.submit(request('3', 'b'), self.send)
+		self.assertEquals(['1', '3'], self.sent)
+		admission.completed('1')
+		self.assertEquals(['1', '3', '2'], self.sent)
+
+	def test_interrupt_bypasses(self):
+		admission = AdmissionController(maxInFlight=1, maxQueued=0)
+		admission.submit(request('1'), self.send)
+		admission.submit(request('2', op='interrupt'), self.send)
+		self.assertEquals(['1', '2'], self.sent)
+		self.assertEquals(1, admission.metrics()['bypassed'])
+
+	def test_rate_is_kept(self):
+		admission = AdmissionController(requestsPerSecond=50)
+		started = time.time()
+		for i in range(60):
+			admission.submit(request(str(i)), self.send)
+			admission.completed(str(i))
+		# the burst of 50 goes straight away, the other 10 at 50 a second
+		self.assertEquals(50, len(self.sent))
+		while len(self.sent) < 60 and time.time() - started < 2:
+			time.sleep(0.01)
+		self.assertEquals(60, len(self.sent))
+		self.assertTrue(time.time() - started >= 0.15)
+
+	def test_token_bucket_larger_than_burst(self):
+		bucket = TokenBucket(100, 10)
+		now = time.time()
+		self.assertEquals(0, bucket.wait_time(1000, now))
+		bucket.take(1000, now)
+		self.assertAlmostEquals(0.1, bucket.wait_time(1000, now))
+
+	def test_aimd(self):
+		admission = AdmissionController(maxInFlight=8, targetLatency=0.05)
+		admission.submit(request('slow'), self.send)
+		time.sleep(0.06)
+		admission.completed('slow')
+		self.assertEquals(4, admission.metrics()['limit'])
+
+		# one cap's worth of fast requests adds one
+		for i in range(4):
+			admission.submit(request(str(i)), self.send)
+			admission.completed(str(i))
+		self.assertEquals(5, admission.metrics()['limit'])
+		self.assertEquals(1, admission.metrics()['increases'])
+		self.assertEquals(1, admission.metrics()['decreases'])
+
+
+	def test_sent_without_the_lock(self):
+		admission = AdmissionController(maxInFlight=1)
+		unlocked = []
+		def send(data):
+			# the lock is reentrant, so another thread has to try it
+			def acquire():
+				with admission._lock:
+					unlocked.append(data['id'])
+			thread = threading.Thread(target=acquire)
+			thread.start()
+			thread.join(1)
+		admission.submit(request('0'), send)
+		admission.submit(request('1'), send)
+		admission.completed('0')
+		admission.submit(request('2', op='interrupt'), send)
+		self.assertEquals(['0', '1', '2'], unlocked)
+
+	def test_released_when_the_send_fails(self):
+		admission = AdmissionController(maxInFlight=1, maxInFlightPerSession=1)
+		def send(data):
+			raise IOError('broken pipe')
+		self.assertRaises(IOError, admission.submit, request('0'), send)
+		self.assertEquals(0, admission.metrics()['in_flight'])
+		self.assertEquals({}, admission._inFlightPerSession)
+
+		admission.submit(request('1'), self.send)
+		self.assertEquals(['1'], self.sent)
+
+class ContainerAdmissionTests(unittest.TestCase):
+	"""Admission control through SessionContainer and NREPLSession"""
+
+	def setUp(self):
+		self.sent = []
+		self.admission = AdmissionController(maxInFlight=1, maxQueued=1)
+		self.container = SessionContainer(self.sent.append, admission=self.admission)
+		self.container.create_new_session(self.new_session)
+		self.container._accept_data({'id': self.sent[0]['id'], 'session': '', 'new-session': 's1'})
+
+	def new_session(self, session):
+		self.session = session
+
+	def test_released_on_done(self):
+		done = []
+		first = self.session.eval('1', done=lambda s, id_: done.append(id_))
+		second = self.session.eval('2', done=lambda s, id_: done.append(id_))
+		self.assertEquals(2, len(self.sent))
+
+		self.container._accept_data({'id': first, 'session': 's1', 'status': ['done']})
+		self.assertEquals(second, self.sent[2]['id'])
+		self.assertEquals([first], done)
+
+	def test_rejected_request_is_forgotten(self):
+		self.session.eval('1')
+		queued = self.session.eval('2')
+		self.assertRaises(AdmissionRejected, self.session.eval, '3')
+		rejected = str(int(queued) + 1)
+		self.assertNotEquals(None, self.session._callbacks._idCallbacks.get(queued))
+		self.assertEquals(None, self.session._callbacks._idCallbacks.get(rejected))
+
+	def test_released_when_the_connection_is_lost(self):
+		self.session.eval('1')
+		self.session.eval('2')
+		self.container._connection_lost()
+		metrics = self.admission.metrics()
+		self.assertEquals((0, 0), (metrics['in_flight'], metrics['queue_length']))
+
+		third = self.session.eval('3')
+		self.assertEquals(third, self.sent[-1]['id'])
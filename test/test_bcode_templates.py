@@ -0,0 +1,45 @@
+import unittest
+
+
+from pyjurer.transports import bcode
+from pyjurer.transports.bcode_templates import RequestTemplates
+
+
+class RequestTemplatesTests(unittest.TestCase):
+	"""Unit tests for the pre-encoded request templates"""
+
+	def test_output_is_identical_to_bencode(self):
+		templates = RequestTemplates()
+		requests = [
+			{'op': 'eval', 'session': 's-1', 'id': '1', 'code': '(+ 1 2)'},
+			{'op': 'eval', 'session': 's-1', 'id': '2', 'code': u'(str "\xe9")'},
+			{'op': 'eval', 'session': 's-2', 'id': '3', 'code': '(+ 1 2)'},
+			{'op': 'stdin', 'session': 's-1', 'id': '4', 'stdin': 'line\n'},
+			{'op': 'interrupt', 'session': 's-1', 'id': '5', 'interrupt-id': 1},
+			{'op': 'clone', 'id': '6'},
+			{'op': 'eval', 'session': 's-1', 'id': '7', 'code': '', 'ns': 'user'},
+			{'op': 'stdin', 'session': 's-1', 'id': '8', 'stdin': u'\xe9\n'.encode('utf8')},
+			{'op': 'stdin', 'session': 's-1', 'id': '9', 'stdin': u'\u20ac'},
+			{'op': 'eval', 'session': 's-1', 'id': u'10', 'code': '\xff\xfe'},
+		]
+		for request in requests + requests:
+			self.assertEquals(bcode.bencode(request), templates.encode(request))
+
+	def test_templates_are_reused_per_session_and_op(self):
+		templates = RequestTemplates()
+		for i in range(10):
+			templates.encode({'op': 'eval', 'session': 's-1', 'id': str(i), 'code': '(f)'})
+			templates.encode({'op': 'eval', 'session': 's-2', 'id': str(i), 'code': '(f)'})
+		self.assertEquals(2, len(templates._templates))
+
+	def test_strings_are_encoded_like_bencode(self):
+		self.assertEquals('2:\xc3\xa9', bcode.bencode(u'\xe9'))
+		self.assertEquals('2:\xc3\xa9', bcode.bencode(u'\xe9'.encode('utf8')))
+		self.assertEquals({'stdin': '\xc3\xa9'}, bcode.bdecode(bcode.bencode({'stdin': '\xc3\xa9'})))
+
+	def test_bencode_sorts_keys(self):
+		self.assertEquals('d1:ai1e1:bi2e1:ci3ee', bcode.bencode({'c': 3, 'a': 1, 'b': 2}))
+
+
+if __name__ == "__main__":
+	unittest.main()
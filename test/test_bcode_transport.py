@@ -0,0 +1,325 @@
+import unittest
+import logging
+import mmap
+import tempfile
+import threading
+
+
+from pyjurer.transports import bcode
+from pyjurer.transports.bcode_transport import BCodeTransport
+from pyjurer.transports.async_bcode_deserialiser import AsyncBCodeDeserialiser, DecodeError, frame_end, frame_field, _walk, _Incomplete
+from pyjurer.transports import offload
+from pyjurer.transports.offload import OffloadDecoder
+
+
+# the deserialiser logs the data it drops, which the tests send on purpose
+logging.getLogger('pyjurer').addHandler(logging.NullHandler())
+
+def failing_decode_file(path):
+	'''stands in for offload._decode_file in a worker that cannot decode'''
+	return (False, 'MemoryError: ')
+
+
+def mapped(contents):
+	f = tempfile.TemporaryFile()
+	f.write(contents)
+	f.flush()
+	return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class BCodeTransportUnitTests(unittest.TestCase):
+	"""Unit tests for BCodeTransport"""
+
+	def test_sends(self):
+		logger = logging.getLogger("{0}:BcodeTransportUnitTest:test_sends".format(__name__))
+
+		def sendBytes(bs):
+			logger.debug("sendBytes: {0}".format(bs))
+			sendBytes.received.append(bs)
+		sendBytes.received = []
+
+		def receivedData(data):
+			receivedData.data.append(data)
+		receivedData.data = []
+
+		t = BCodeTransport(sendBytes, receivedData)
+		t.send(4)
+		t.send(['1','2','3','4'])
+
+		self.assertEquals(0, len(receivedData.data))
+		self.assertEquals(bcode.bencode(4), sendBytes.received[0])
+		self.assertEquals(bcode.bencode(['1','2','3','4']), sendBytes.received[1])
+
+	def test_receives(self):
+		logger = logging.getLogger("{0}:BcodeTransportUnitTest:test_receives".format(__name__))
+
+		def sendBytes(bs):
+			logger.debug("sendBytes: {0}".format(bs))
+			sendBytes.received.append(bs)
+		sendBytes.received = []
+
+		def receivedData(data):
+			receivedData.data.append(data)
+		receivedData.data = []
+
+		t = BCodeTransport(sendBytes, receivedData)
+		t.receive('12:aoeuaoeuaoeu')
+		t.receive('12:aoeua')
+		t.receive('oeuaoeu')
+
+		self.assertEquals(0, len(sendBytes.received))
+
+		self.assertEquals(2, len(receivedData.data))
+		self.assertEquals('aoeuaoeuaoeu', receivedData.data[0])
+		self.assertEquals('aoeuaoeuaoeu', receivedData.data[1])
+
+
+	def test_sends_mapped_files_in_parts(self):
+		sent = []
+		t = BCodeTransport(sent.append)
+		contents = mapped('(ns big)')
+		t.send({'op': 'load-file', 'file': contents})
+
+		parts = sent[0]
+		self.assertTrue(contents in parts)
+		self.assertEquals(bcode.bencode({'op': 'load-file', 'file': '(ns big)'}),
+			''.join(p[:] for p in parts))
+
+
+class AsyncBCodeDeserialiserTest(unittest.TestCase):
+	"""Unit tests for AsyncBCodeDeserialiser"""
+
+	def setUp(self):        
+		self.received_data = []
+		self.ds = AsyncBCodeDeserialiser()
+		self.ds.register_cb(self.data_received)
+
+	def test_pushing_fragments(self):
+		self.ds.push_data('4:ao')
+		self.ds.push_data('oe')
+		self.ds.push_data('5:3.uoe')
+		self.ds.push_data('l4:aoeu3')
+		self.ds.push_data(':oeue')
+
+		self.assertEqual(['aooe', '3.uoe', ['aoeu', 'oeu']], self.received_data)
+
+	def test_large_frame_in_many_chunks(self):
+		frame = bcode.bencode({'id': '1', 'value': 'x' * 100000, 'status': ['done']})
+		for i in range(0, len(frame), 1000):
+			self.ds.push_data(frame[i:i + 1000])
+		self.ds.push_data('i42e')
+
+		self.assertEqual(2, len(self.received_data))
+		self.assertEqual('x' * 100000, self.received_data[0]['value'])
+		self.assertEqual(42, self.received_data[1])
+
+	def test_malformed_frame_is_skipped(self):
+		self.ds.push_data('i1x2ei3e')
+		self.assertEqual([3], self.received_data)
+
+	def test_data_that_is_not_bencode_is_dropped(self):
+		self.ds.push_data('4:aoeu')
+		self.assertRaises(DecodeError, self.ds.push_data, 'x4:abcd')
+		self.assertEqual([], self.ds._chunks)
+		# there is no telling where the next frame starts
+		self.ds.push_data('i1e')
+		self.assertEqual(['aoeu'], self.received_data)
+
+	def test_walk_counts_tokens(self):
+		self.assertEqual((14, 7), _walk('d2:idl1:ai1eee'))
+		try:
+			_walk('d2:idl1:ai1')
+			self.fail()
+		except _Incomplete, e:
+			self.assertEqual((9, 2, 4), (e.resume, e.depth, e.tokens))
+		self.assertEqual((14, 7), _walk('d2:idl1:ai1eee', e.resume, e.depth, e.tokens))
+
+	def test_frame_end(self):
+		self.assertEqual(9, frame_end('d2:idi1ee3:abc'))
+		self.assertEqual(15, frame_end('d2:idi1ee4:abcdi1e', 9))
+		self.assertRaises(_Incomplete, frame_end, 'd5:value10:abc')
+		self.assertRaises(ValueError, frame_end, 'x')
+
+	def test_frame_field(self):
+		frame = bcode.bencode({'id': '7', 'ns': {'a': 'b'}, 'session': 's', 'value': 'x' * 10})
+		self.assertEqual('7', frame_field(frame, 'id'))
+		self.assertEqual('s', frame_field(frame, 'session'))
+		self.assertEqual(None, frame_field(frame, 'ns'))
+		self.assertEqual(None, frame_field(frame, 'status'))
+		self.assertEqual(None, frame_field('i1e', 'id'))
+
+	def data_received(self, d):
+		self.received_data.append(d)
+
+
+class LazyDecodingTests(unittest.TestCase):
+	"""Unit tests for bcode.lazy_bdecode and the lazy mode of AsyncBCodeDeserialiser"""
+
+	response = {'id': '3', 'session': 's', 'status': ['done'], 'count': 12, 'value': 'x' * 1000,
+		'ops': {'eval': {'doc': 'y' * 300, 'requires': {'code': 'The code'}}, 'describe': {}},
+		'list': [1, {'a': 'b'}, 'c']}
+
+	def test_equal_to_bdecode(self):
+		frame = bcode.bencode(self.response)
+		self.assertEqual(self.response, bcode.lazy_bdecode(frame))
+		self.assertEqual(bcode.bdecode('l1:ai2ee'), bcode.lazy_bdecode('l1:ai2ee'))
+		self.assertEqual(sorted(self.response.items()), sorted(bcode.lazy_bdecode(frame).items()))
+
+	def test_decoded_on_lookup(self):
+		decoded = bcode.lazy_bdecode(bcode.bencode(self.response))
+		raw = lambda d, k: dict.__getitem__(d, k)
+		self.assertEqual('s', raw(decoded, 'session'))
+		self.assertEqual(12, raw(decoded, 'count'))
+		self.assertEqual(bcode._Undecoded, type(raw(decoded, 'value')))
+
+		ops = decoded['ops']
+		self.assertTrue(isinstance(ops, bcode.LazyDict))
+		self.assertEqual(['describe', 'eval'], sorted(ops.keys()))
+		self.assertEqual(bcode._Undecoded, type(raw(ops, 'eval')))
+		self.assertEqual('The code', ops['eval']['requires']['code'])
+		self.assertEqual('x' * 1000, decoded.get('value'))
+		self.assertEqual(None, decoded.get('missing'))
+
+	def test_plain_copies(self):
+		frame = bcode.bencode(self.response)
+		self.assertEqual(bcode._Undecoded, type(dict(bcode.lazy_bdecode(frame))['value']))
+		for copy in (lambda d: d.copy(), lambda d: dict(d.decode_all())):
+			plain = copy(bcode.lazy_bdecode(frame))
+			self.assertEqual(dict, type(plain))
+			self.assertEqual('x' * 1000, dict.__getitem__(plain, 'value'))
+			self.assertEqual(self.response, plain)
+
+	def test_pop_forgets_the_key(self):
+		decoded = bcode.lazy_bdecode(bcode.bencode(self.response))
+		self.assertEqual('x' * 1000, decoded.pop('value'))
+		self.assertFalse('value' in decoded)
+		key, value = decoded.popitem()
+		self.assertEqual(self.response[key], value)
+		self.assertFalse(key in decoded)
+
+	def test_plain(self):
+		value = bcode.plain(bcode.lazy_bdecode(bcode.bencode(self.response)))
+		self.assertEqual(dict, type(value))
+		self.assertEqual(dict, type(dict.__getitem__(value, 'ops')))
+		self.assertEqual(dict, type(dict.__getitem__(dict.__getitem__(value, 'ops'), 'eval')))
+		self.assertEqual(self.response, value)
+		self.assertEqual('x', bcode.plain('x'))
+
+	def test_deserialiser_in_chunks(self):
+		received = []
+		ds = AsyncBCodeDeserialiser(lazy=True)
+		ds.register_cb(received.append)
+		frames = bcode.bencode(self.response) + bcode.bencode({'id': '4', 'value': 'z' * 500}) + 'i7e'
+		for i in range(0, len(frames), 7):
+			ds.push_data(frames[i:i + 7])
+
+		self.assertEqual([self.response, {'id': '4', 'value': 'z' * 500}, 7], received)
+		self.assertTrue(isinstance(received[0], bcode.LazyDict))
+
+
+class ManualOffload(object):
+	"""OffloadDecoder that decodes when the test says so"""
+
+	threshold = 100
+
+	def __init__(self):
+		self.pending = []
+
+	def decode(self, frame, callback):
+		self.pending.append((frame, callback))
+
+	def finish(self):
+		frame, callback = self.pending.pop(0)
+		callback(bcode.bdecode(frame))
+
+
+class OffloadTests(unittest.TestCase):
+	"""Unit tests for decoding large frames away from the channel's thread"""
+
+	def setUp(self):
+		self.received_data = []
+		self.offload = ManualOffload()
+		self.ds = AsyncBCodeDeserialiser(self.offload)
+		self.ds.register_cb(self.received_data.append)
+
+	def test_later_frames_of_the_same_request_wait(self):
+		large = {'id': '1', 'value': range(100)}
+		self.ds.push_data(bcode.bencode(large) + bcode.bencode({'id': '2', 'value': 'a'}) +
+			bcode.bencode({'id': '1', 'status': ['done']}))
+		self.assertEqual([{'id': '2', 'value': 'a'}], self.received_data)
+
+		self.ds.push_data(bcode.bencode(large))
+		self.ds.push_data(bcode.bencode({'id': '1', 'status': ['done']}))
+		self.offload.finish()
+		self.assertEqual([{'id': '2', 'value': 'a'}, large, {'id': '1', 'status': ['done']}],
+			self.received_data)
+
+		self.offload.finish()
+		self.assertEqual(5, len(self.received_data))
+		self.assertEqual({}, self.ds._waiting)
+
+	def test_decoded_in_a_worker_process(self):
+		decoder = OffloadDecoder()
+		try:
+			# no worker until there is a frame for it
+			self.assertEqual(None, decoder._pool)
+			decoded = threading.Event()
+			values = []
+			def callback(value):
+				values.append(value)
+				decoded.set()
+			decoder.decode(bcode.bencode({'id': '1', 'value': ['x' * 100, 1, {'a': 'b'}]}), callback)
+			self.assertTrue(decoded.wait(10))
+			self.assertEqual([{'id': '1', 'value': ['x' * 100, 1, {'a': 'b'}]}], values)
+
+			decoded.clear()
+			decoder.decode('not bencode', callback)
+			self.assertTrue(decoded.wait(10))
+			self.assertEqual(None, values[-1])
+		finally:
+			decoder.close()
+
+	def test_decoded_inline_when_the_worker_fails(self):
+		decoder = OffloadDecoder()
+		# the worker is forked, and handed the function, with the failing stand-in
+		decodeFile = offload._decode_file
+		offload._decode_file = failing_decode_file
+		try:
+			decoded = threading.Event()
+			values = []
+			def callback(value):
+				values.append(value)
+				decoded.set()
+			decoder.decode(bcode.bencode({'id': '1', 'value': range(10)}), callback)
+			self.assertTrue(decoded.wait(10))
+			self.assertEqual([{'id': '1', 'value': range(10)}], values)
+		finally:
+			offload._decode_file = decodeFile
+			decoder.close()
+
+		# and after it is closed
+		values = []
+		decoder.decode(bcode.bencode({'id': '2'}), values.append)
+		self.assertEqual([{'id': '2'}], values)
+
+	def test_long_strings_are_spooled(self):
+		decoder = OffloadDecoder(threshold=10 ** 9, spoolSize=100)
+		try:
+			ds = AsyncBCodeDeserialiser(decoder)
+			received = []
+			ds.register_cb(received.append)
+			frames = [{'id': '1', 'value': 'x' * 1000, 'ns': 'user'}, {'id': '2', 'out': 'a'},
+				{'id': '3', 'value': ['b' * 300, 'c', {'d': 'e' * 200, 'f': 1}], 'z': 'q' * 101}, 'y' * 500]
+			data = ''.join(bcode.bencode(f) for f in frames)
+			for i in range(0, len(data), 37):
+				ds.push_data(data[i:i + 37])
+				if i == 37:
+					self.assertFalse(ds._spool is None)
+			self.assertEqual(frames, received)
+			self.assertEqual(None, ds._spool)
+		finally:
+			decoder.close()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+import logging
+import socket
+import threading
+import time
+
+
+from pyjurer import broadcast as broadcast_module
+from pyjurer.broadcast import broadcast, broadcast_as_completed, parse_endpoint
+import standin_server
+from standin_server import StandinNrepl
+
+
+def unused_endpoint():
+	s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	s.bind(('127.0.0.1', 0))
+	endpoint = s.getsockname()
+	s.close()
+	return endpoint
+
+
+class SilentSession(object):
+	"""a session that keeps the callbacks of its eval and never answers"""
+
+	def __init__(self):
+		self.callbacks = None
+
+	def eval(self, code, **callbacks):
+		self.callbacks = callbacks
+		return '1'
+
+	def interrupt(self, interrupt_id=None):
+		pass
+
+	def close(self):
+		pass
+
+
+class SilentContainer(object):
+	def __init__(self, session):
+		self.session = session
+
+	def create_new_session(self, callback):
+		callback(self.session)
+
+
+class BroadcastTests(unittest.TestCase):
+	"""End-to-end tests of broadcasting a form to several stand-in nrepls"""
+
+	def setUp(self):
+		self.fast = StandinNrepl().start()
+		self.other = StandinNrepl(out_chunks=2, out_size=4).start()
+		self.slow = StandinNrepl(latency=5.0).start()
+
+	def tearDown(self):
+		for server in (self.fast, self.other, self.slow):
+			server.stop()
+
+	def test_results_per_host(self):
+		dead = unused_endpoint()
+		endpoints = [self.fast.address, self.slow.address, dead, self.other.address]
+
+		started = time.time()
+		results = broadcast(endpoints, '(+ 1 2)', timeout=0.5)
+		elapsed = time.time() - started
+
+		self.assertTrue(elapsed < 2, elapsed)
+		self.assertEquals(endpoints, [r.endpoint for r in results])
+		self.assertEquals(['done', 'timeout', 'unreachable', 'done'], [r.status for r in results])
+		self.assertEquals(['(+ 1 2)'], results[0].values)
+		self.assertEquals('ooo\nooo\n', ''.join(results[3].out))
+		self.assertFalse(results[2].error is None)
+
+	def test_slow_hosts_come_last(self):
+		statuses = [r.status for r in broadcast_as_completed(
+			[self.slow.address, self.fast.address], '(throw)', timeout=0.5)]
+		self.assertEquals(['eval-error', 'timeout'], statuses)
+
+	def test_a_host_that_times_out_is_interrupted(self):
+		interrupted = threading.Event()
+		interrupt = standin_server._Session.interrupt
+		def recording(session, message):
+			interrupted.set()
+			interrupt(session, message)
+		standin_server._Session.interrupt = recording
+		try:
+			results = broadcast([self.slow.address], '(+ 1 2)', timeout=0.2)
+			self.assertEquals(['timeout'], [r.status for r in results])
+			self.assertTrue(interrupted.wait(2))
+		finally:
+			standin_server._Session.interrupt = interrupt
+
+	def test_an_endpoint_given_twice(self):
+		endpoints = [self.fast.address, self.other.address, self.fast.address]
+		results = broadcast(endpoints, '(+ 1 2)', timeout=0.5)
+		self.assertEquals(endpoints, [r.endpoint for r in results])
+		self.assertEquals(['done'] * 3, [r.status for r in results])
+		self.assertFalse(results[0] is results[2])
+		self.assertEquals(3, len(list(broadcast_as_completed(endpoints, '(+ 1 2)', timeout=0.5))))
+
+	def test_unexpected_failures_are_reported(self):
+		def failing(*args, **kwargs):
+			raise ValueError('no such thing')
+		create = broadcast_module.create_bcode_over_tcp_session_container
+		broadcast_module.create_bcode_over_tcp_session_container = failing
+		logger = logging.getLogger('pyjurer.broadcast')
+		logger.disabled = True
+		try:
+			results = broadcast([self.fast.address], '(+ 1 2)', timeout=0.5)
+		finally:
+			broadcast_module.create_bcode_over_tcp_session_container = create
+			logger.disabled = False
+		self.assertEquals(['error'], [r.status for r in results])
+		self.assertEquals('no such thing', results[0].error)
+
+	def test_late_callbacks_leave_the_result_alone(self):
+		session = SilentSession()
+		create = broadcast_module.create_bcode_over_tcp_session_container
+		stop = broadcast_module.stop_bcode_over_tcp_session_container
+		broadcast_module.create_bcode_over_tcp_session_container = lambda *args, **kwargs: SilentContainer(session)
+		stopped = threading.Event()
+		broadcast_module.stop_bcode_over_tcp_session_container = lambda *args, **kwargs: stopped.set()
+		try:
+			results = broadcast([self.fast.address], '(+ 1 2)', timeout=0.1)
+			# the host's thread stops its container after handing the result on
+			self.assertTrue(stopped.wait(2))
+		finally:
+			broadcast_module.create_bcode_over_tcp_session_container = create
+			broadcast_module.stop_bcode_over_tcp_session_container = stop
+
+		session.callbacks['value'](session, '1', '3')
+		session.callbacks['stdout'](session, '1', 'late')
+		session.callbacks['error'](session, '1')
+		self.assertEquals('timeout', results[0].status)
+		self.assertEquals(([], [], []), (results[0].values, results[0].out, results[0].err))
+
+	def test_parse_endpoint(self):
+		self.assertEquals(('worker1', 7888), parse_endpoint('worker1:7888'))
+		self.assertEquals(('localhost', 7888), parse_endpoint('7888'))
+
+
+if __name__ == "__main__":
+	unittest.main()
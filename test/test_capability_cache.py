@@ -0,0 +1,129 @@
+import unittest
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+from pyjurer.nrepl_session import NREPLSession
+from pyjurer.capability_cache import CapabilityCache
+
+# the cache warns about the files it cannot use, which the tests make on purpose
+logging.getLogger('pyjurer').addHandler(logging.NullHandler())
+
+class FakeDescribeChannel(object):
+	"""Channel that answers describe with a fixed set of ops and everything
+	else with unknown-op"""
+
+	def __init__(self, ops, version='1.0'):
+		self.session = None
+		self.ops = ops
+		self.version = version
+		self.submitted = []
+
+	def _submit(self, data):
+		self.submitted.append(data['op'])
+		reply = self.session._receive_results
+		if data['op'] == 'describe':
+			reply({'id': data['id'], 'ops': dict((o, {}) for o in self.ops),
+				'versions': {'nrepl': {'version-string': self.version}}})
+			reply({'id': data['id'], 'status': ['done']})
+		else:
+			reply({'id': data['id'], 'op': data['op'], 'status': ['error', 'unknown-op', 'done']})
+
+
+def make_session(ops, version='1.0'):
+	channel = FakeDescribeChannel(ops, version)
+	session = NREPLSession(channel, "1", (str(i) for i in itertools.count()))
+	channel.session = session
+	return channel, session
+
+
+class CapabilityCacheTests(unittest.TestCase):
+	"""Unit tests for CapabilityCache"""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'cache', 'capabilities.json')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_cached_across_instances(self):
+		channel, session = make_session(['eval', 'complete'])
+		fresh = []
+		self.assertEquals(None, CapabilityCache(self.path).capabilities(session, ('localhost', 7888),
+			lambda s, entry: fresh.append(entry)))
+		self.assertEquals(['complete', 'eval'], fresh[0]['ops'])
+
+		cache = CapabilityCache(self.path)
+		self.assertTrue(cache.supports(('localhost', 7888), 'complete'))
+		self.assertFalse(cache.supports(('localhost', 7888), 'info'))
+		self.assertEquals(None, cache.supports(('localhost', 7889), 'eval'))
+
+		# fresh, so not described again
+		channel, session = make_session(['eval'], version='2.0')
+		fresh = []
+		cached = cache.capabilities(session, ('localhost', 7888), lambda s, entry: fresh.append(entry))
+		self.assertEquals(['complete', 'eval'], cached['ops'])
+		self.assertEquals([cached], fresh)
+		self.assertEquals([], channel.submitted)
+
+	def test_stale_entries_are_described_again(self):
+		channel, session = make_session(['eval', 'complete'])
+		CapabilityCache(self.path).capabilities(session, ('localhost', 7888))
+
+		channel, session = make_session(['eval'], version='2.0')
+		cached = CapabilityCache(self.path, maxAge=0).capabilities(session, ('localhost', 7888))
+		self.assertEquals(['complete', 'eval'], cached['ops'])
+		self.assertEquals(['describe'], channel.submitted)
+		self.assertFalse(CapabilityCache(self.path).supports(('localhost', 7888), 'complete'))
+
+	def test_writes_keep_the_entries_of_others(self):
+		first = CapabilityCache(self.path)
+		second = CapabilityCache(self.path)
+		first.store(('localhost', 7888), {'ops': ['eval']})
+		second.store(('localhost', 7889), {'ops': ['eval', 'complete']})
+		first.store(('localhost', 7890), {'ops': ['eval']})
+
+		with open(self.path) as f:
+			self.assertEquals(['localhost:7888', 'localhost:7889', 'localhost:7890'], sorted(json.load(f)))
+		self.assertTrue(first.supports(('localhost', 7889), 'complete'))
+
+		second.invalidate(('localhost', 7888))
+		self.assertEquals(None, CapabilityCache(self.path).supports(('localhost', 7888), 'eval'))
+
+	def test_unknown_op_invalidates(self):
+		channel, session = make_session(['eval', 'complete'])
+		cache = CapabilityCache(self.path)
+		cache.capabilities(session, 'tcp://localhost:7888')
+		self.assertTrue(cache.supports('tcp://localhost:7888', 'complete'))
+
+		# the server was replaced by one without the complete op
+		channel.ops = ['eval']
+		session.complete('ma')
+		self.assertFalse(cache.supports('tcp://localhost:7888', 'complete'))
+		self.assertEquals(['describe', 'complete', 'describe'], channel.submitted)
+
+	def test_a_session_is_watched_once(self):
+		channel, session = make_session(['eval', 'complete'])
+		cache = CapabilityCache(self.path)
+		for i in range(3):
+			cache.capabilities(session, 'tcp://localhost:7888')
+		self.assertEquals(1, len(session._unknownOpListeners))
+
+		channel.ops = ['eval']
+		session.complete('ma')
+		self.assertEquals(['describe', 'complete', 'describe'], channel.submitted)
+
+	def test_malformed_file_is_ignored(self):
+		os.makedirs(os.path.dirname(self.path))
+		with open(self.path, 'w') as f:
+			f.write('{not json')
+		self.assertEquals(None, CapabilityCache(self.path).lookup(('localhost', 7888)))
+
+
+if __name__ == "__main__":
+	unittest.main()
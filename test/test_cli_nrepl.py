@@ -0,0 +1,106 @@
+import unittest
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import StringIO
+
+
+from pyjurer.nrepl_session import NREPLSession
+from pyjurer.cli_nrepl import BatchRunner
+from pyjurer.forms import split_forms
+
+
+class EchoChannel(object):
+	"""Channel that answers every eval synchronously with its own code as the value,
+	forms containing 'throw' are answered with an eval-error"""
+
+	def __init__(self, answer=True):
+		self.session = None
+		self.answer = answer
+
+	def _submit(self, data):
+		if not self.answer:
+			return
+		id_ = data['id']
+		if 'throw' in data['code']:
+			self.session._receive_results({'id': id_, 'err': 'boom\n', 'status': ['eval-error']})
+		else:
+			self.session._receive_results({'id': id_, 'out': 'printed'})
+			self.session._receive_results({'id': id_, 'value': data['code']})
+		self.session._receive_results({'id': id_, 'status': ['done']})
+
+
+def make_runner(output, answer=True, window=4):
+	channel = EchoChannel(answer)
+	session = NREPLSession(channel, "1", (str(i) for i in itertools.count()))
+	channel.session = session
+	return BatchRunner(session, output, window)
+
+
+class BatchRunnerTests(unittest.TestCase):
+	"""Unit tests for the batch cli"""
+
+	def test_writes_a_record_per_form(self):
+		output = StringIO.StringIO()
+		runner = make_runner(output)
+
+		runner.run(split_forms('(+ 1 2) (throw (Exception.)) :done'))
+		self.assertTrue(runner.wait(1))
+
+		records = [json.loads(l) for l in output.getvalue().splitlines()]
+		self.assertEquals([0, 1, 2], [r['form'] for r in records])
+		self.assertEquals(['(+ 1 2)'], records[0]['value'])
+		self.assertEquals('printed', records[0]['out'])
+		self.assertEquals('done', records[0]['status'])
+		self.assertEquals('eval-error', records[1]['status'])
+		self.assertEquals('boom\n', records[1]['err'])
+		self.assertEquals(3, runner.completed)
+		self.assertEquals(1, runner.errors)
+
+	def test_unanswered_forms_time_out(self):
+		output = StringIO.StringIO()
+		runner = make_runner(output, answer=False)
+
+		runner.run(['(a)', '(b)'])
+		self.assertFalse(runner.wait(0.01))
+
+		records = [json.loads(l) for l in output.getvalue().splitlines()]
+		self.assertEquals(['timeout', 'timeout'], [r['status'] for r in records])
+
+	def test_a_full_window_times_out(self):
+		output = StringIO.StringIO()
+		runner = make_runner(output, answer=False, window=2)
+
+		self.assertFalse(runner.run(['(a)', '(b)', '(c)', '(d)'], timeout=0.01))
+		self.assertFalse(runner.wait(0.01))
+
+		records = [json.loads(l) for l in output.getvalue().splitlines()]
+		self.assertEquals([2, 3, 0, 1], [r['form'] for r in records])
+		self.assertEquals(['timeout'] * 4, [r['status'] for r in records])
+		self.assertEquals(4, runner.errors)
+
+
+	def test_a_session_that_is_never_made_times_out(self):
+		# accepts the connection and never answers the clone
+		listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		listener.bind(('127.0.0.1', 0))
+		listener.listen(1)
+		script = os.path.join(os.path.dirname(__file__), '..', 'pyjurer', 'cli_nrepl.py')
+		started = time.time()
+		try:
+			process = subprocess.Popen([sys.executable, script, '-t', '0.2', str(listener.getsockname()[1])],
+				stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+			out, err = process.communicate('(+ 1 2)')
+		finally:
+			listener.close()
+		self.assertEquals(1, process.returncode)
+		self.assertEquals('', out)
+		self.assertTrue(time.time() - started < 5)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import itertools
+
+
+from pyjurer.nrepl_session import NREPLSession
+from pyjurer import completion_cache
+from pyjurer.completion_cache import CompletionCache
+
+
+class FakeNreplChannel(object):
+	"""Channel that answers complete, info and eval ops synchronously from
+	a fixed set of vars, counting the requests by op, and creates sessions
+	like a container"""
+
+	def __init__(self, names):
+		self.ids = (str(i) for i in itertools.count())
+		self.sessions = {}
+		self.names = names
+		self.ops = []
+		self.evaluatedOn = []
+		self.missing = set()
+		self.fuzzy = False
+
+	def create_new_session(self, newSessionCb):
+		self.ops.append('clone')
+		session = NREPLSession(self, str(len(self.sessions) + 1), self.ids)
+		self.sessions[session._sessionId] = session
+		newSessionCb(session)
+
+	def _submit(self, data):
+		op = data['op']
+		self.ops.append(op)
+		id_ = data['id']
+		reply = self.sessions[data['session']]._receive_results
+		if op == 'eval':
+			self.evaluatedOn.append(data['session'])
+
+		if op == 'eval' and any(ns in data['code'] for ns in self.missing):
+			reply({'id': id_, 'err': 'No namespace found'})
+			reply({'id': id_, 'status': ['eval-error']})
+		elif op == 'eval':
+			reply({'id': id_, 'out': '\n'.join(self.names) + '\n'})
+		elif op == 'complete':
+			reply({'id': id_, 'completions': [{'candidate': n, 'type': 'var'}
+				for n in self.names if n.startswith(data['prefix']) or (self.fuzzy and
+					n.startswith(data['prefix'][0]) and data['prefix'][-1] in n)]})
+		elif op == 'info':
+			reply({'id': id_, 'name': data['symbol'], 'ns': 'my.ns', 'doc': 'docs'})
+		elif op == 'load-file':
+			reply({'id': id_, 'value': 'nil'})
+		reply({'id': id_, 'status': ['done']})
+
+
+def make_cache(names):
+	channel = FakeNreplChannel(names)
+	sessions = []
+	channel.create_new_session(sessions.append)
+	del channel.ops[:]
+	return channel, sessions[0], CompletionCache(sessions[0])
+
+
+class CompletionCacheTests(unittest.TestCase):
+	"""Unit tests for CompletionCache"""
+
+	def test_complete_is_answered_locally_after_prefetch(self):
+		channel, session, cache = make_cache(['map', 'mapcat', 'max', 'filter'])
+
+		results = []
+		cache.complete('ma', 'my.ns', lambda s, names: results.append(names))
+		cache.complete('map', 'my.ns', lambda s, names: results.append(names))
+		cache.complete('f', 'my.ns', lambda s, names: results.append(names))
+
+		self.assertEquals([['map', 'mapcat', 'max'], ['map', 'mapcat'], ['filter']], results)
+		self.assertEquals(['clone', 'eval', 'complete'], channel.ops)
+
+	def test_prefetches_run_on_a_session_of_their_own(self):
+		channel, session, cache = make_cache(['map'])
+		cache.prefetch('my.ns')
+		cache.prefetch('other.ns')
+		self.assertEquals(['2', '2'], channel.evaluatedOn)
+
+		cache.close()
+		cache.prefetch('third.ns')
+		self.assertEquals(['clone', 'eval', 'eval', 'close'], channel.ops)
+
+	def test_fuzzy_completions_are_not_narrowed_down(self):
+		channel, session, cache = make_cache(['map', 'mapcat', 'max', 'merge'])
+		channel.fuzzy = True
+
+		results = []
+		cache.complete('mt', 'my.ns', lambda s, names: results.append(names))
+		cache.complete('mt', 'my.ns', lambda s, names: results.append(names))
+		self.assertEquals([['mapcat'], ['mapcat']], results)
+		self.assertEquals(1, channel.ops.count('complete'))
+
+		# neither the index nor the candidates for 'm' are narrowed down
+		cache.complete('m', 'my.ns', lambda s, names: None)
+		self.assertEquals(None, cache.lookup_completions('map', 'my.ns'))
+		self.assertEquals(None, cache.lookup_completions('str/j', 'my.ns'))
+
+	def test_qualified_prefixes_are_narrowed_down_locally(self):
+		channel, session, cache = make_cache(['str/join', 'str/split', 'str/starts-with?'])
+
+		results = []
+		cache.complete('str/', 'my.ns', lambda s, names: results.append(names))
+		cache.complete('str/s', 'my.ns', lambda s, names: results.append(names))
+
+		self.assertEquals(['str/split', 'str/starts-with?'], results[1])
+		self.assertEquals(1, channel.ops.count('complete'))
+
+	def test_info_is_cached_until_the_namespace_is_loaded_again(self):
+		channel, session, cache = make_cache(['f'])
+
+		results = []
+		cache.info('f', 'other.ns', lambda s, info: results.append(info))
+		cache.info('f', 'other.ns', lambda s, info: results.append(info))
+		self.assertEquals(1, channel.ops.count('info'))
+		self.assertEquals('docs', results[0]['doc'])
+
+		session.load_file('(ns my.ns)\n(defn f [])')
+		self.assertEquals(None, cache.lookup_completions('g', 'other.ns'))
+		cache.info('f', 'other.ns', lambda s, info: results.append(info))
+		self.assertEquals(2, channel.ops.count('info'))
+		self.assertEquals(['f'], cache._index['my.ns'])
+
+	def test_a_namespace_that_cannot_be_indexed_is_not_tried_again_for_a_while(self):
+		channel, session, cache = make_cache(['map'])
+		channel.missing.add('my.ns')
+
+		for prefix in ('a', 'b', 'c'):
+			cache.complete(prefix, 'my.ns', lambda s, names: None)
+		self.assertEquals(['clone', 'eval', 'complete', 'complete', 'complete'], channel.ops)
+
+		cache._failed['my.ns'] -= completion_cache.PREFETCH_RETRY_INTERVAL
+		channel.missing.clear()
+		cache.complete('d', 'my.ns', lambda s, names: None)
+		self.assertEquals(['map'], cache.lookup_completions('m', 'my.ns'))
+
+	def test_only_symbols_are_prefetched(self):
+		channel, session, cache = make_cache(['map'])
+		cache.prefetch("x) (System/exit 0")
+		cache.prefetch('')
+		self.assertEquals([], channel.ops)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import copy
+import decimal
+import fractions
+import gc
+import pickle
+import uuid
+
+
+from pyjurer import edn
+from pyjurer.edn import Keyword, Symbol, TaggedLiteral
+
+
+class EdnTests(unittest.TestCase):
+	"""Unit tests for edn.loads"""
+
+	def test_scalars(self):
+		self.assertEquals([None, True, False, 42, -7, 3, 10 ** 20, 2.5, -1e3, decimal.Decimal('1.25'),
+			fractions.Fraction(1, 3), 255, 5, float('inf')],
+			edn.loads('[nil true false 42 -7 +3 100000000000000000000N 2.5 -1e3 1.25M 1/3 0xff 2r101 ##Inf]'))
+
+	def test_strings_and_characters(self):
+		self.assertEquals(['a "quoted"\n\tline', '\xc3\xa9', 'x', '\n', ' ', '\xc3\xa9'],
+			edn.loads('["a \\"quoted\\"\\n\\tline" "\xc3\xa9" \\x \\newline \\space \\\xc3\xa9]'))
+
+	def test_collections(self):
+		value = edn.loads('{:a [1 2], :b (3 4), :c #{5 6}, "d" {:e nil}}')
+		self.assertEquals({edn.keyword('a'): [1, 2], edn.keyword('b'): [3, 4],
+			edn.keyword('c'): set([5, 6]), 'd': {edn.keyword('e'): None}}, value)
+
+	def test_collections_as_keys_are_hashable(self):
+		self.assertEquals({(1, 2): set([(3,), frozenset([4])])}, edn.loads('{[1 2] #{[3] #{4}}}'))
+
+	def test_keywords_and_symbols_are_interned(self):
+		first, second = edn.loads('[[:user/name clojure.core/map] [:user/name clojure.core/map]]')
+		self.assertTrue(first[0] is second[0])
+		self.assertTrue(first[1] is second[1])
+		self.assertTrue(first[0] is Keyword('name', 'user'))
+		self.assertEquals(('user', 'name'), (first[0].namespace, first[0].name))
+		self.assertEquals(':user/name', repr(first[0]))
+		self.assertFalse(edn.keyword('map') is edn.symbol('map'))
+		self.assertTrue(pickle.loads(pickle.dumps(first[1])) is first[1])
+		self.assertTrue(copy.deepcopy(first[0]) is first[0])
+
+	def test_names_no_longer_in_use_are_not_kept(self):
+		value = edn.loads('{:unused/key unused/symbol}')
+		self.assertTrue('unused/key' in Keyword._interned)
+		del value
+		gc.collect()
+		self.assertFalse('unused/key' in Keyword._interned)
+		self.assertFalse('unused/symbol' in Symbol._interned)
+
+	def test_tagged_literals(self):
+		self.assertEquals([uuid.UUID('f81d4fae-7dec-11d0-a765-00a0c91e6bf6'),
+			TaggedLiteral('inst', '2017-01-01T00:00:00.000-00:00'),
+			TaggedLiteral('var', edn.symbol('user/foo')),
+			TaggedLiteral('object', [edn.symbol('java.lang.Object'), 16, 'java.lang.Object@10'])],
+			edn.loads('''[#uuid "f81d4fae-7dec-11d0-a765-00a0c91e6bf6"
+				#inst "2017-01-01T00:00:00.000-00:00" #'user/foo
+				#object[java.lang.Object 0x10 "java.lang.Object@10"]]'''))
+		self.assertEquals(['2017'], edn.loads('[#inst "2017"]', tags={'inst': lambda v: v}))
+
+	def test_namespaced_maps(self):
+		self.assertEquals({edn.keyword('user/a'): 1, edn.keyword('other/b'): 2, edn.keyword('c'): 3,
+			edn.symbol('user/d'): {edn.keyword('e'): 4}, 'f': 5},
+			edn.loads('#:user{:a 1 :other/b 2 :_/c 3 d {:e 4} "f" 5}'))
+		self.assertEquals([{edn.keyword('app.core/a'): 1}],
+			edn.loads('[#::{:a 1}]', ns='app.core'))
+		for text in ['#::{:a 1}', '#::alias{:a 1}', '#:user[:a 1]']:
+			self.assertRaises(ValueError, edn.loads, text)
+
+	def test_octal(self):
+		self.assertEquals([0, 8, -8, 8, 7], edn.loads('[0 010 -010 010N 07]'))
+		for text in ['08', '-09', '08N']:
+			self.assertRaises(ValueError, edn.loads, text)
+
+	def test_discards_and_comments(self):
+		self.assertEquals([1, 3], edn.loads('[1 #_ 2 #_ #_ [4] 5 3] ; the end'))
+		self.assertEquals(2, edn.loads('#_ 1 ; a comment\n 2'))
+
+	def test_deep_nesting(self):
+		value = edn.loads('[' * 5000 + ']' * 5000)
+		for i in range(4999):
+			value = value[0]
+		self.assertEquals([], value)
+
+	def test_errors(self):
+		for text in ['', '[1 2', '[1 2}', '1 2', '{:a}', '"abc', '#', '\\']:
+			self.assertRaises(ValueError, edn.loads, text)
+
+
+if __name__ == "__main__":
+	unittest.main()
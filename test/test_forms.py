@@ -0,0 +1,61 @@
+import unittest
+import doctest
+
+
+from pyjurer import forms
+from pyjurer.forms import split_forms, split_forms_incrementally
+
+
+class SplitFormsTests(unittest.TestCase):
+	"""Unit tests for splitting source into top-level forms"""
+
+	def test_doctests(self):
+		failed, attempted = doctest.testmod(forms)
+		self.assertEquals(0, failed)
+
+	def test_reader_macros_stay_with_their_form(self):
+		source = '''(def a \\( ) #{1 2} ^:private foo #inst "2020" @a
+			#_ (x) 'y `(~@z) #?(:clj 1) [\\space "q\\""] 42 ; trailing'''
+		self.assertEquals(
+			['(def a \\( )', '#{1 2}', '^:private foo', '#inst "2020"', '@a',
+			 '#_ (x)', "'y", '`(~@z)', '#?(:clj 1)', '[\\space "q\\""]', '42'],
+			list(split_forms(source)))
+
+	def test_unbalanced_input(self):
+		self.assertRaises(ValueError, list, split_forms('(defn f [x] (inc x)'))
+		self.assertRaises(ValueError, list, split_forms('(a))'))
+
+
+	def test_forms_split_at_any_chunk_boundary(self):
+		source = '''(def a \\( ) #{1 2} ^:private foo #inst "2020" ; note
+			#_ (x) 'y `(~@z) [\\space "q\\""] 42 symbol'''
+		chunks = [source[i:i + 1] for i in range(len(source))]
+		self.assertEquals(list(split_forms(source)), list(split_forms_incrementally(chunks)))
+
+	def test_forms_are_generated_as_they_complete(self):
+		read = []
+		def lines():
+			for line in ['(+ 1\n', '2) (f\n', ')\n', 'last']:
+				read.append(line)
+				yield line
+		forms = split_forms_incrementally(lines())
+		self.assertEquals('(+ 1\n2)', next(forms))
+		self.assertEquals(2, len(read))
+		self.assertEquals('(f\n)', next(forms))
+		self.assertEquals(3, len(read))
+		self.assertEquals(['last'], list(forms))
+
+	def test_incremental_errors(self):
+		read = []
+		def lines():
+			read.append(1)
+			yield '(a)) (b)\n'
+			read.append(2)
+			yield '(c)\n'
+		self.assertRaises(ValueError, list, split_forms_incrementally(lines()))
+		self.assertEquals([1], read)
+		self.assertRaises(ValueError, list, split_forms_incrementally(['(defn f\n', '[x]\n']))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+import itertools
+import threading
+import time
+import Queue
+
+
+from pyjurer.hedging import HedgedEvaluator, percentile
+from pyjurer.nrepl_session import NREPLSession
+from pyjurer.session_container import create_bcode_session_container, stop_bcode_session_container
+from standin_server import StandinNrepl
+
+
+class RecordingChannel(object):
+	"""Channel that only records what is submitted, the test answers"""
+
+	def __init__(self):
+		self.submitted = []
+
+	def _submit(self, data):
+		self.submitted.append(data)
+
+
+def wait_until(condition, timeout=5):
+	deadline = time.time() + timeout
+	while not condition():
+		if time.time() > deadline:
+			raise AssertionError('timed out waiting')
+		time.sleep(0.005)
+
+
+class HedgedEvaluatorTests(unittest.TestCase):
+	"""Unit tests for HedgedEvaluator, on sessions the test answers for"""
+
+	def setUp(self):
+		ids = (str(i) for i in itertools.count())
+		self.channels = [RecordingChannel(), RecordingChannel()]
+		self.sessions = [NREPLSession(c, str(i), ids) for i, c in enumerate(self.channels)]
+		self.calls = Queue.Queue()
+
+	def evaluator(self, **options):
+		options.setdefault('baselineFraction', 0)
+		return HedgedEvaluator(self.sessions, **options)
+
+	def eval(self, evaluator, idempotent=True):
+		return evaluator.eval('(f)', idempotent=idempotent,
+			value=lambda s, id_, v: self.calls.put((s, v)),
+			done=lambda s, id_: self.calls.put((s, 'done')))
+
+	def answer(self, session, id_, value):
+		session._receive_results({'id': id_, 'value': value})
+		session._receive_results({'id': id_, 'status': ['done']})
+
+	def test_the_hedge_wins_and_the_primary_is_cancelled(self):
+		evaluator = self.evaluator(initialDelay=0.01)
+		primary = self.eval(evaluator)
+		wait_until(lambda: len(self.channels[1].submitted) == 1)
+		hedge = self.channels[1].submitted[0]['id']
+		self.assertEquals('(f)', self.channels[1].submitted[0]['code'])
+
+		self.answer(self.sessions[1], hedge, 'fast')
+		self.assertEquals([(self.sessions[1], 'fast'), (self.sessions[1], 'done')],
+			[self.calls.get(True, 1), self.calls.get(True, 1)])
+		self.assertEquals(['eval', 'interrupt'], [d['op'] for d in self.channels[0].submitted])
+		self.assertEquals(primary, self.channels[0].submitted[1]['interrupt-id'])
+
+		# what the loser still sends is dropped
+		self.answer(self.sessions[0], primary, 'slow')
+		self.assertTrue(self.calls.empty())
+		self.assertFalse(primary in self.sessions[0]._callbacks._idCallbacks)
+
+		metrics = evaluator.metrics()
+		self.assertEquals((1, 1, 1.0), (metrics['hedged'], metrics['hedge_wins'], metrics['hedge_rate']))
+
+	def test_no_hedge_when_answered_within_the_delay(self):
+		evaluator = self.evaluator(initialDelay=0.05)
+		primary = self.eval(evaluator)
+		self.answer(self.sessions[0], primary, 'quick')
+		time.sleep(0.1)
+		self.assertEquals([], self.channels[1].submitted)
+		self.assertEquals(['eval'], [d['op'] for d in self.channels[0].submitted])
+		self.assertEquals(0, evaluator.metrics()['hedged'])
+
+	def test_evals_that_are_not_idempotent_are_not_hedged(self):
+		evaluator = self.evaluator(initialDelay=0.01)
+		self.eval(evaluator, idempotent=False)
+		time.sleep(0.05)
+		self.assertEquals([], self.channels[1].submitted)
+		self.assertEquals(0, evaluator.metrics()['requests'])
+
+	def test_pending_hedges_share_a_thread(self):
+		evaluator = self.evaluator(initialDelay=60)
+		self.eval(evaluator)
+		before = threading.active_count()
+		for i in range(50):
+			self.eval(evaluator)
+		self.assertEquals(before, threading.active_count())
+
+	def test_the_delay_follows_the_latencies(self):
+		evaluator = self.evaluator(initialDelay=1, minSamples=10, percentile=90)
+		for i in range(20):
+			id_ = self.eval(evaluator)
+			self.answer(self.sessions[i % 2], id_, 'v')
+		self.assertTrue(evaluator.delay() < 0.5)
+
+	def test_percentile(self):
+		self.assertEquals(None, percentile([], 99))
+		self.assertEquals(99, percentile(range(1, 101), 99))
+		self.assertEquals(50, percentile(range(100, 0, -1), 50))
+
+
+class HedgedServersTests(unittest.TestCase):
+	"""End-to-end tests of hedging from a stalled server to a healthy one"""
+
+	def test_stalled_server(self):
+		stalled = StandinNrepl(latency=0.5).start()
+		healthy = StandinNrepl().start()
+		containers = [create_bcode_session_container('tcp://{0}:{1}'.format(*s.address)) for s in (stalled, healthy)]
+		try:
+			created = Queue.Queue()
+			for container in containers:
+				container.create_new_session(created.put)
+			sessions = [created.get(True, 5) for container in containers]
+			sessions.sort(key=lambda s: s._channel is containers[1])
+
+			evaluator = HedgedEvaluator(sessions, initialDelay=0.02, baselineFraction=0)
+			values = Queue.Queue()
+			started = time.time()
+			evaluator.eval('(+ 1 2)', idempotent=True, value=lambda s, id_, v: values.put(v))
+			self.assertEquals('(+ 1 2)', values.get(True, 1))
+			self.assertTrue(time.time() - started < 0.4)
+			self.assertEquals(1, evaluator.metrics()['hedge_wins'])
+
+			# the stalled session was interrupted, and is free again
+			sessions[0].eval('(+ 3 4)', value=lambda s, id_, v: values.put(v))
+			self.assertEquals('(+ 3 4)', values.get(True, 5))
+		finally:
+			for container in containers:
+				stop_bcode_session_container(container)
+			stalled.stop()
+			healthy.stop()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import threading
+import time
+
+
+from pyjurer.channels import inproc
+
+
+class LoopbackChannelTests(unittest.TestCase):
+	"""Unit tests for the in-process channels"""
+
+	def setUp(self):
+		self.a, self.b = inproc.loopback_pair()
+		self.received = []
+		self.arrived = threading.Semaphore(0)
+		def received(data):
+			self.received.append(data)
+			self.arrived.release()
+		self.b.add_callback(received)
+
+	def tearDown(self):
+		self.a.stop()
+		self.b.stop()
+
+	def test_delivers_to_the_other_end(self):
+		self.a.start()
+		self.a.send('before start')
+		self.b.start()
+		self.a.send(['in ', 'parts'])
+		self.arrived.acquire()
+		self.arrived.acquire()
+		self.assertEquals(['before start', 'in parts'], self.received)
+
+	def test_stop_is_seen_as_an_empty_string(self):
+		self.b.start()
+		self.a.stop()
+		self.arrived.acquire()
+		self.assertEquals([''], self.received)
+		self.a.send('dropped')
+		self.assertEquals([''], self.received)
+
+	def test_stop_waits_at_most_timeout(self):
+		blocked = threading.Event()
+		self.a.add_callback(lambda data: blocked.wait(5))
+		self.a.start()
+		self.b.send('blocks the callback')
+		started = time.time()
+		self.a.stop(timeout=0.05)
+		blocked.set()
+		self.assertTrue(time.time() - started < 0.5)
+
+	def test_connect_to_a_name(self):
+		accepted = []
+		inproc.listen('test', accepted.append)
+		try:
+			self.assertRaises(ValueError, inproc.listen, 'test', accepted.append)
+			client = inproc.connect('test')
+			self.assertTrue(accepted[0]._peer is client)
+		finally:
+			inproc.unlisten('test')
+		self.assertRaises(ValueError, inproc.connect, 'test')
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,555 @@
+import unittest
+import itertools
+import logging
+import threading
+import time
+import StringIO
+
+
+from pyjurer import edn
+from pyjurer.scheduler import shared_scheduler
+from pyjurer.transports import bcode
+from pyjurer.nrepl_session import NREPLSession, InterruptStatus, StdinStream, FLIGHT_REPLAY_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class FakeListChannel(object):
+	"""Channel that responds with a list of responses that are passed in as ctor arg"""
+
+	def __init__(self, responses):
+		self._responses = list(responses)
+		self._responses.reverse()
+		self.session = None
+		self.submitted = []
+
+	def processResult(self):
+		if len(self._responses) == 0:
+			raise Exception('not enough data')
+
+		nextData = self._responses.pop()
+		logger.debug("FakeListChannel: nextData = {0}".format(nextData))
+		for d in nextData:
+			self.session._receive_results(d)
+
+	def _submit(self, data):
+		self.submitted.append(data)
+		self.processResult()
+
+
+class RecordingChannel(object):
+	"""Channel that only records what is submitted, the test answers"""
+
+	def __init__(self):
+		self.submitted = []
+
+	def _submit(self, data):
+		self.submitted.append(data)
+
+
+def wait_until(condition, timeout=5):
+	deadline = time.time() + timeout
+	while not condition():
+		if time.time() > deadline:
+			raise AssertionError('timed out waiting')
+		time.sleep(0.005)
+
+
+def make_session(responses, sessionId="1"):
+	channel = FakeListChannel(responses)
+	session = NREPLSession(channel, sessionId, (str(i) for i in itertools.count()))
+	channel.session = session
+	return channel, session
+
+
+class NREPLSessionTests(unittest.TestCase):
+	"""Unit tests for NREPLSession"""
+
+	def test_load_file(self):
+		channel, session = make_session([
+			[
+				{"id": "0", "value": "nil"},
+				{"id": "0", "status": ["done"]}
+			]])
+
+		def called(s, id_):
+			called.called = True
+		called.called = False
+
+		session.load_file("this is the contents", fileName="filename", filePath="filepath", done=called)
+
+		self.assertTrue(called.called)
+		self.assertEquals("this is the contents", channel.submitted[0]['file'])
+		self.assertEquals("filename", channel.submitted[0]['file-name'])
+		self.assertEquals("filepath", channel.submitted[0]['file-path'])
+
+	def test_happy_cases(self):
+		'''This tests that when a simple command is sent, it successfully 
+		receives the result and removes the callbacks when status 'done'
+		is received'''
+
+		channel, session = make_session([
+			[
+				{"value": "6", "id": "0"},
+				{"value": "7", "id": "0"},
+				{"status": ["done"], "id": "0"}
+			]])
+
+		responses = []
+		session.eval("(+ 3 4)", value=lambda s, id_, v: responses.append(v))
+
+		self.assertEquals(2, len(responses))
+		self.assertEquals("6", responses[0])
+		self.assertEquals("7", responses[1])
+		self.assertEquals(0, len(session._callbacks._idCallbacks))
+
+	def test_decode(self):
+		channel, session = make_session([
+			[
+				{"id": "0", "value": "{:a [1 2.5 nil]}"},
+				{"id": "0", "value": "#<unreadable>"},
+				{"id": "0", "status": ["done"]}
+			]])
+
+		values = []
+		session.eval("(f)", decode=True, value=lambda s, id_, v: values.append(v))
+
+		self.assertEquals([{edn.keyword('a'): [1, 2.5, None]}, "#<unreadable>"], values)
+
+	def test_cancel(self):
+		channel = RecordingChannel()
+		session = NREPLSession(channel, "1", (str(i) for i in itertools.count()))
+		values = []
+		id_ = session.eval("(slow)", value=lambda s, id_, v: values.append(v),
+			done=lambda s, id_: values.append('done'))
+
+		self.assertTrue(session.cancel(id_))
+		self.assertEquals({'op': 'interrupt', 'session': '1', 'id': '1', 'interrupt-id': id_}, channel.submitted[1])
+		session._receive_results({'id': id_, 'value': 'late'})
+		session._receive_results({'id': id_, 'status': ['interrupted', 'done']})
+
+		self.assertEquals([], values)
+		self.assertFalse(id_ in session._callbacks._idCallbacks)
+		self.assertFalse(session.cancel(id_))
+
+	def test_dispatch_order(self):
+		'''fields are dispatched before statuses, statuses in the order they
+		came in, and the request is forgotten before done is called'''
+
+		channel, session = make_session([
+			[
+				{"id": "0", "out": "x", "value": "nil", "status": ["eval-error", "done"]}
+			]])
+
+		calls = []
+		def done(s, id_):
+			calls.append(('done', id_ in session._callbacks._idCallbacks))
+		session.eval("(/ 1 0)",
+			value=lambda s, id_, v: calls.append(('value', v)),
+			stdout=lambda s, id_, out: calls.append(('out', out)),
+			error=lambda s, id_: calls.append(('error',)),
+			done=done)
+
+		self.assertEquals(set([('value', 'nil'), ('out', 'x')]), set(calls[:2]))
+		self.assertEquals([('error',), ('done', False)], calls[2:])
+
+	def test_stdin_stream_window(self):
+		'''a stream sends a window of chunks and then waits for need-input,
+		reading only a window ahead of what it sent'''
+
+		channel = RecordingChannel()
+		session = NREPLSession(channel, "1", (str(i) for i in itertools.count()))
+		read = []
+		def pieces():
+			for i in range(100):
+				read.append(i)
+				yield 'x' * 10
+		stream = StdinStream(pieces(), chunkSize=10, window=2)
+		id_ = session.eval('(slurp *in*)', stdin=stream)
+
+		def stdins():
+			return [d['stdin'] for d in channel.submitted if d['op'] == 'stdin']
+		wait_until(lambda: len(stdins()) == 2 and len(read) == 4)
+		time.sleep(0.05)
+		self.assertEquals(['x' * 10] * 2, stdins())
+		self.assertEquals(4, len(read))
+
+		session._receive_results({'id': id_, 'status': ['need-input']})
+		wait_until(lambda: len(stdins()) == 4)
+		session._receive_results({'id': id_, 'status': ['done']})
+		time.sleep(0.05)
+		self.assertEquals(4, len(stdins()))
+
+	def test_stdin_streams_stop_when_their_eval_is_gone(self):
+		channel = RecordingChannel()
+		session = NREPLSession(channel, "1", (str(i) for i in itertools.count()))
+		def pieces():
+			while True:
+				yield 'x'
+
+		cancelled = StdinStream(pieces(), chunkSize=1, window=1)
+		session.cancel(session.eval('(slurp *in*)', stdin=cancelled))
+		superseded = StdinStream(pieces(), chunkSize=1, window=1)
+		session.eval_latest('slot', '(slurp *in*)', stdin=superseded)
+		session.eval_latest('slot', '(+ 1 2)')
+		lost = StdinStream(pieces(), chunkSize=1, window=1)
+		session.eval('(slurp *in*)', stdin=lost)
+		session._connection_lost()
+
+		for stream in (cancelled, superseded, lost):
+			stream._thread.join(2)
+			self.assertFalse(stream._thread.is_alive())
+		self.assertEquals({}, session._streams)
+
+	def test_stdin_chunks_end_on_character_boundaries(self):
+		text = u'ab\u00e9cd\u20ac\U0001f600e\u00e9'.encode('utf8')
+		for source in (lambda: StringIO.StringIO(text), lambda: iter([text[:5], text[5:]])):
+			stream = StdinStream(source(), chunkSize=4)
+			chunks = []
+			while True:
+				chunk = stream._next_chunk()
+				if len(chunk) == 0:
+					break
+				chunks.append(chunk)
+				chunk.decode('utf8')
+				self.assertTrue(len(chunk) <= 4)
+			self.assertEquals(text, ''.join(chunks))
+
+	@unittest.skip('NREPLSession.clone is not implemented yet')
+	def test_clone(self):
+		'''this tests that a session can clone itself'''
+		channel, session = make_session([
+			[
+				{"id": '0', "session": "1", "new-session": "2"}
+			]])
+
+		def accept_clone(clonedSession):
+			self.assertEquals('2', clonedSession._sessionId)
+			accept_clone.called = True
+		accept_clone.called = False
+
+		session.clone(accept_clone)
+		self.assertTrue(accept_clone.called)
+
+	def test_interrupt(self):
+		channel, session = make_session([
+			[{"id": "0", "status": ["interrupted", "done"]}],
+			[{"id": "1", "status": ["session-idle", "done"]}],
+			[{"id": "2", "status": ["interrupt-id-mismatch", "done"]}]
+		], "2")
+
+		statusii = iter([InterruptStatus.INTERRUPTED, InterruptStatus.SESSION_IDLE, InterruptStatus.INTERRUPT_ID_MISMATCH])
+
+		def received(s, i):
+			self.assertEquals(statusii.next(), i)
+			received.called = received.called + 1
+		received.called = 0
+
+		session.interrupt(result=received)
+		session.interrupt(result=received)
+		session.interrupt(result=received)
+
+		self.assertEquals(3, received.called)
+		self.assertFalse('interrupt-id' in channel.submitted[0])
+
+	def test_interrupt_by_id(self):
+		channel, session = make_session([
+			[{"id": "0", "status": ["interrupted", "done"]}]
+		], "2")
+
+		session.interrupt(interrupt_id="17")
+
+		self.assertEquals("17", channel.submitted[0]['interrupt-id'])
+		self.assertEquals(0, len(session._callbacks._idCallbacks))
+
+	def test_closing(self):
+		'''This tests that when a close is requested the close callbock will get fired'''
+
+		channel, session = make_session([
+			[
+				{"value": "7", "id": "0"},
+				{"status": ["done"], "id": "0"}
+			],
+			[
+				{"status": ["session-closed", "done"], "id": "1"}
+			]
+		], "2")
+
+		def receivedValue(s, id_, data):
+			logger.debug("got data for request: {0}".format(data))
+			receivedValue.received = True
+		receivedValue.received = False
+
+		session.eval("(+ 3 4)", value=receivedValue)
+
+		def setClosed(s, id_):
+			logger.debug("Received session closed callback")
+			setClosed.closed = True
+		setClosed.closed = False
+		session.close(setClosed)
+
+		self.assertEquals(True, setClosed.closed)
+		self.assertEquals(True, receivedValue.received)
+
+
+class LazyResponseTests(unittest.TestCase):
+	"""Unit tests for responses decoded with bcode.lazy_bdecode"""
+
+	def test_callbacks_get_plain_dicts(self):
+		channel = RecordingChannel()
+		session = NREPLSession(channel, "1", (str(i) for i in itertools.count()))
+		described = []
+		id_ = session.describe(lambda s, result: described.append(result))
+		session._receive_results(bcode.lazy_bdecode(bcode.bencode({'id': id_,
+			'ops': {'eval': {'doc': 'x' * 1000}}, 'versions': {'nrepl': {'version-string': 'y' * 1000}}})))
+		session._receive_results({'id': id_, 'status': ['done']})
+
+		versions = described[0]['versions']
+		self.assertEquals(dict, type(versions))
+		self.assertEquals(dict, type(dict.__getitem__(versions, 'nrepl')))
+		self.assertEquals('y' * 1000, dict.__getitem__(dict.__getitem__(versions, 'nrepl'), 'version-string'))
+		self.assertEquals(['eval'], described[0]['ops'])
+
+
+class LatestWinsTests(unittest.TestCase):
+	"""Unit tests for NREPLSession.eval_latest"""
+
+	def setUp(self):
+		self.channel = RecordingChannel()
+		self.session = NREPLSession(self.channel, "1", (str(i) for i in itertools.count()))
+		self.values = []
+
+	def submit(self, code, debounce=None):
+		self.session.eval_latest('preview', code, debounce=debounce,
+			value=lambda s, id_, v: self.values.append(v))
+
+	def test_newer_submission_interrupts_the_one_in_flight(self):
+		self.submit('(slow 1)')
+		self.submit('(slow 2)')
+
+		self.assertEquals(['eval', 'interrupt', 'eval'], [d['op'] for d in self.channel.submitted])
+		self.assertEquals('0', self.channel.submitted[1]['interrupt-id'])
+
+		self.session._receive_results({'id': '0', 'value': 'stale'})
+		self.session._receive_results({'id': '0', 'status': ['interrupted', 'done']})
+		self.session._receive_results({'id': '1', 'status': ['interrupted', 'done']})
+		self.session._receive_results({'id': '2', 'value': 'fresh'})
+		self.session._receive_results({'id': '2', 'status': ['done']})
+
+		self.assertEquals(['fresh'], self.values)
+
+	def test_completed_requests_are_not_interrupted(self):
+		self.submit('(fast 1)')
+		self.session._receive_results({'id': '0', 'status': ['done']})
+		self.submit('(fast 2)')
+
+		self.assertEquals(['eval', 'eval'], [d['op'] for d in self.channel.submitted])
+
+	def test_a_stdin_source_is_streamed(self):
+		self.session.eval_latest('preview', '(slurp *in*)', stdin=StringIO.StringIO('input'))
+		wait_until(lambda: len(self.channel.submitted) == 3)
+		self.assertEquals([('eval', None), ('stdin', 'input'), ('stdin', '')],
+			[(d['op'], d.get('stdin')) for d in self.channel.submitted])
+
+	def test_debounced_submissions_are_dropped_before_sending(self):
+		self.submit('(a)', debounce=0.05)
+		self.submit('(b)', debounce=0.05)
+		self.submit('(c)', debounce=0.05)
+		self.assertEquals([], self.channel.submitted)
+
+		deadline = time.time() + 2
+		while not self.channel.submitted and time.time() < deadline:
+			time.sleep(0.01)
+		time.sleep(0.1)
+
+		self.assertEquals(['(c)'], [d['code'] for d in self.channel.submitted])
+
+	def test_a_slot_keeps_one_deadline(self):
+		scheduler = shared_scheduler()
+		before = len(scheduler)
+		for i in range(20):
+			self.submit('({0})'.format(i), debounce=0.05)
+		self.assertTrue(len(scheduler) <= before + 1)
+
+		wait_until(lambda: len(self.channel.submitted) == 1)
+		time.sleep(0.1)
+		self.assertEquals(['(19)'], [d['code'] for d in self.channel.submitted])
+
+	def test_an_undebounced_submission_drops_the_held_back_one(self):
+		self.submit('(a)', debounce=0.05)
+		self.submit('(b)')
+		time.sleep(0.1)
+		self.assertEquals(['(b)'], [d['code'] for d in self.channel.submitted])
+
+
+class SingleFlightTests(unittest.TestCase):
+	"""Unit tests for collapsing identical evals in flight into one"""
+
+	def setUp(self):
+		self.channel = RecordingChannel()
+		self.session = NREPLSession(self.channel, "1", (str(i) for i in itertools.count()))
+		self.calls = []
+
+	def submit(self, name, code='(config)', dedup=True):
+		return self.session.eval(code, dedup=dedup,
+			value=lambda s, id_, v: self.calls.append((name, v)),
+			stdout=lambda s, id_, out: self.calls.append((name, out)),
+			done=lambda s, id_: self.calls.append((name, 'done')))
+
+	def test_identical_evals_share_one_request(self):
+		first = self.submit('a')
+		self.session._receive_results({'id': first, 'out': 'building'})
+		second = self.submit('b')
+		self.submit('c', dedup='other key')
+		self.submit('d', code='(other)')
+
+		self.assertEquals(first, second)
+		self.assertEquals(['(config)', '(config)', '(other)'], [d['code'] for d in self.channel.submitted])
+		self.session._receive_results({'id': first, 'value': '{:a 1}'})
+		self.session._receive_results({'id': first, 'status': ['done']})
+
+		self.assertEquals([('a', 'building'), ('b', 'building'), ('a', '{:a 1}'), ('b', '{:a 1}'),
+			('a', 'done'), ('b', 'done')], self.calls)
+
+	def test_a_new_flight_after_done(self):
+		first = self.submit('a')
+		self.session._receive_results({'id': first, 'status': ['done']})
+		second = self.submit('b')
+		self.assertNotEquals(first, second)
+		self.assertEquals(2, len(self.channel.submitted))
+		self.session._receive_results({'id': second, 'status': ['done']})
+		self.assertEquals({}, self.session._flights)
+
+	def test_concurrent_waiters_see_every_event_once_in_order(self):
+		first = self.submit('first')
+		threads = [threading.Thread(target=self.submit, args=(i,)) for i in range(20)]
+		for thread in threads:
+			thread.start()
+		for i in range(50):
+			self.session._receive_results({'id': first, 'out': str(i)})
+		for thread in threads:
+			thread.join()
+		self.session._receive_results({'id': first, 'status': ['done']})
+
+		self.assertEquals(1, len(self.channel.submitted))
+		for name in ['first'] + range(20):
+			self.assertEquals([str(i) for i in range(50)] + ['done'], [v for n, v in self.calls if n == name])
+
+	def test_a_new_flight_after_cancel(self):
+		first = self.submit('a')
+		self.assertTrue(self.session.cancel(first))
+		self.session._receive_results({'id': first, 'status': ['done']})
+		second = self.submit('b')
+		self.assertNotEquals(first, second)
+		self.assertEquals(['(config)', '(config)'],
+			[d['code'] for d in self.channel.submitted if d['op'] == 'eval'])
+		self.session._receive_results({'id': second, 'value': '1'})
+		self.session._receive_results({'id': second, 'status': ['done']})
+		self.assertEquals([('b', '1'), ('b', 'done')], self.calls)
+		self.assertEquals({}, self.session._flights)
+		self.assertEquals({}, self.session._flightsById)
+
+	def test_a_new_flight_after_the_connection_is_lost(self):
+		first = self.submit('a')
+		self.session._connection_lost()
+		self.assertNotEquals(first, self.submit('b'))
+
+	def test_leave(self):
+		done = lambda s, id_: self.calls.append(('left', 'done'))
+		first = self.session.eval('(config)', dedup=True, done=done)
+		self.submit('b')
+		self.assertTrue(self.session.leave(first, done))
+		self.session._receive_results({'id': first, 'status': ['done']})
+		self.assertEquals([('b', 'done')], self.calls)
+
+		# the request is cancelled once the last one leaves
+		second = self.session.eval('(config)', dedup=True, done=done)
+		self.assertTrue(self.session.leave(second, done))
+		self.assertEquals(second, self.channel.submitted[-1]['interrupt-id'])
+		self.assertFalse(self.session.leave(second, done))
+
+	def test_late_joiners_once_the_output_is_too_large_to_replay(self):
+		first = self.submit('a')
+		self.session._receive_results({'id': first, 'out': 'x' * (FLIGHT_REPLAY_BYTES + 1)})
+		second = self.submit('b')
+		self.assertNotEquals(first, second)
+		self.assertEquals(2, len(self.channel.submitted))
+
+
+class CoalescingTests(unittest.TestCase):
+	"""Unit tests for merging the out and err fragments of a request"""
+
+	def setUp(self):
+		self.channel = RecordingChannel()
+		self.session = NREPLSession(self.channel, "1", (str(i) for i in itertools.count()))
+		self.calls = []
+
+	def callback(self, name):
+		return lambda s, id_, v: self.calls.append((name, v))
+
+	def receive(self, id_, **fields):
+		fields['id'] = id_
+		self.session._receive_results(fields)
+
+	def test_fragments_are_flushed_in_order(self):
+		id_ = self.session.eval("(f)", coalesce=(1024, None),
+			stdout=self.callback('out'), stderr=self.callback('err'),
+			value=self.callback('value'), done=lambda s, id_: self.calls.append(('done', None)))
+
+		for i in range(100):
+			self.receive(id_, out='a')
+		self.receive(id_, err='x')
+		self.receive(id_, err='y')
+		self.receive(id_, out='b')
+		self.receive(id_, value='nil')
+		self.receive(id_, out='c')
+		self.assertEquals([('out', 'a' * 100), ('err', 'xy'), ('out', 'b'), ('value', 'nil')], self.calls)
+
+		self.receive(id_, status=['done'])
+		self.assertEquals([('out', 'c'), ('done', None)], self.calls[4:])
+
+	def test_flushes_at_the_byte_threshold(self):
+		id_ = self.session.load_file("(f)", coalesce=(10, None), stdout=self.callback('out'))
+		for i in range(25):
+			self.receive(id_, out='a')
+		self.assertEquals([('out', 'a' * 10), ('out', 'a' * 10)], self.calls)
+		self.receive(id_, status=['done'])
+		self.assertEquals(('out', 'a' * 5), self.calls[-1])
+
+	def test_flushes_after_the_interval(self):
+		id_ = self.session.eval("(f)", coalesce=(1024, 0.01), stdout=self.callback('out'))
+		self.receive(id_, out='a')
+		self.receive(id_, out='b')
+		deadline = time.time() + 2
+		while len(self.calls) == 0 and time.time() < deadline:
+			time.sleep(0.005)
+		self.assertEquals([('out', 'ab')], self.calls)
+
+	def test_timed_flushes_share_a_thread(self):
+		before = threading.active_count()
+		for i in range(50):
+			id_ = self.session.eval("(f)", coalesce=(1024, 60), stdout=self.callback('out'))
+			self.receive(id_, out='a')
+		# the scheduler of the process may be started by this test
+		self.assertTrue(threading.active_count() <= before + 1)
+
+	def test_a_timed_flush_waits_for_the_other_callbacks(self):
+		entered = threading.Event()
+		def value(s, id_, v):
+			self.calls.append(('value', v))
+			entered.set()
+			time.sleep(0.1)
+			self.calls.append(('value returned', v))
+		id_ = self.session.eval("(f)", coalesce=(1024, 0.01), stdout=self.callback('out'), value=value)
+
+		thread = threading.Thread(target=self.receive, args=(id_,), kwargs={'value': 'nil'})
+		thread.start()
+		entered.wait(2)
+		self.receive(id_, out='a')
+		thread.join()
+		wait_until(lambda: len(self.calls) == 3)
+		self.assertEquals([('value', 'nil'), ('value returned', 'nil'), ('out', 'a')], self.calls)
+
+
+if __name__ == "__main__":
+	unittest.main()
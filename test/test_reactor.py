@@ -0,0 +1,151 @@
+import unittest
+import socket
+import struct
+import threading
+import time
+import Queue
+
+
+from pyjurer.channels.reactor import Reactor, _SelectPoller
+from pyjurer.session_container import create_bcode_session_container, stop_bcode_session_container
+from standin_server import StandinNrepl
+
+
+class Collector(object):
+	"""gathers what is read from a connection until expected bytes came in"""
+
+	def __init__(self, expected):
+		self.expected = expected
+		self.chunks = []
+		self.size = 0
+		self.complete = threading.Event()
+
+	def __call__(self, chunk):
+		self.chunks.append(chunk)
+		self.size += len(chunk)
+		if self.size >= self.expected:
+			self.complete.set()
+
+
+class ReactorTests(unittest.TestCase):
+	"""Unit tests for Reactor, on socket pairs"""
+
+	def setUp(self):
+		self.reactor = Reactor()
+
+	def tearDown(self):
+		self.reactor.close()
+
+	def test_large_writes_in_order(self):
+		client, server = socket.socketpair()
+		parts = ['{0:08}'.format(i) * 4096 for i in range(64)]
+		received = Collector(sum(len(p) for p in parts))
+		serverConnection = self.reactor.register(server, received)
+		clientConnection = self.reactor.register(client, lambda chunk: None)
+
+		self.reactor.send(clientConnection, parts[:32])
+		for part in parts[32:]:
+			self.reactor.send(clientConnection, part)
+
+		self.assertTrue(received.complete.wait(10))
+		self.assertEquals(''.join(parts), ''.join(received.chunks))
+		self.reactor.unregister(clientConnection)
+		self.reactor.unregister(serverConnection)
+
+	def test_threads_stay_flat(self):
+		before = threading.active_count()
+		pairs = [socket.socketpair() for i in range(50)]
+		connections = []
+		collectors = []
+		for client, server in pairs:
+			collector = Collector(5)
+			collectors.append(collector)
+			connections.append(self.reactor.register(server, collector))
+			connections.append(self.reactor.register(client, lambda chunk: None))
+
+		for connection in connections[1::2]:
+			self.reactor.send(connection, 'hello')
+		for collector in collectors:
+			self.assertTrue(collector.complete.wait(5))
+			self.assertEquals('hello', ''.join(collector.chunks))
+
+		self.assertEquals(before, threading.active_count())
+		for connection in connections:
+			self.reactor.unregister(connection)
+
+	def test_unregister_flushes(self):
+		client, server = socket.socketpair()
+		received = Collector(3 * 65536)
+		serverConnection = self.reactor.register(server, received)
+		clientConnection = self.reactor.register(client, lambda chunk: None)
+		self.reactor.send(clientConnection, 'x' * (3 * 65536))
+		self.reactor.unregister(clientConnection)
+		self.assertTrue(received.complete.wait(5))
+		self.reactor.unregister(serverConnection)
+
+	def test_reset_while_writing(self):
+		listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		listener.bind(('127.0.0.1', 0))
+		listener.listen(1)
+		client = socket.create_connection(listener.getsockname())
+		server, address = listener.accept()
+		listener.close()
+
+		lost = threading.Event()
+		def callback(chunk):
+			if chunk == '':
+				lost.set()
+		connection = self.reactor.register(client, callback)
+		# more than the socket buffers take, so the rest waits for the peer
+		self.reactor.send(connection, 'x' * (16 * 1024 * 1024))
+		for i in range(500):
+			if connection.writing:
+				break
+			time.sleep(0.01)
+		self.assertTrue(connection.writing)
+
+		server.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+		server.close()
+		self.assertTrue(lost.wait(5))
+		self.reactor.unregister(connection, timeout=1)
+
+	def test_select_poller(self):
+		client, server = socket.socketpair()
+		poller = _SelectPoller()
+		poller.register(server.fileno())
+		poller.register(client.fileno(), True)
+		self.assertEquals([(client.fileno(), False, True)], poller.poll())
+		client.send('x')
+		poller.modify(client.fileno(), False)
+		self.assertEquals([(server.fileno(), True, False)], poller.poll())
+		client.close()
+		server.close()
+
+
+class ReactorSessionTests(unittest.TestCase):
+	"""End-to-end tests of containers whose sockets are served by one reactor"""
+
+	def setUp(self):
+		self.server = StandinNrepl(value_size=1024 * 1024).start()
+		self.reactor = Reactor()
+
+	def tearDown(self):
+		self.reactor.close()
+		self.server.stop()
+
+	def test_many_containers(self):
+		uri = 'tcp://{0}:{1}'.format(*self.server.address)
+		containers = [create_bcode_session_container(uri, reactor=self.reactor) for i in range(8)]
+		try:
+			created = Queue.Queue()
+			for container in containers:
+				container.create_new_session(created.put)
+			sessions = [created.get(True, 5) for container in containers]
+
+			values = Queue.Queue()
+			for session in sessions:
+				session.eval('(+ 1 2)', value=lambda s, id_, v: values.put(len(v)))
+			self.assertEquals([1024 * 1024] * len(sessions), [values.get(True, 5) for session in sessions])
+		finally:
+			for container in containers:
+				stop_bcode_session_container(container)
@@ -0,0 +1,96 @@
+import unittest
+import os
+import socket
+import tempfile
+
+
+from pyjurer.channels.recording import RecordingChannel, ReplayChannel, read_recording, SENT, RECEIVED
+
+
+class FakeChannel:
+	"""Channel that keeps what is sent and lets the test play the nrepl"""
+
+	def __init__(self):
+		self.sent = []
+		self.callbacks = []
+		self.started = False
+
+	def add_callback(self, callback):
+		self.callbacks.append(callback)
+
+	def receive(self, data):
+		for cb in self.callbacks:
+			cb(data)
+
+	def start(self):
+		self.started = True
+
+	def stop(self, flush=True, timeout=None):
+		self.started = False
+
+	def send(self, data, session=None):
+		self.sent.append(data)
+
+
+class RecordingTests(unittest.TestCase):
+	"""Unit tests for recording and replaying channel traffic"""
+
+	def setUp(self):
+		fd, self.path = tempfile.mkstemp()
+		os.close(fd)
+		os.remove(self.path)
+
+	def tearDown(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+	def record(self):
+		inner = FakeChannel()
+		channel = RecordingChannel(inner, self.path)
+		received = []
+		channel.add_callback(received.append)
+
+		channel.start()
+		channel.send('d2:op5:clonee')
+		inner.receive('d11:new-session')
+		inner.receive('1:1e')
+		channel.stop()
+
+		self.assertEquals(['d2:op5:clonee'], inner.sent)
+		self.assertEquals(['d11:new-session', '1:1e'], received)
+
+	def test_records_chunks_in_order(self):
+		self.record()
+
+		chunks = [(d, c) for d, seconds, c in read_recording(self.path)]
+		self.assertEquals([(SENT, 'd2:op5:clonee'), (RECEIVED, 'd11:new-session'), (RECEIVED, '1:1e')], chunks)
+
+	def test_closed_when_the_channel_fails_to_start(self):
+		inner = FakeChannel()
+		def refuse():
+			raise socket.error('refused')
+		inner.start = refuse
+		channel = RecordingChannel(inner, self.path)
+		self.assertRaises(socket.error, channel.start)
+		self.assertEquals(None, channel._file)
+
+	def test_recordings_are_appended_to(self):
+		self.record()
+		self.record()
+
+		self.assertEquals(6, len(list(read_recording(self.path))))
+
+	def test_replay_delivers_the_received_chunks(self):
+		self.record()
+
+		replayed = []
+		replay = ReplayChannel(self.path, realtime=False, dataReceivedCallback=replayed.append)
+		replay.start()
+		self.assertTrue(replay.finished.wait(5))
+		replay.stop()
+
+		self.assertEquals(['d11:new-session', '1:1e'], replayed)
+
+
+if __name__ == "__main__":
+	unittest.main()
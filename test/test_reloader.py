@@ -0,0 +1,160 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import Queue
+
+
+from pyjurer import reloader
+from pyjurer.reloader import NamespaceGraph, Reloader, create_reloader
+from pyjurer.session_container import create_bcode_session_container, stop_bcode_session_container
+from standin_server import StandinNrepl
+
+
+class FakeSession(object):
+	"""records the files loaded into it, and fails the namespaces in failing"""
+
+	def __init__(self, failing=()):
+		self.loaded = []
+		self.failing = failing
+
+	def load_file_path(self, path, filePath=None, error=None, stderr=None, done=None):
+		with open(path) as f:
+			contents = f.read()
+		self.loaded.append(filePath)
+		if any(ns in contents for ns in self.failing):
+			stderr(self, '1', 'CompilerException')
+			error(self, '1')
+		done(self, '1')
+
+
+class SourceTree(object):
+	"""writes namespaces into a temporary source directory"""
+
+	def __init__(self):
+		self.root = tempfile.mkdtemp()
+
+	def path(self, ns):
+		return os.path.join(self.root, *ns.split('.')) + '.clj'
+
+	def write(self, ns, *requires):
+		path = self.path(ns)
+		if not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		with open(path, 'w') as f:
+			f.write('(ns {0}\n  (:require {1}))\n(def x 1)\n'.format(ns, ' '.join('[{0}]'.format(r) for r in requires)))
+		return path
+
+	def remove(self):
+		shutil.rmtree(self.root)
+
+
+class NamespaceGraphTests(unittest.TestCase):
+	"""Unit tests for working out what to reload"""
+
+	def setUp(self):
+		self.tree = SourceTree()
+		self.graph = NamespaceGraph()
+		self.tree.write('app.util')
+		self.tree.write('app.db', 'app.util')
+		self.tree.write('app.api', 'app.db', 'app.util', 'clojure.string')
+		self.tree.write('app.other')
+		self.graph.affected(reloader._sources_under(self.tree.root, reloader.SOURCE_EXTENSIONS))
+
+	def tearDown(self):
+		self.tree.remove()
+
+	def affected(self, *namespaces, **options):
+		return [ns for ns, path in self.graph.affected([self.tree.path(n) for n in namespaces], **options)]
+
+	def test_dependents_are_reloaded_after_what_they_require(self):
+		self.assertEquals(['app.util', 'app.db', 'app.api'], self.affected('app.util'))
+		self.assertEquals(['app.db', 'app.api'], self.affected('app.db'))
+		self.assertEquals(['app.other'], self.affected('app.other'))
+		self.assertEquals(['app.db'], self.affected('app.db', dependents=False))
+
+	def test_changed_requires_are_followed(self):
+		self.tree.write('app.other', 'app.api')
+		self.assertEquals(['app.other'], self.affected('app.other'))
+		self.assertEquals(['app.db', 'app.api', 'app.other'], self.affected('app.db'))
+
+	def test_removed_files(self):
+		os.remove(self.tree.path('app.db'))
+		self.assertEquals(['app.api'], self.affected('app.db'))
+		shutil.rmtree(os.path.join(self.tree.root, 'app'))
+		self.assertEquals([], self.graph.affected([os.path.join(self.tree.root, 'app')]))
+
+	def test_cycles_are_still_reloaded(self):
+		self.tree.write('app.util', 'app.api')
+		self.assertEquals(set(['app.util', 'app.db', 'app.api']), set(self.affected('app.util')))
+
+
+class ReloaderTests(unittest.TestCase):
+	"""Tests of reloading changed files, with inotify and by polling"""
+
+	def setUp(self):
+		self.tree = SourceTree()
+		for i in range(20):
+			self.tree.write('app.ns{0}'.format(i))
+		self.tree.write('app.core', *['app.ns{0}'.format(i) for i in range(20)])
+		self.reports = Queue.Queue()
+
+	def tearDown(self):
+		self.tree.remove()
+
+	def check_reloads(self, polling):
+		session = FakeSession(failing=['deep.broken'])
+		watcher = Reloader(session, [self.tree.root], reloaded=self.reports.put,
+			polling=polling, pollInterval=0.02, quiet=0.1).start()
+		try:
+			self.tree.write('app.ns3')
+			report = self.reports.get(True, 5)
+			self.assertEquals(['app.ns3', 'app.core'], report.namespaces)
+			self.assertEquals(['app/ns3.clj', 'app/core.clj'], session.loaded)
+			self.assertTrue(0 <= report.reload_time <= report.latency < 5)
+
+			# a burst is reloaded at once, each namespace once
+			for i in range(20):
+				self.tree.write('app.ns{0}'.format(i))
+			report = self.reports.get(True, 5)
+			self.assertEquals(21, len(report.namespaces))
+			self.assertEquals('app.core', report.namespaces[-1])
+
+			# new directories are watched
+			self.tree.write('app.nested.deep.broken')
+			report = self.reports.get(True, 5)
+			self.assertEquals(['app.nested.deep.broken'], report.failed)
+			self.assertEquals({'app.nested.deep.broken': 'CompilerException'}, report.errors)
+			self.tree.write('app.nested.deep.fine')
+			self.assertEquals(['app.nested.deep.fine'], self.reports.get(True, 5).namespaces)
+			self.assertTrue(self.reports.empty())
+		finally:
+			started = time.time()
+			watcher.stop()
+			self.assertTrue(time.time() - started < 1)
+
+	@unittest.skipIf(reloader._libc is None, 'there is no inotify')
+	def test_inotify(self):
+		self.check_reloads(False)
+
+	def test_polling(self):
+		self.check_reloads(True)
+
+	def test_create_reloader(self):
+		server = StandinNrepl().start()
+		container = create_bcode_session_container('tcp://{0}:{1}'.format(*server.address))
+		try:
+			watcher = create_reloader(container, [self.tree.root], reloaded=self.reports.put)
+			self.tree.write('app.core')
+			report = self.reports.get(True, 5)
+			watcher.stop()
+			self.assertEquals(['app.core'], report.namespaces)
+			self.assertEquals([], report.failed)
+		finally:
+			stop_bcode_session_container(container)
+			server.stop()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import logging
+import threading
+import time
+
+
+from pyjurer.scheduler import Scheduler, COMPACT_CANCELLED
+
+# a failing call is logged, which a test does on purpose
+logging.getLogger('pyjurer').addHandler(logging.NullHandler())
+
+class SchedulerTests(unittest.TestCase):
+	"""Unit tests for Scheduler"""
+
+	def setUp(self):
+		self.scheduler = Scheduler()
+
+	def tearDown(self):
+		self.scheduler.close()
+
+	def test_calls_in_deadline_order(self):
+		made = []
+		finished = threading.Event()
+		self.scheduler.call_later(0.06, made.append, 'c')
+		self.scheduler.call_later(0.02, made.append, 'a')
+		self.scheduler.call_later(0.04, made.append, 'b')
+		self.scheduler.call_later(0.08, finished.set)
+		self.assertTrue(finished.wait(2))
+		self.assertEquals(['a', 'b', 'c'], made)
+		self.assertEquals(0, len(self.scheduler))
+
+	def test_cancelled_calls_are_not_made(self):
+		made = []
+		finished = threading.Event()
+		call = self.scheduler.call_later(0.01, made.append, 'cancelled')
+		self.scheduler.call_later(0.02, made.append, 'made')
+		self.scheduler.call_later(0.03, finished.set)
+		call.cancel()
+		call.cancel()
+		self.assertTrue(finished.wait(2))
+		self.assertEquals(['made'], made)
+
+	def test_cancelled_calls_do_not_pile_up(self):
+		for i in range(COMPACT_CANCELLED * 4):
+			self.scheduler.call_later(60, lambda: None).cancel()
+		self.assertTrue(len(self.scheduler._heap) < COMPACT_CANCELLED)
+		self.assertEquals(0, len(self.scheduler))
+
+	def test_a_failing_call_does_not_stop_the_others(self):
+		finished = threading.Event()
+		self.scheduler.call_later(0, lambda: 1 / 0)
+		self.scheduler.call_later(0.01, finished.set)
+		self.assertTrue(finished.wait(2))
+
+	def test_one_thread_for_every_call(self):
+		before = threading.active_count()
+		calls = [self.scheduler.call_later(60, lambda: None) for i in range(100)]
+		self.assertEquals(before, threading.active_count())
+		for call in calls:
+			call.cancel()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,8 +1,41 @@
 import unittest
 import doctest
+import socket
+import subprocess
+import sys
+import threading
+import time
+import Queue
 
 
-from pyjurer.session_container import SessionContainer
+from pyjurer import session_container
+from pyjurer.session_container import SessionContainer, IdAllocator, create_bcode_session_containers
+from standin_server import StandinNrepl
+
+
+class EchoResponder(object):
+	"""answers every request on its own thread, the way the tcp channel's
+	callback thread delivers responses, with the eval's code as its value"""
+
+	def __init__(self):
+		self.container = None
+		self._queue = Queue.Queue()
+		thread = threading.Thread(target=self._run)
+		thread.daemon = True
+		thread.start()
+
+	def send(self, data):
+		self._queue.put(data)
+
+	def _run(self):
+		while True:
+			data = self._queue.get()
+			id_ = data['id']
+			if data['op'] == 'clone':
+				self.container._accept_data({'id': id_, 'session': '', 'new-session': 's1'})
+			else:
+				self.container._accept_data({'id': id_, 'session': 's1', 'value': data['code']})
+				self.container._accept_data({'id': id_, 'session': 's1', 'status': ['done']})
 
 
 class Test(unittest.TestCase):
@@ -10,7 +43,134 @@ class Test(unittest.TestCase):
 
 	def test_doctests(self):
 		"""run doctests on SessionContainer"""
-		doctest.testmod(SessionContainer)
+		failed, attempted = doctest.testmod(session_container)
+		self.assertEquals(0, failed)
+
+	def test_import_is_lazy(self):
+		"""importing the container does not drag in test scaffolding or the tcp channel"""
+		script = ("import sys, pyjurer.session_container; "
+			"print ' '.join(m for m in ('unittest', 'pyjurer.channels.tcp', "
+			"'pyjurer.transports.bcode_transport') if m in sys.modules)")
+		loaded = subprocess.check_output([sys.executable, '-c', script]).strip()
+		self.assertEquals('', loaded)
+
+
+	def test_id_allocator_is_unique_across_threads(self):
+		ids = IdAllocator()
+		drawn = []
+		def draw():
+			drawn.extend([ids.next() for i in range(1000)])
+		threads = [threading.Thread(target=draw) for i in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEquals(8000, len(set(drawn)))
+
+	def test_concurrent_submission(self):
+		"""evals submitted from 32 threads all get their own responses"""
+		responder = EchoResponder()
+		container = SessionContainer(responder.send)
+		responder.container = container
+
+		ready = threading.Event()
+		def new_session(s):
+			new_session.session = s
+			ready.set()
+		container.create_new_session(new_session)
+		self.assertTrue(ready.wait(5))
+		session = new_session.session
+
+		finished = Queue.Queue()
+		misrouted = []
+		def submitter(t):
+			for i in range(50):
+				code = '(+ {0} {1})'.format(t, i)
+				def value(s, id_, v, code=code):
+					if v != code:
+						misrouted.append(v)
+				session.eval(code, value=value, done=lambda s, id_: finished.put(id_))
+
+		threads = [threading.Thread(target=submitter, args=(t,)) for t in range(32)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		for i in range(32 * 50):
+			try:
+				finished.get(True, 5)
+			except Queue.Empty:
+				self.fail('only {0} of {1} evals were done'.format(i, 32 * 50))
+
+		self.assertEquals([], misrouted)
+		self.assertEquals(0, len(session._callbacks._idCallbacks))
+
+
+class ParallelConnectTests(unittest.TestCase):
+	"""Tests of opening containers on several nrepls at once"""
+
+	def setUp(self):
+		self.servers = [StandinNrepl().start() for i in range(4)]
+		self.uris = ['tcp://{0}:{1}'.format(*s.address) for s in self.servers]
+
+	def tearDown(self):
+		for server in self.servers:
+			server.stop()
+
+	def test_containers_in_order(self):
+		started = time.time()
+		containers = create_bcode_session_containers(self.uris)
+		elapsed = time.time() - started
+		try:
+			self.assertEquals(4, len(containers))
+			self.assertTrue(elapsed < 1, 'connecting took {0:.3f} s'.format(elapsed))
+			for container, server in zip(containers, self.servers):
+				channel = session_container.tcp_sessions[container]
+				self.assertEquals(server.address, channel._socket.getpeername())
+		finally:
+			started = time.time()
+			for container in containers:
+				session_container.stop_bcode_session_container(container)
+			elapsed = time.time() - started
+		self.assertTrue(elapsed < 0.1, 'stopping took {0:.3f} s'.format(elapsed))
+
+	def test_stop_without_flushing(self):
+		container = session_container.create_bcode_session_container(self.uris[0])
+		started = time.time()
+		session_container.stop_bcode_session_container(container, flush=False, timeout=0.01)
+		self.assertTrue(time.time() - started < 0.05)
+		self.assertFalse(container in session_container.tcp_sessions)
+
+	def test_a_channel_that_fails_to_start_is_stopped(self):
+		class FailingChannel(object):
+			stopped = None
+			def add_callback(self, callback):
+				pass
+			def start(self):
+				raise socket.error('refused')
+			def stop(self, flush=True, timeout=None):
+				self.stopped = (flush, timeout)
+			def send(self, data, session=None):
+				pass
+
+		channel = FailingChannel()
+		opened = len(session_container.tcp_sessions)
+		self.assertRaises(socket.error, session_container._create_bcode_session_container,
+			channel, None, None, None, False)
+		self.assertEquals((False, 0), channel.stopped)
+		self.assertEquals(opened, len(session_container.tcp_sessions))
+
+	def test_a_failed_connect_stops_the_others(self):
+		# a port nothing listens on any more
+		closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		closed.bind(('127.0.0.1', 0))
+		port = closed.getsockname()[1]
+		closed.close()
+
+		opened = len(session_container.tcp_sessions)
+		self.assertRaises(socket.error, create_bcode_session_containers,
+			self.uris + ['tcp://127.0.0.1:{0}'.format(port)], connectTimeout=1)
+		self.assertEquals(opened, len(session_container.tcp_sessions))
 
 
 if __name__ == "__main__":
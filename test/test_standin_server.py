@@ -0,0 +1,168 @@
+import unittest
+import threading
+import os
+import tempfile
+import hashlib
+
+
+from pyjurer.nrepl_session import InterruptStatus, StdinStream
+from pyjurer.session_container import create_bcode_over_tcp_session_container, stop_bcode_over_tcp_session_container, \
+	create_bcode_session_container
+from standin_server import StandinNrepl
+
+
+class StandinServerTests(unittest.TestCase):
+	"""End-to-end tests of the client against the stand-in nrepl on localhost"""
+
+	def setUp(self):
+		self.server = StandinNrepl(latency=0.0).start()
+		self.container = create_bcode_over_tcp_session_container(*self.server.address)
+		self.session = self.new_session()
+
+	def tearDown(self):
+		stop_bcode_over_tcp_session_container(self.container)
+		self.server.stop()
+
+	def new_session(self):
+		ready = threading.Event()
+		def new_session(s):
+			new_session.session = s
+			ready.set()
+		self.container.create_new_session(new_session)
+		self.assertTrue(ready.wait(5))
+		return new_session.session
+
+	def test_eval(self):
+		done = threading.Event()
+		values = []
+		self.session.eval('(+ 1 2)', value=lambda s, id_, v: values.append(v),
+			done=lambda s, id_: done.set())
+		self.assertTrue(done.wait(5))
+		self.assertEquals(['(+ 1 2)'], values)
+
+	def test_eval_reads_stdin(self):
+		done = threading.Event()
+		values = []
+		self.session.eval('(read-line)', value=lambda s, id_, v: values.append(v),
+			stdin=lambda s, id_: s.stdin('hey man\n'),
+			done=lambda s, id_: done.set())
+		self.assertTrue(done.wait(5))
+		self.assertEquals(['"hey man"'], values)
+
+	def slurp(self, stdin):
+		done = threading.Event()
+		values = []
+		self.session.eval('(slurp *in*)', value=lambda s, id_, v: values.append(v),
+			stdin=stdin, done=lambda s, id_: done.set())
+		self.assertTrue(done.wait(10))
+		return values
+
+	def test_eval_streams_a_file_to_stdin(self):
+		contents = ''.join('{0},row,{1}\n'.format(i, i * 7) for i in range(100000))
+		with tempfile.TemporaryFile() as f:
+			f.write(contents)
+			f.seek(0)
+			values = self.slurp(StdinStream(f, chunkSize=16384, window=2))
+		self.assertEquals(['[{0} "{1}"]'.format(len(contents), hashlib.md5(contents).hexdigest())], values)
+
+	def test_eval_streams_an_iterator_to_stdin(self):
+		lines = ['line {0}\n'.format(i) for i in range(20000)]
+		contents = ''.join(lines)
+		values = self.slurp(iter(lines))
+		self.assertEquals(['[{0} "{1}"]'.format(len(contents), hashlib.md5(contents).hexdigest())], values)
+		self.assertEquals(['[0 "{0}"]'.format(hashlib.md5('').hexdigest())], self.slurp([]))
+
+	def test_interrupt(self):
+		self.server.latency = 5
+		evalDone = threading.Event()
+		results = []
+		id_ = self.session.eval('(Thread/sleep 5000)', done=lambda s, id_: evalDone.set())
+
+		def interrupt():
+			self.session.interrupt(interrupt_id=id_, result=lambda s, r: results.append(r))
+			if not evalDone.wait(0.1):
+				interrupt()
+		interrupt()
+
+		self.assertTrue(evalDone.wait(5))
+		self.assertTrue(InterruptStatus.INTERRUPTED in results)
+
+	def test_load_file_path(self):
+		self.server.fragment = 1000
+		fd, path = tempfile.mkstemp(suffix='.clj')
+		os.write(fd, '(ns big)\n' + '(def x 1)\n' * 100000)
+		os.close(fd)
+		try:
+			done = threading.Event()
+			values = []
+			self.session.load_file_path(path, value=lambda s, id_, v: values.append(v),
+				done=lambda s, id_: done.set())
+			self.assertTrue(done.wait(10))
+			self.assertEquals([str(os.path.getsize(path))], values)
+		finally:
+			os.remove(path)
+
+	def test_describe_and_close(self):
+		described = threading.Event()
+		def on_described(s, result):
+			on_described.ops = result['ops']
+			described.set()
+		self.session.describe(on_described)
+		self.assertTrue(described.wait(5))
+		self.assertTrue('eval' in on_described.ops)
+
+		closed = threading.Event()
+		self.session.close(lambda s, id_: closed.set())
+		self.assertTrue(closed.wait(5))
+
+
+class ChannelUriTests(unittest.TestCase):
+	"""End-to-end tests of the channels create_bcode_session_container picks by uri"""
+
+	def eval_over(self, uri):
+		container = create_bcode_session_container(uri)
+		try:
+			ready = threading.Event()
+			sessions = []
+			container.create_new_session(lambda s: (sessions.append(s), ready.set()))
+			self.assertTrue(ready.wait(5))
+
+			done = threading.Event()
+			values = []
+			sessions[0].eval('(+ 1 2)', value=lambda s, id_, v: values.append(v),
+				done=lambda s, id_: done.set())
+			self.assertTrue(done.wait(5))
+			self.assertEquals(['(+ 1 2)'], values)
+		finally:
+			stop_bcode_over_tcp_session_container(container)
+
+	def test_tcp(self):
+		server = StandinNrepl().start()
+		try:
+			self.eval_over('tcp://{0}:{1}'.format(*server.address))
+		finally:
+			server.stop()
+
+	def test_unix(self):
+		path = os.path.join(tempfile.mkdtemp(), 'nrepl.sock')
+		server = StandinNrepl(path=path).start()
+		try:
+			self.eval_over('unix://' + path)
+		finally:
+			server.stop()
+		self.assertFalse(os.path.exists(path))
+		os.rmdir(os.path.dirname(path))
+
+	def test_inproc(self):
+		server = StandinNrepl().listen_inproc('standin-test').start()
+		try:
+			self.eval_over('inproc://standin-test')
+		finally:
+			server.stop()
+
+	def test_unsupported(self):
+		self.assertRaises(ValueError, create_bcode_session_container, 'http://localhost:80')
+
+
+if __name__ == "__main__":
+	unittest.main()
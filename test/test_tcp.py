@@ -0,0 +1,286 @@
+import unittest
+import logging
+import socket
+import threading
+import time
+import Queue
+
+
+from pyjurer.channels.tcp import socketThreadMain, _ReceiveBuffer, Tcp, TCP_SHRINK_AFTER
+
+mockLogger = logging.getLogger(__name__ + 'mocks')
+
+
+class MockSocket:
+
+	def __init__(self, recvs):
+		'''recvs => list of items. items must be either strings or the value True.
+		When True is read, a Queue.Empty will be raised
+
+		sends => similarly a list of items. items must be strings or the Value True.
+		When True is encountered, a Queue.Empty is raised'''
+		self._recvs = recvs
+		self._sends = []
+		self._closeCalled = False
+
+	def send(self, bs):
+		mockLogger.debug("Mock socket sending something: '{0}'".format(bs))
+		self._sends.append(bs)
+		return len(bs)
+
+	def recv(self, i):
+		if len(self._recvs) == 0:
+			mockLogger.debug("MockSocket raising timeout")
+			raise socket.timeout
+
+		res = self._recvs.pop(0)
+
+		if res == None:
+			mockLogger.debug("MockSocket raising timeout")
+			raise socket.timeout
+
+		mockLogger.debug("Mocket socket recv'ing something: '{0}'".format(res))
+		return res
+
+	def close(self):
+		self._closeCalled = True
+
+
+class MockQueue:
+
+	def __init__(self, gets, putsAllows):
+		'''gets => a list of things that will be read. Must be either a None or 
+		python item. For every None a Queue.Empty will be raised
+
+		putsAllows => an item corresponding to every puts invocation. True
+		accepts the put and False raises an Queue.Full'''
+		self._gets = gets
+		self._puts = []
+		self._putsAllows = putsAllows
+
+	def get_nowait(self):
+		res = self._gets.pop(0)
+		if res == None:
+			mockLogger.debug('MockQueue raising Queue.Empty')
+			raise Queue.Empty
+		mockLogger.debug("MockQueue getting '{0}'".format(res))
+		return res
+
+	def empty(self):
+		return len(self._gets) == 0 or self._gets[0] == None
+
+	def put_nowait(self, received):
+		allow = self._putsAllows.pop(0)
+		if allow:
+			mockLogger.debug("MockQueue putting: '{0}'".format(received))
+			self._puts.append(received)
+		else:
+			mockLogger.debug("MockQueue refusing to put, raising Queue.Full")
+			raise Queue.Full
+
+
+class TcpTests(unittest.TestCase):
+	"""Unit tests for the Tcp channel's thread methods"""
+
+	def test_thread_read_1(self):
+		socketReceives = ['1234']
+		isocket = MockSocket(socketReceives)
+
+		sendQueue = MockQueue(
+			[
+				None,  
+				{'type': 'message', 'contents': 'aoeu'},
+				None,
+				{'type': 'control', 'op': 'stop'}
+			], 
+			None)
+		receiveQueue = MockQueue(None, [True])
+
+		socketThreadMain(isocket, sendQueue, receiveQueue)
+
+		self.assertTrue(isocket._closeCalled)
+		self.assertEquals('1234', receiveQueue._puts.pop())
+		self.assertEquals(1, len(isocket._sends))
+		self.assertEquals('aoeu', isocket._sends[0])
+
+
+class ReceiveBufferTests(unittest.TestCase):
+	"""Unit tests for the buffer the Tcp channel reads into"""
+
+	def setUp(self):
+		self.reader, self.writer = socket.socketpair()
+
+	def tearDown(self):
+		self.reader.close()
+		self.writer.close()
+
+	def test_grows_while_reads_fill_it(self):
+		buffer = _ReceiveBuffer(size=16, maxSize=64)
+		self.writer.sendall('a' * 16 + 'b' * 32 + 'c' * 100)
+		self.assertEquals('a' * 16, buffer.read(self.reader))
+		self.assertEquals(32, buffer.size)
+		self.assertEquals('b' * 32, buffer.read(self.reader))
+		self.assertEquals(64, buffer.size)
+		self.assertEquals('c' * 64, buffer.read(self.reader))
+		self.assertEquals(64, buffer.size)
+
+	def test_shrinks_after_small_reads(self):
+		buffer = _ReceiveBuffer(size=16, maxSize=64)
+		self.writer.sendall('a' * 16 + 'b' * 32)
+		buffer.read(self.reader)
+		buffer.read(self.reader)
+		self.assertEquals(64, buffer.size)
+		for i in range(TCP_SHRINK_AFTER):
+			self.writer.sendall('x')
+			self.assertEquals('x', buffer.read(self.reader))
+		self.assertEquals(32, buffer.size)
+
+	def test_falls_back_to_recv(self):
+		buffer = _ReceiveBuffer(size=4)
+		self.assertEquals('1234', buffer.read(MockSocket(['1234'])))
+		self.assertEquals(8, buffer.size)
+
+
+class TcpOptionsTests(unittest.TestCase):
+	"""Tests for the socket options of the Tcp channel"""
+
+	def setUp(self):
+		self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.listener.bind(('127.0.0.1', 0))
+		self.listener.listen(1)
+
+	def tearDown(self):
+		self.listener.close()
+
+	def options(self, **kwargs):
+		tcp = Tcp(*self.listener.getsockname(), **kwargs)
+		tcp.start()
+		try:
+			return (tcp._socket.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY),
+				tcp._socket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF))
+		finally:
+			tcp.stop()
+
+	def test_nodelay_by_default(self):
+		self.assertNotEquals(0, self.options()[0])
+		self.assertEquals(0, self.options(nodelay=False)[0])
+
+	def test_buffer_sizes(self):
+		# linux doubles the size that is asked for
+		self.assertTrue(self.options(sendBufferSize=65536)[1] >= 65536)
+
+
+class ConnectAndStopTests(unittest.TestCase):
+	"""Tests of how long connecting and stopping the Tcp channel take"""
+
+	def setUp(self):
+		self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.listener.bind(('127.0.0.1', 0))
+		self.listener.listen(1)
+
+	def tearDown(self):
+		self.listener.close()
+
+	def check_stop_is_immediate(self, **options):
+		tcp = Tcp(*self.listener.getsockname(), **options)
+		started = time.time()
+		tcp.start()
+		connected = time.time()
+		tcp.stop()
+		stopped = time.time()
+		# both are woken up rather than polled, and take a couple of ms
+		self.assertTrue(connected - started < 0.05, 'connect took {0:.3f} s'.format(connected - started))
+		self.assertTrue(stopped - connected < 0.05, 'stop took {0:.3f} s'.format(stopped - connected))
+
+	def test_stop_is_immediate(self):
+		self.check_stop_is_immediate()
+
+	def test_stop_is_immediate_with_a_reactor(self):
+		self.check_stop_is_immediate(reactor=True)
+
+	def test_connect_times_out(self):
+		# a listener whose backlog is full drops the syns of new connects,
+		# like a host that is down
+		listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		listener.bind(('127.0.0.1', 0))
+		listener.listen(0)
+		backlog = socket.create_connection(listener.getsockname())
+		try:
+			tcp = Tcp(*listener.getsockname(), connectTimeout=0.2)
+			started = time.time()
+			self.assertRaises(socket.timeout, tcp.start)
+			self.assertTrue(time.time() - started < 1)
+		finally:
+			backlog.close()
+			listener.close()
+
+	def check_closed_by_the_other_side(self, **options):
+		received = Queue.Queue()
+		tcp = Tcp(*self.listener.getsockname(), dataReceivedCallback=received.put, **options)
+		tcp.start()
+		server, address = self.listener.accept()
+		server.sendall('abc')
+		server.close()
+		self.assertEqual('abc', received.get(True, 1))
+		self.assertEqual('', received.get(True, 1))
+		if options.get('reactor') is None:
+			tcp._socketThread.join(1)
+			self.assertFalse(tcp._socketThread.isAlive())
+		tcp.stop()
+
+	def test_closed_by_the_other_side(self):
+		self.check_closed_by_the_other_side()
+
+	def test_closed_by_the_other_side_with_a_reactor(self):
+		self.check_closed_by_the_other_side(reactor=True)
+
+	def test_stop_after_a_failed_start(self):
+		# a port nothing listens on any more
+		closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		closed.bind(('127.0.0.1', 0))
+		address = closed.getsockname()
+		closed.close()
+
+		tcp = Tcp(*address)
+		self.assertRaises(socket.error, tcp.start)
+		tcp.stop()
+
+	def test_stop_flushes(self):
+		tcp = Tcp(*self.listener.getsockname())
+		tcp.start()
+		server, address = self.listener.accept()
+		received = []
+		def read():
+			while True:
+				data = server.recv(65536)
+				if not data:
+					break
+				received.append(len(data))
+		reader = threading.Thread(target=read)
+		reader.start()
+
+		part = 'x' * 65536
+		for i in range(64):
+			tcp.send(part)
+		tcp.stop()
+		reader.join(5)
+		server.close()
+		self.assertEquals(64 * 65536, sum(received))
+
+	def test_stop_without_flushing(self):
+		tcp = Tcp(*self.listener.getsockname(), sendBufferSize=4096)
+		tcp.start()
+		# the other side never reads, so only what fits in the buffers is sent
+		server, address = self.listener.accept()
+		part = 'x' * 65536
+		for i in range(256):
+			tcp.send(part)
+		started = time.time()
+		tcp.stop(flush=False, timeout=0.2)
+		self.assertTrue(time.time() - started < 1)
+		self.assertTrue(tcp._socketSendQueue.empty())
+		server.close()
+
+
+if __name__ == "__main__":
+	unittest.main()